@@ -1,9 +1,15 @@
 import json
 from datetime import datetime
 import ee
+import numpy as np
 from Methods_cloud_masking  import download
 import os
 import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Cloud_masking', 'Local_methods'))
+from local_utils import iterWindows, coreWindow, createOutputRaster
 
 RASTER_NAME = "raster"
 
@@ -66,11 +72,51 @@ class LocalImage:
     def readBands(self):
         """
         Read the image as a np.array in format (rows,cols,channels)
+        (memory mapped: use iterTiles to bound the memory used)
 
         :return: np.ndarray with image in format (rows,cols,channels)
         """
         return self.memmap
 
+    def iterTiles(self, block_size=512, halo=0):
+        """
+        Iterate over the image by square tiles: only one tile is read at a time.
+
+        :param block_size: tile size (pixels)
+        :param halo: number of pixels added around each tile (neighbourhood
+                     operations, ex: 2 * radius for a morphological opening:
+                     erosion + dilation)
+        :return: generator of (window, inner, tile): window = tile with halo
+                 (slices in the image), inner = tile without halo (slices in
+                 the window), tile = np.ndarray (rows, cols, channels) of the window
+        """
+        for window, inner in iterWindows(self.nrows, self.ncols, block_size, halo):
+            yield window, inner, np.asarray(self.memmap[window])
+
+    def processTiles(self, function, output_tiff, block_size=512, halo=0,
+                     dtype=np.uint8, nbands=None):
+        """
+        Apply a function tile by tile, the results are written in a memory mapped
+        raster: the peak memory only depends on the tile size.
+
+        :param function: function(tile) -> np.ndarray (rows, cols) or (rows, cols, bands)
+                         of the tile with halo
+        :param output_tiff: path to the output tif file
+        :param block_size: tile size (pixels)
+        :param halo: number of pixels added around each tile (2 * radius for an opening)
+        :param dtype: data type of the output raster
+        :param nbands: number of bands of the output raster (None: one band, 2D raster)
+        :return: np.memmap of the output raster
+        """
+        shape = (self.nrows, self.ncols) if nbands is None else (self.nrows, self.ncols, nbands)
+        output = createOutputRaster(output_tiff, shape, dtype)
+
+        for window, inner, tile in self.iterTiles(block_size, halo):
+            output[coreWindow(window, inner)] = function(tile)[inner]
+
+        output.flush()
+        return output
+
     def bandNames(self):
         """
         Return name of the bands
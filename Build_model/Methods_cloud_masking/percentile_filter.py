@@ -6,8 +6,15 @@ Created on May 18, 2016
 
 """
 import ee
+import numpy as np
+import os
+import sys
 from Methods_cloud_masking.parameters import SENTINEL2_BANDNAMES
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Cloud_masking', 'Local_methods'))
+from local_utils import iterWindows, percentileStack, allocate
+
 
 class PercentileFilter:
     """Simple class which implements a simple percentile filter"""
@@ -26,11 +33,7 @@ class PercentileFilter:
         """Given an imgCollection, it computes the percentile and the mean absolute deviation from 
            such percentile filtering values defined by self.filter_percentiles """
         bandsImgCollection = imgCollection.select(self.bands)
-        percentiles_compute = [self.percentile];
-        if self.filter_percentiles[0] > 0:
-            percentiles_compute.append(self.filter_percentiles[0])
-        if self.filter_percentiles[1] < 100:
-            percentiles_compute.append(self.filter_percentiles[1])
+        percentiles_compute = self._percentiles_compute()
 
         # Compute the percentiles
         percentiles_image = bandsImgCollection.reduce(ee.Reducer.percentile(percentiles_compute))
@@ -64,6 +67,76 @@ class PercentileFilter:
         # Reduce imgCollection to img and we keep X_dev on sd_from_percentile_image field of the object
         self.sd_from_percentile_image = squared_diferences_collection.mean()
 
+    def _percentiles_compute(self):
+        percentiles_compute = [self.percentile]
+        if self.filter_percentiles[0] > 0:
+            percentiles_compute.append(self.filter_percentiles[0])
+        if self.filter_percentiles[1] < 100:
+            percentiles_compute.append(self.filter_percentiles[1])
+        return percentiles_compute
+
+    def train_local(self, images, block_size=512):
+        """Same as train on local images (list of LocalImage, see local_image.py). The images
+           are read by blocks and all the percentiles are computed in one pass with a partition
+           based reducer on the uint16 values (0: masked pixel, ignored). The arrays of the
+           granule are stored in LOCAL_SCRATCH_DIR if defined (see local_utils.allocate)"""
+        indexes = [[image.bandNames().index(band) for band in self.bands] for image in images]
+        nrows, ncols = images[0].nrows, images[0].ncols
+        percentiles_compute = self._percentiles_compute()
+
+        self.percentile_array = allocate((nrows, ncols, len(self.bands)), np.float32)
+        self.sd_from_percentile_array = allocate((nrows, ncols, len(self.bands)), np.float32)
+
+        for window, _ in iterWindows(nrows, ncols, block_size):
+            stack = np.stack([np.asarray(image.memmap[window])[..., index]
+                              for image, index in zip(images, indexes)])
+            percentiles = percentileStack(stack, percentiles_compute)
+            self.percentile_array[window] = percentiles[0]
+
+            # Residuals, 0 if the values are >high_percentile or < low_percentile
+            resta = np.abs(stack.astype(np.float32) - percentiles[0])
+            k = 1
+            if self.filter_percentiles[0] > 0:
+                resta[stack < percentiles[k]] = 0
+                k += 1
+            if self.filter_percentiles[1] < 100:
+                resta[stack > percentiles[k]] = 0
+
+            # Mean over the valid (not masked) values
+            valid = stack != 0
+            resta[~valid] = 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.sd_from_percentile_array[window] = resta.sum(axis=0) / valid.sum(axis=0)
+
+    def predict_local(self, image, apply_threshold=True, cloud_and_shadows=False, block_size=512):
+        """Same as predict on a local image (LocalImage), after train_local
+           (output stored in LOCAL_SCRATCH_DIR if defined)"""
+        if getattr(self, "percentile_array", None) is None:
+            raise AssertionError("Model has not been trained. Call train_local function before predict_local")
+
+        index = [image.bandNames().index(band) for band in self.bands]
+        dtype = np.uint16 if cloud_and_shadows else (bool if apply_threshold else np.float32)
+        output = allocate((image.nrows, image.ncols), dtype)
+
+        for window, _, tile in image.iterTiles(block_size):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                image_normalized = (tile[..., index].astype(np.float32) - self.percentile_array[window]) \
+                                   / self.sd_from_percentile_array[window]
+                single_band_image_residuals = np.sqrt((image_normalized ** 2).mean(axis=-1))
+                if not apply_threshold:
+                    output[window] = single_band_image_residuals
+                    continue
+
+                mask_cloud_and_shadows = single_band_image_residuals > self.threshold
+                if cloud_and_shadows:
+                    signed_mean_positive = image_normalized.mean(axis=-1) > 0
+                    mask = mask_cloud_and_shadows.astype(np.uint16)
+                    mask[signed_mean_positive & mask_cloud_and_shadows] = 2
+                    mask_cloud_and_shadows = mask
+            output[window] = mask_cloud_and_shadows
+
+        return output
+
     def predict(self, image, apply_threshold=True, cloud_and_shadows=False):
         """Given an image, it returns a mask image with 1 for potentially cloudy pixels. 
         If cloud_and_shadows flag is true returns 1 for shadows 2 for clouds """
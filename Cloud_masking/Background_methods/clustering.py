@@ -145,37 +145,127 @@ def ClusterClouds(image,
                                                                 )
 
     else:
-        arrayImageDiff = img_differences.select(bands_thresholds).toArray()
-        arrayImage = image.select(bands_thresholds).toArray()
-
-        arrayImageDiffmean = arrayImageDiff.arrayReduce(ee.Reducer.mean(), axes=[0])\
-                                           .gte(0).arrayGet([0])
-        arrayImageDiffnorm = arrayImageDiff.multiply(arrayImageDiff)\
-                                           .arrayReduce(ee.Reducer.mean(), axes=[0])\
-                                           .sqrt().arrayGet([0])
-
-        arrayImagenorm = arrayImage.multiply(arrayImage) \
-                                   .arrayReduce(ee.Reducer.mean(), axes=[0])\
-                                   .sqrt().arrayGet([0]) \
-
-        reflectance_score = arrayImagenorm
-
-        multitemporal_score = arrayImageDiffnorm.multiply(arrayImageDiffmean)
+        multitemporal_score, reflectance_score = _PixelScores(image, img_differences, bands_thresholds)
 
     # Apply thresholds
-    if threshold_reflectance <= 0:
-        cloud_score_threshold = multitemporal_score.gt(threshold_dif_cloud)
-    else:
-        cloud_score_threshold = multitemporal_score.gt(threshold_dif_cloud)\
-                                                   .multiply(reflectance_score.gt(threshold_reflectance))
+    cloud_score_threshold = _ApplyThresholds(multitemporal_score, reflectance_score,
+                                             threshold_dif_cloud, threshold_reflectance)
 
     # apply opening
-    kernel = ee.Kernel.circle(radius=growing_ratio)
-    cloud_score_threshold = cloud_score_threshold.focal_min(kernel=kernel) \
-                                                .focal_max(kernel=kernel)
+    cloud_score_threshold = _Opening(cloud_score_threshold, growing_ratio)
 
     # Rename band name
     if band_name:
         cloud_score_threshold = cloud_score_threshold.select(
             [cloud_score_threshold.bandNames().get(0)], [band_name])
     return cloud_score_threshold
+
+
+def ClusterCloudsCombined(image,
+                          background_predictions,
+                          threshold_dif_cloud=.045,
+                          do_clustering=True, numPixels=1000,
+                          threshold_reflectance=.175,
+                          bands_thresholds=["B2", "B3", "B4"],
+                          growing_ratio=2,
+                          n_clusters=10, region_of_interest=None,
+                          tileScale=PARAMS_CLOUDCLUSTERSCORE_DEFAULT['tileScale'],
+                          band_names=None):
+    """ ClusterClouds of several background predictions of the same image
+        (percentile 1 and 5 methods): the differences are sampled once (same pixels
+        for all the predictions), the normalisation statistics are computed with
+        one reducer and the opening is applied once to all the bands.
+        The pixels masked in one of the predictions are not sampled.
+    Arguments
+        :param image: 
+        :param background_predictions: list of ee.Image (forecast bands)
+        :param band_names=None: output band names (one per prediction)
+        :param others: see ClusterClouds
+        :return: ee.Image with one band per prediction, 0 for clear pixels, 1 for cloudy pixels
+    """
+    differences = [image.subtract(background_prediction).select(BANDS_MODEL)
+                   for background_prediction in background_predictions]
+    bands_differences = [[band + "_" + str(k) for band in BANDS_MODEL] for k in range(len(differences))]
+
+    if do_clustering:
+        img_differences = ee.Image.cat([diff.select(BANDS_MODEL, bands)
+                                        for diff, bands in zip(differences, bands_differences)])
+        training = img_differences.sample(region=region_of_interest,
+                                          scale=30, numPixels=numPixels,
+                                          tileScale=tileScale
+                                          )
+
+        # Normalisation statistics of all the predictions (one reducer)
+        all_bands = [band for bands in bands_differences for band in bands]
+        training, mean, std = normalization.ComputeNormalizationFeatureCollection(training,
+                                                                                  all_bands)
+
+    cloud_scores = []
+    for k, background_prediction in enumerate(background_predictions):
+        if do_clustering:
+            clusterer = ee.Clusterer.wekaKMeans(n_clusters) \
+                                    .train(training.select(bands_differences[k], BANDS_MODEL))
+
+            img_differences_normalized = normalization.ApplyNormalizationImage(
+                img_differences.select(bands_differences[k]), bands_differences[k], mean, std) \
+                .select(bands_differences[k], BANDS_MODEL)
+            result = img_differences_normalized.cluster(clusterer)
+
+            multitemporal_score, reflectance_score = SelectClusters(image, background_prediction,
+                                                                    result, n_clusters, bands_thresholds,
+                                                                    region_of_interest,
+                                                                    tileScale=tileScale
+                                                                    )
+        else:
+            multitemporal_score, reflectance_score = _PixelScores(image, differences[k], bands_thresholds)
+
+        cloud_scores.append(_ApplyThresholds(multitemporal_score, reflectance_score,
+                                             threshold_dif_cloud, threshold_reflectance)
+                            .rename("cloud_score_" + str(k)))
+
+    # One opening for all the predictions
+    cloud_score_threshold = _Opening(ee.Image.cat(cloud_scores), growing_ratio)
+
+    # Rename band names
+    if band_names:
+        cloud_score_threshold = cloud_score_threshold.rename(band_names)
+    return cloud_score_threshold
+
+
+def _PixelScores(image, img_differences, bands_thresholds):
+    """ Multitemporal and reflectance scores of each pixel (no clustering)
+    """
+    arrayImageDiff = img_differences.select(bands_thresholds).toArray()
+    arrayImage = image.select(bands_thresholds).toArray()
+
+    arrayImageDiffmean = arrayImageDiff.arrayReduce(ee.Reducer.mean(), axes=[0])\
+                                       .gte(0).arrayGet([0])
+    arrayImageDiffnorm = arrayImageDiff.multiply(arrayImageDiff)\
+                                       .arrayReduce(ee.Reducer.mean(), axes=[0])\
+                                       .sqrt().arrayGet([0])
+
+    arrayImagenorm = arrayImage.multiply(arrayImage) \
+                               .arrayReduce(ee.Reducer.mean(), axes=[0])\
+                               .sqrt().arrayGet([0])
+
+    reflectance_score = arrayImagenorm
+
+    multitemporal_score = arrayImageDiffnorm.multiply(arrayImageDiffmean)
+    return multitemporal_score, reflectance_score
+
+
+def _ApplyThresholds(multitemporal_score, reflectance_score, threshold_dif_cloud, threshold_reflectance):
+    """ Cloud pixels: multitemporal score (and reflectance score) over the thresholds
+    """
+    if threshold_reflectance <= 0:
+        return multitemporal_score.gt(threshold_dif_cloud)
+    return multitemporal_score.gt(threshold_dif_cloud)\
+                              .multiply(reflectance_score.gt(threshold_reflectance))
+
+
+def _Opening(cloud_score_threshold, growing_ratio):
+    """ Opening (erosion + dilation) of every band
+    """
+    kernel = ee.Kernel.circle(radius=growing_ratio)
+    return cloud_score_threshold.focal_min(kernel=kernel) \
+                                .focal_max(kernel=kernel)
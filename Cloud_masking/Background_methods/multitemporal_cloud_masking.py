@@ -7,14 +7,20 @@
 #   - SelectBackgroundImages(sentinel_img,          #
 #                            number_of_images,      #
 #                            number_preselect,      #
-#                            region_of_interest)    #
+#                            region_of_interest,    #
+#                            background_ids)        #
+#   - countValid(region_of_interest)                #
 #   - SelectImagesTraining(sentinel_img,            #
 #                          imgColl,                 #
 #                          number_of_images)        #
+#   - BackgroundMedians(imgColl_p1, imgColl_p5)     #
 #   - CloudClusterScore(img,                        #
 #                       region_of_interest,         #
 #                       number_of_images            #
-#                       number_preselect)           #
+#                       number_preselect,           #
+#                       clip_land,                  #
+#                       background_ids,             #
+#                       combined)                   #
 #   - filter_partial_tiles(images_background,       #
 #                          image,                   #
 #                          region_of_interest)      #
@@ -30,7 +36,7 @@ sys.path.append(os.path.join(BASE_DIR, '..'))
 import parameters
 from utils import GenerateBandNames
 from background_methods import method1, method5
-from clustering import ClusterClouds
+from clustering import ClusterClouds, ClusterCloudsCombined
 
 
 def filter_partial_tiles(images_background, image, region_of_interest):
@@ -55,7 +61,7 @@ def filter_partial_tiles(images_background, image, region_of_interest):
 
 
 def SelectBackgroundImages(sentinel_img, number_of_images,
-                            number_preselect, region_of_interest):
+                            number_preselect, region_of_interest, background_ids=None):
     """ Return the NUMBER_IMAGES previous images with cloud cover for 
         percentile 1 and 5 methods
 
@@ -64,8 +70,38 @@ def SelectBackgroundImages(sentinel_img, number_of_images,
         :param number_of_images: 
         :param number_preselect: 
         :param region_of_interest: 
+        :param background_ids=None: candidates already selected (method1, method5, valids),
+                                    see Utils/utils_scene_index.py. None: selected on GEE side.
+                                    valids (ratios of valid pixels) not None: the lists are
+                                    already sorted by valids and limited
     """
+    if background_ids is not None:
+        # Fixed lists of images: no filter / sort of the whole collection
+        ids_p1, ids_p5, valids = background_ids
+        if valids is not None:
+            # Ratios of valid pixels precomputed (candidate cache): no reduceRegion
+            imgColl_percentile1 = ee.ImageCollection([ee.Image("COPERNICUS/S2/" + name).set("valids", valids[name])
+                                                      for name in ids_p1])
+            imgColl_percentile5 = ee.ImageCollection([ee.Image("COPERNICUS/S2/" + name).set("valids", valids[name])
+                                                      for name in ids_p5])
+            return imgColl_percentile1, imgColl_percentile5
+        imgColl_percentile1 = ee.ImageCollection([ee.Image("COPERNICUS/S2/" + name) for name in ids_p1])
+        imgColl_percentile5 = ee.ImageCollection([ee.Image("COPERNICUS/S2/" + name) for name in ids_p5])
+    else:
+        imgColl_percentile1, imgColl_percentile5 = _selectNeighbours(sentinel_img, number_of_images,
+                                                                     number_preselect, region_of_interest)
 
+    # Get rid of images with many invalid values
+    _count_valid = countValid(region_of_interest)
+    imgColl_percentile1 = imgColl_percentile1.map(_count_valid).sort("valids").limit(number_of_images)
+    imgColl_percentile5 = imgColl_percentile5.map(_count_valid).sort("valids").limit(number_of_images)
+
+    return imgColl_percentile1, imgColl_percentile5
+
+
+def _selectNeighbours(sentinel_img, number_of_images, number_preselect, region_of_interest):
+    """ Background candidates of the methods percentile 1 and 5 selected on GEE side
+    """
     # Retrieve Sentinel Collection:
     #   - filter by area of interest 
     #   - filter by Tile
@@ -93,8 +129,15 @@ def SelectBackgroundImages(sentinel_img, number_of_images,
                                   dataset_date_asc, dataset_date_desc)
     imgColl_percentile5 = method5(sentinel_img, number_of_images,
                                   number_preselect, dataset_date_asc, dataset_date_desc)
+    return imgColl_percentile1, imgColl_percentile5
 
-    # Get rid of images with many invalid values
+
+def countValid(region_of_interest):
+    """ Return the function adding the ratio of valid pixels ("valids")
+    Arguments:
+        :param region_of_interest: ee.Geometry
+        :return: function(ee.Image) -> ee.Image
+    """
     def _count_valid(img):
         mascara = img.mask()
         mascara = mascara.select(parameters.SENTINEL2_BANDNAMES)
@@ -106,11 +149,7 @@ def SelectBackgroundImages(sentinel_img, number_of_images,
 
         img = img.set("valids", dictio.get("all"))
         return img
-
-    imgColl_percentile1 = imgColl_percentile1.map(_count_valid).sort("valids").limit(number_of_images)
-    imgColl_percentile5 = imgColl_percentile5.map(_count_valid).sort("valids").limit(number_of_images)
-    
-    return imgColl_percentile1, imgColl_percentile5
+    return _count_valid
 
 
 def SelectImagesTraining(sentinel_img, imgColl, number_of_images):
@@ -144,9 +183,51 @@ def SelectImagesTraining(sentinel_img, imgColl, number_of_images):
     return sentinel_img
 
 
+def BackgroundMedians(imgColl_p1, imgColl_p5):
+    """ Median of the background images of the percentile 1 and 5 methods
+        with one reduction over the union of the candidates: each image is loaded
+        once, its bands are duplicated ("_p1" / "_p5") and masked when the image
+        doesn't belong to the method.
+    Arguments:
+        :param imgColl_p1: ee.ImageCollection, background of the method percentile 1
+        :param imgColl_p5: ee.ImageCollection, background of the method percentile 5
+        :return: two ee.Image (forecast bands) for the 2 methods
+    """
+    bands = parameters.SENTINEL2_BANDNAMES
+    bands_p1 = [i + "_p1" for i in bands]
+    bands_p5 = [i + "_p5" for i in bands]
+    ids_p1 = imgColl_p1.aggregate_array("system:index")
+    ids_p5 = imgColl_p5.aggregate_array("system:index")
+
+    def stack(in_p1, in_p5):
+        def _stack(image):
+            image = ee.Image(image)
+            return image.select(bands, bands_p1).updateMask(ee.Image.constant(in_p1(image))) \
+                        .addBands(image.select(bands, bands_p5).updateMask(ee.Image.constant(in_p5(image))))
+        return _stack
+
+    def is_in(ids):
+        return lambda image: ee.Number(ee.Algorithms.If(ids.contains(image.get("system:index")), 1, 0))
+
+    # Union: images of the method 1 (also in the method 5 or not) + images only in the method 5
+    union = imgColl_p1.map(stack(lambda image: 1, is_in(ids_p5))) \
+                      .merge(imgColl_p5.filter(ee.Filter.inList("system:index", ids_p1).Not())
+                                       .map(stack(lambda image: 0, lambda image: 1)))
+
+    medians = union.reduce(reducer=ee.Reducer.percentile(percentiles=[50]))
+
+    forecast_bands_sentinel2 = [i + "_forecast" for i in bands]
+    img_forecast_p1 = medians.select([i + "_p50" for i in bands_p1], forecast_bands_sentinel2)
+    img_forecast_p5 = medians.select([i + "_p50" for i in bands_p5], forecast_bands_sentinel2)
+    return img_forecast_p1, img_forecast_p5
+
+
 def CloudClusterScore(img, region_of_interest,
                       number_of_images=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images'],
-                      number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']
+                      number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect'],
+                      clip_land=True,
+                      background_ids=None,
+                      combined=None
                       ):
     """  Get the cloud cluster score the percentile methods 1 & 5
     Params are defined in parameters.py file
@@ -155,8 +236,15 @@ def CloudClusterScore(img, region_of_interest,
         :param region_of_interest: 
         :param number_of_images=PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images']: 
         :param number_preselect=PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']: 
+        :param clip_land=True: clip to the land geometry (False if the image
+                               is fully inside land: the clip is a no-op)
+        :param background_ids=None: background candidates already selected (method1, method5, valids),
+                                    see Utils/utils_scene_index.py
+        :param combined=parameters.COMBINED_BACKGROUND: one background pipeline for the
+                                    2 methods (see BackgroundMedians and ClusterCloudsCombined)
         :return:  cloud mask (1: cloud, 0: clear)
     """
+    if combined is None: combined = parameters.COMBINED_BACKGROUND
 
     params = parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT
 
@@ -167,7 +255,31 @@ def CloudClusterScore(img, region_of_interest,
     imgColl_p1, imgColl_p5 = SelectBackgroundImages(img,
                                      number_of_images,
                                      number_preselect,
-                                     region_of_interest)
+                                     region_of_interest,
+                                     background_ids)
+
+    # Clip to land area
+    land_geometry = ee.FeatureCollection(parameters.land_geometry)
+
+    if combined:
+        # Union of the candidates: both medians with one reduction,
+        # shared sampling / normalisation / opening
+        img_forecast_p1, img_forecast_p5 = BackgroundMedians(imgColl_p1, imgColl_p5)
+        clusterscores = ClusterCloudsCombined(img.select(parameters.SENTINEL2_BANDNAMES),
+                                              [img_forecast_p1, img_forecast_p5],
+                                              region_of_interest=region_of_interest,
+                                              threshold_dif_cloud=params["threshold_dif_cloud"],
+                                              do_clustering=params["do_clustering"],
+                                              threshold_reflectance=params["threshold_reflectance"],
+                                              numPixels=params["numPixels"],
+                                              bands_thresholds=params["bands_thresholds"],
+                                              growing_ratio=params["growing_ratio"],
+                                              n_clusters=params["n_clusters"],
+                                              band_names=["percentile1", "percentile5"]) \
+                                        .gte(parameters.CUTTOF)
+        if clip_land:
+            clusterscores = clusterscores.clip(land_geometry)
+        return clusterscores.select("percentile1"), clusterscores.select("percentile5")
 
     # Summarize BackGround images in one band
     image_with_lags_p1 = SelectImagesTraining(img, imgColl_p1, number_of_images)
@@ -187,9 +299,6 @@ def CloudClusterScore(img, region_of_interest,
     img_forecast_p5 = img_percentile5.select(reflectance_bands_sentinel2_perc50,
                                             forecast_bands_sentinel2)
 
-    # Clip to land area
-    land_geometry = ee.FeatureCollection(parameters.land_geometry)
-
     clusterscore_percentile1 = ClusterClouds(image_with_lags_p1.select(parameters.SENTINEL2_BANDNAMES),
                                         img_forecast_p1.select(forecast_bands_sentinel2),
                                         region_of_interest=region_of_interest,
@@ -201,8 +310,7 @@ def CloudClusterScore(img, region_of_interest,
                                         growing_ratio=params["growing_ratio"],
                                         n_clusters = params["n_clusters"],
                                         band_name="percentile1") \
-                                    .gte(parameters.CUTTOF)    \
-                                    .clip(land_geometry)
+                                    .gte(parameters.CUTTOF)
 
     clusterscore_percentile5 = ClusterClouds(image_with_lags_p5.select(parameters.SENTINEL2_BANDNAMES),
                                         img_forecast_p5.select(forecast_bands_sentinel2),
@@ -215,8 +323,11 @@ def CloudClusterScore(img, region_of_interest,
                                         growing_ratio=params["growing_ratio"],
                                         n_clusters = params["n_clusters"],
                                         band_name="percentile5") \
-                                    .gte(parameters.CUTTOF)    \
-                                    .clip(land_geometry)
+                                    .gte(parameters.CUTTOF)
+
+    if clip_land:
+        clusterscore_percentile1 = clusterscore_percentile1.clip(land_geometry)
+        clusterscore_percentile5 = clusterscore_percentile5.clip(land_geometry)
     
     return clusterscore_percentile1, clusterscore_percentile5
 
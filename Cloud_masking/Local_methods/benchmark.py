@@ -0,0 +1,295 @@
+#####################################################
+# Benchmark of the local cloud masking engine       #
+#                                                   #
+# Run each stage of the local model on synthetic    #
+# Sentinel 2 stacks: no data or GEE account needed. #
+#                                                   #
+# Methods:                                          #
+#   - syntheticScene(nrows, ncols, bands,           #
+#                    cloud_fraction, time_start,    #
+#                    rng)                           #
+#   - syntheticStack(nrows, ncols, depth, nb_bands, #
+#                    cloud_fraction, seed)          #
+#   - syntheticArtifact(features, numberOfTrees,    #
+#                       max_depth, seed)            #
+#   - run_benchmark(size, depths, nb_bands,         #
+#                   cloud_fraction, block_size,     #
+#                   numberOfTrees, seed,            #
+#                   output_json)                    #
+#                                                   #
+# Stages timed (both percentile methods):           #
+#   - tree_masks: tree2 / tree3 bitfield            #
+#   - background_selection: coverage + selection    #
+#   - background_median: median of the backgrounds  #
+#   - clustering: ClusterClouds (sampling, k-means, #
+#     labels; computes its own median forecast)     #
+#   - morphology: opening                           #
+#   - rf_inference: random forest votes             #
+# Each stage reports its time, pixels / second and  #
+# the peak RSS of the process after the stage.      #
+#                                                   #
+# Usage:                                            #
+#   python Cloud_masking/Local_methods/benchmark.py #
+#       [size] [output.json]                        #
+#####################################################
+
+import json                             # Write results
+import platform                         # Machine description
+import time                             # Measure time
+import os
+import sys
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+sys.path.append(os.path.join(BASE_DIR, '..', 'Utils'))
+
+import parameters
+from utils_classifier import predictArtifact
+from utils_fingerprint import MODEL_VERSION
+from local_utils import LocalScene, iterWindows, coreWindow
+from local_tree_methods import getTreeBitfield, bitfieldMask
+from local_background_methods import SelectBackgroundImages, forecastWindow
+from local_clustering import BANDS_MODEL, ClusterClouds, openingWindow
+
+# Time between two synthetic images (milliseconds, Sentinel 2 revisit)
+REVISIT = 5 * 24 * 3600000
+
+
+def _peak_rss():
+    """ Peak resident memory of the process (MB), None if not available (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: kilobytes, macOS: bytes
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def syntheticScene(nrows, ncols, bands, cloud_fraction, time_start, rng):
+    """ Synthetic Sentinel 2 scene: smooth surface + noise + bright clouds
+    Arguments:
+        :param nrows: number of rows
+        :param ncols: number of columns
+        :param bands: list of band names
+        :param cloud_fraction: ratio of cloudy pixels (0 to 1)
+        :param time_start: acquisition time (milliseconds)
+        :param rng: np.random.RandomState
+        :return: LocalScene (uint16 digital numbers)
+    """
+    nbands = len(bands)
+
+    # Surface: coarse random field (blocks of 32 pixels) + noise
+    coarse = rng.uniform(300, 2500, ((nrows + 31) // 32, (ncols + 31) // 32, nbands))
+    surface = np.repeat(np.repeat(coarse, 32, axis=0), 32, axis=1)[:nrows, :ncols]
+    data = surface + rng.normal(0, 50, (nrows, ncols, nbands))
+
+    # Clouds: coarse random field above its (1 - cloud_fraction) quantile
+    field = rng.uniform(size=((nrows + 15) // 16, (ncols + 15) // 16))
+    field = np.repeat(np.repeat(field, 16, axis=0), 16, axis=1)[:nrows, :ncols]
+    cloud = field > np.quantile(field, 1 - cloud_fraction) if cloud_fraction > 0 \
+            else np.zeros((nrows, ncols), dtype=bool)
+    data[cloud] = rng.uniform(5000, 9000, (cloud.sum(), nbands))
+
+    data = np.clip(data, 1, 10000).astype(np.uint16)
+    metadata = {"bands": bands,
+                "system:time_start": time_start,
+                "CLOUDY_PIXEL_PERCENTAGE": 100. * cloud.mean()}
+    return LocalScene(data, metadata)
+
+
+def syntheticStack(nrows, ncols, depth, nb_bands=None, cloud_fraction=0.3, seed=0):
+    """ Synthetic image + `depth` background candidates (previous dates)
+    Arguments:
+        :param nrows: number of rows
+        :param ncols: number of columns
+        :param depth: number of background candidates
+        :param nb_bands=len(SENTINEL2_BANDNAMES): number of bands (>= 13, extra bands
+                        are appended after the Sentinel 2 bands)
+        :param cloud_fraction=0.3: ratio of cloudy pixels of the image
+        :param seed=0: random seed
+        :return: LocalScene image, list of LocalScene (candidates)
+    """
+    bands = list(parameters.SENTINEL2_BANDNAMES)
+    if nb_bands is None: nb_bands = len(bands)
+    if nb_bands < len(BANDS_MODEL):
+        raise ValueError("The model requires at least {} bands".format(len(BANDS_MODEL)))
+    bands = bands[:nb_bands] + ["EXTRA{}".format(k) for k in range(nb_bands - len(bands))]
+
+    rng = np.random.RandomState(seed)
+    time_start = 1500000000000
+    image = syntheticScene(nrows, ncols, bands, cloud_fraction, time_start, rng)
+    # Backgrounds: less cloudy than the image
+    candidates = [syntheticScene(nrows, ncols, bands, cloud_fraction / 3, time_start - (k + 1) * REVISIT, rng)
+                  for k in range(depth)]
+    return image, candidates
+
+
+def syntheticArtifact(features, numberOfTrees=None, max_depth=4, seed=0):
+    """ Random forest artifact with random complete trees (same structure as
+        utils_classifier.trainLocalForest, no scikit-learn required)
+    Arguments:
+        :param features: list of feature names
+        :param numberOfTrees=parameters.NUMBER_TREES: size of the forest
+        :param max_depth=4: depth of the trees
+        :param seed=0: random seed
+        :return: python dict (artifact)
+    """
+    if numberOfTrees is None: numberOfTrees = parameters.NUMBER_TREES
+    rng = np.random.RandomState(seed)
+    nb_nodes = 2 ** (max_depth + 1) - 1
+    nb_inner = 2 ** max_depth - 1
+
+    trees = []
+    for _ in range(numberOfTrees):
+        # Complete binary tree, node k has children 2k+1 and 2k+2
+        left = [2 * k + 1 if k < nb_inner else -1 for k in range(nb_nodes)]
+        right = [2 * k + 2 if k < nb_inner else -1 for k in range(nb_nodes)]
+        trees.append({
+            "children_left": left,
+            "children_right": right,
+            "feature": [int(rng.randint(len(features))) if k < nb_inner else -2 for k in range(nb_nodes)],
+            "threshold": [0.5 if k < nb_inner else -2. for k in range(nb_nodes)],
+            "value": rng.uniform(size=nb_nodes).tolist(),
+        })
+    return {"version": "synthetic", "numberOfTrees": numberOfTrees, "features": list(features), "trees": trees}
+
+
+class _Timer:
+    """ Accumulate the time of each stage
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.rss = {}
+
+    def __call__(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.seconds[stage] = self.seconds.get(stage, 0.) + time.perf_counter() - start
+        self.rss[stage] = _peak_rss()
+        return result
+
+
+def _run_stages(image, candidates, artifact, block_size):
+    """ Run every stage of the model once, return the _Timer
+    """
+    params = parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT
+    growing_ratio = params["growing_ratio"]
+    # Opening = erosion + dilation: 2 * radius of context
+    halo = 2 * int(np.ceil(growing_ratio))
+    depth = len(candidates)
+    timer = _Timer()
+
+    # Tree masks
+    index = image.band_index(parameters.SENTINEL2_BANDNAMES)
+    features = {"tree2": np.empty((image.nrows, image.ncols), dtype=bool),
+                "tree3": np.empty((image.nrows, image.ncols), dtype=bool)}
+
+    def tree_masks():
+        for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+            bitfield = getTreeBitfield(image.data[window][..., index])
+            features["tree2"][window] = bitfieldMask(bitfield, "tree2")
+            features["tree3"][window] = bitfieldMask(bitfield, "tree3")
+    timer("tree_masks", tree_masks)
+
+    # Background selection (all the candidates: depth = number of images)
+    backgrounds = timer("background_selection", SelectBackgroundImages,
+                        image, candidates, depth, depth, block_size)
+
+    for method, images in zip(["percentile1", "percentile5"], backgrounds):
+        # Median of the backgrounds
+        def median():
+            for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+                forecastWindow(images, window, BANDS_MODEL)
+        timer("background_median", median)
+
+        # Clustering
+        cloud, valid = timer("clustering", ClusterClouds, image, images,
+                             threshold_dif_cloud=params["threshold_dif_cloud"],
+                             do_clustering=params["do_clustering"],
+                             threshold_reflectance=params["threshold_reflectance"],
+                             numPixels=params["numPixels"],
+                             bands_thresholds=params["bands_thresholds"],
+                             n_clusters=params["n_clusters"],
+                             block_size=block_size)
+
+        # Morphology
+        features[method] = np.empty((image.nrows, image.ncols), dtype=bool)
+
+        def morphology():
+            for window, inner in iterWindows(image.nrows, image.ncols, block_size, halo):
+                features[method][coreWindow(window, inner)] = openingWindow(cloud, valid, window, inner, growing_ratio)
+        timer("morphology", morphology)
+
+    # Random forest inference
+    def rf_inference():
+        for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+            X = np.stack([features[name][window].ravel() for name in artifact["features"]], axis=1)
+            predictArtifact(artifact, X)
+    timer("rf_inference", rf_inference)
+
+    return timer
+
+
+def run_benchmark(size=1024, depths=(20, 40), nb_bands=None, cloud_fraction=0.3,
+                  block_size=None, numberOfTrees=None, seed=0, output_json=None):
+    """ Time each stage of the local model on synthetic stacks, return the measures
+    Arguments:
+        :param size=1024: number of rows and columns of the images
+        :param depths=(20, 40): numbers of background images tested
+        :param nb_bands=len(SENTINEL2_BANDNAMES): number of bands of the images
+        :param cloud_fraction=0.3: ratio of cloudy pixels of the image
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param numberOfTrees=parameters.NUMBER_TREES: size of the random forest
+        :param seed=0: random seed
+        :param output_json=None: path of the json file storing the results
+        :return: python dict
+    """
+    if block_size is None: block_size = parameters.LOCAL_BLOCK_SIZE
+    if numberOfTrees is None: numberOfTrees = parameters.NUMBER_TREES
+    artifact = syntheticArtifact(parameters.METHODS_NAME, numberOfTrees, seed=seed)
+    nb_pixels = size * size
+
+    runs = []
+    for depth in depths:
+        image, candidates = syntheticStack(size, size, depth, nb_bands, cloud_fraction, seed)
+        timer = _run_stages(image, candidates, artifact, block_size)
+        stages = {stage: {"seconds": seconds,
+                          "pixels_per_second": nb_pixels / seconds if seconds else None,
+                          "peak_rss_mb": timer.rss[stage]}
+                  for stage, seconds in timer.seconds.items()}
+        total = sum(timer.seconds.values())
+        runs.append({"depth": depth,
+                     "stages": stages,
+                     "total": {"seconds": total, "pixels_per_second": nb_pixels / total}})
+        del image, candidates
+
+    results = {
+        "model_version": MODEL_VERSION,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "size": size,
+        "nb_bands": nb_bands or len(parameters.SENTINEL2_BANDNAMES),
+        "cloud_fraction": cloud_fraction,
+        "block_size": block_size,
+        "numberOfTrees": numberOfTrees,
+        "seed": seed,
+        "runs": runs,
+        "peak_rss_mb": _peak_rss(),
+    }
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    output_json = sys.argv[2] if len(sys.argv) > 2 else None
+    print(json.dumps(run_benchmark(size=size, output_json=output_json), indent=4))
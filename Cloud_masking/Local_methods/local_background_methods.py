@@ -0,0 +1,361 @@
+#####################################################
+# Background selection + forecast on NumPy arrays   #
+# Same logic as "Background_methods/                #
+# multitemporal_cloud_masking.py" and               #
+# "Background_methods/background_methods.py"        #
+#                                                   #
+# Methods:                                          #
+#   - computeCoverage(image, candidate, block_size) #
+#   - roiHash(image, block_size)                    #
+#   - SelectBackgroundImages(image, candidates,     #
+#                            number_of_images,      #
+#                            number_preselect,      #
+#                            block_size, cache)     #
+#   - forecastWindow(backgrounds, window, bands)    #
+#   - forecastPixels(backgrounds, rows, cols,       #
+#                    bands)                         #
+#   - forecastUnion(selections, window, bands)      #
+#   - forecastUnionPixels(selections, rows, cols,   #
+#                         bands)                    #
+#   - iterForecastSeries(series, window, bands)     #
+# Class:                                            #
+#   - SlidingMedian(shape, capacity)                #
+#       - reset(stack)                              #
+#       - add(values)                               #
+#       - evict(values)                             #
+#       - median()                                  #
+#                                                   #
+# Scenes are LocalScene objects (see local_utils)   #
+#####################################################
+
+import hashlib                          # Region hash
+import os
+import sys
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+sys.path.append(os.path.join(BASE_DIR, '..', 'Utils'))
+
+import parameters
+from local_utils import iterWindows, validMask, percentileStack
+from utils_candidate_cache import getCandidateCache
+
+
+def computeCoverage(image, candidate, block_size=None):
+    """ Coverage of a background candidate over the image footprint (region of interest)
+        - common_area: ratio of the footprint covered by the candidate (filter_partial_tiles)
+        - valids: ratio of the footprint where all the candidate bands are valid (_count_valid)
+    Arguments:
+        :param image: LocalScene analysed
+        :param candidate: LocalScene background candidate
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :return: common_area, valids (python floats)
+    """
+    nb_roi, nb_common, nb_valids = 0, 0, 0
+    for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+        roi = np.any(image.data[window] != 0, axis=-1)
+        data = candidate.data[window][roi]
+        nb_roi += roi.sum()
+        nb_common += np.any(data != 0, axis=-1).sum()
+        nb_valids += validMask(data).sum()
+
+    if nb_roi == 0:
+        return 0., 0.
+    return nb_common / nb_roi, nb_valids / nb_roi
+
+
+def roiHash(image, block_size=None):
+    """ Hash of the region of interest of an image (pixels with data)
+        Key of the candidate statistics in the cache (see Utils/utils_candidate_cache.py)
+    Arguments:
+        :param image: LocalScene
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :return: python string
+    """
+    md5 = hashlib.md5("{}x{}".format(image.nrows, image.ncols).encode("utf-8"))
+    for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+        md5.update(np.packbits(np.any(image.data[window] != 0, axis=-1)).tobytes())
+    return "local_" + md5.hexdigest()
+
+
+def SelectBackgroundImages(image, candidates,
+                           number_of_images=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images'],
+                           number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect'],
+                           block_size=None, cache=None):
+    """ Return the background images of the methods percentile 1 and 5
+        The coverage of the candidates is only computed for the neighbours explored,
+        and read from the cache when already computed (candidates with an "id")
+    Arguments:
+        :param image: LocalScene analysed
+        :param candidates: list of LocalScene (same MGRS tile, any date)
+        :param number_of_images=PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images']:
+        :param number_preselect=PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']:
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param cache=getCandidateCache(): CandidateCache of the candidate coverages
+        :return: two python lists of LocalScene (percentile 1, percentile 5)
+    """
+    if cache is None: cache = getCandidateCache()
+    time_start = image.time_start()
+    time_end = image.metadata.get("system:time_end", time_start)
+
+    # Remove image of same date (+ or - NUMBER_HOURS hours)
+    delta = parameters.NUMBER_HOURS * 3600000
+    candidates = [c for c in candidates
+                  if c.time_start() < time_start - delta or c.time_start() > time_start + delta]
+
+    # Coverages already computed for this region (key: scene id)
+    key = roiHash(image, block_size)
+    cached = cache.get(key, [c.metadata["id"] for c in candidates if "id" in c.metadata])
+    coverage = {}
+    computed = {}
+
+    def get_coverage(candidate):
+        if id(candidate) not in coverage:
+            scene = candidate.metadata.get("id")
+            if scene in cached and None not in cached[scene]:
+                coverage[id(candidate)] = cached[scene]
+            else:
+                coverage[id(candidate)] = computeCoverage(image, candidate, block_size)
+                if scene is not None:
+                    computed[scene] = coverage[id(candidate)]
+        return coverage[id(candidate)]
+
+    def neighbours(nb_images):
+        # Previous images (from more recent to older), partial tiles removed
+        before = sorted((c for c in candidates if c.time_start() < time_end),
+                        key=lambda c: c.time_start(), reverse=True)
+        images = []
+        for candidate in before:
+            if len(images) == nb_images: break
+            if get_coverage(candidate)[0] > parameters.COMMON_AREA:
+                images.append(candidate)
+
+        # Allow selecting image in futur (when there are no enough images in past)
+        if parameters.PARAMS_SELECTBACKGROUND_DEFAULT['allow_future']:
+            after = sorted((c for c in candidates if c.time_start() > time_end),
+                           key=lambda c: c.time_start())
+            nb_images_after = nb_images - len(images)
+            for candidate in after:
+                if nb_images_after == 0: break
+                if get_coverage(candidate)[0] > parameters.COMMON_AREA:
+                    images.append(candidate)
+                    nb_images_after -= 1
+        return images
+
+    def cloudy(candidate):
+        return candidate.metadata.get("CLOUDY_PIXEL_PERCENTAGE", 0)
+
+    # Method 1: the previous images, most cloudy first
+    images_p1 = sorted(neighbours(number_of_images), key=cloudy, reverse=True)[:number_of_images]
+    # Method 5: `number_preselect` previous images, `number_of_images` less cloudy
+    images_p5 = sorted(neighbours(number_preselect), key=cloudy)[:number_of_images]
+
+    # Sort by valid pixels ratio
+    images_p1 = sorted(images_p1, key=lambda c: get_coverage(c)[1])[:number_of_images]
+    images_p5 = sorted(images_p5, key=lambda c: get_coverage(c)[1])[:number_of_images]
+
+    if computed:
+        cache.set_many(key, computed)
+    return images_p1, images_p5
+
+
+def _median(stack):
+    """ Median over the first axis, invalid values (0) ignored
+        Same as ee.Reducer.percentile([50]) over a masked imageCollection
+        (NaN output where no valid background, masked in GEE)
+    """
+    return percentileStack(stack, [50])[0]
+
+
+def forecastWindow(backgrounds, window, bands):
+    """ Median of the background images over a window
+    Arguments:
+        :param backgrounds: list of LocalScene
+        :param window: (row slice, column slice)
+        :param bands: list of band names
+        :return: np.ndarray float32 (rows, cols, bands), NaN where no valid background
+    """
+    if not backgrounds:
+        shape = (window[0].stop - window[0].start, window[1].stop - window[1].start, len(bands))
+        return np.full(shape, np.nan, dtype=np.float32)
+    stack = np.stack([bg.data[window][..., bg.band_index(bands)] for bg in backgrounds])
+    return _median(stack)
+
+
+def forecastPixels(backgrounds, rows, cols, bands):
+    """ Median of the background images for a list of pixels
+    Arguments:
+        :param backgrounds: list of LocalScene
+        :param rows: np.ndarray of row indexes
+        :param cols: np.ndarray of column indexes
+        :param bands: list of band names
+        :return: np.ndarray float32 (n_pixels, bands), NaN where no valid background
+    """
+    if not backgrounds:
+        return np.full((len(rows), len(bands)), np.nan, dtype=np.float32)
+    stack = np.stack([bg.data[rows, cols][..., bg.band_index(bands)] for bg in backgrounds])
+    return _median(stack)
+
+
+def _medianSelections(selections, read):
+    """ Median of several background selections: the union of the
+        selections is read once, one median per selection
+    """
+    union = {}
+    for backgrounds in selections:
+        for bg in backgrounds:
+            union.setdefault(id(bg), (len(union), bg))
+    stack = np.stack([read(bg) for _, bg in union.values()]) if union else None
+
+    medians = []
+    for backgrounds in selections:
+        if not backgrounds:
+            medians.append(None)
+            continue
+        medians.append(_median(stack[[union[id(bg)][0] for bg in backgrounds]]))
+    return medians
+
+
+def forecastUnion(selections, window, bands):
+    """ forecastWindow of several background selections (ex: percentile 1 and 5)
+        The union of the selections is read once
+    Arguments:
+        :param selections: list of background lists (LocalScene)
+        :param window: (row slice, column slice)
+        :param bands: list of band names
+        :return: python list of np.ndarray (see forecastWindow), one per selection
+    """
+    shape = (window[0].stop - window[0].start, window[1].stop - window[1].start, len(bands))
+    medians = _medianSelections(selections, lambda bg: bg.data[window][..., bg.band_index(bands)])
+    return [np.full(shape, np.nan, dtype=np.float32) if median is None else median for median in medians]
+
+
+def forecastUnionPixels(selections, rows, cols, bands):
+    """ forecastPixels of several background selections (ex: percentile 1 and 5)
+        The union of the selections is read once
+    Arguments:
+        :param selections: list of background lists (LocalScene)
+        :param rows: np.ndarray of row indexes
+        :param cols: np.ndarray of column indexes
+        :param bands: list of band names
+        :return: python list of np.ndarray (see forecastPixels), one per selection
+    """
+    medians = _medianSelections(selections, lambda bg: bg.data[rows, cols][..., bg.band_index(bands)])
+    return [np.full((len(rows), len(bands)), np.nan, dtype=np.float32) if median is None else median
+            for median in medians]
+
+
+class SlidingMedian:
+    """ Per-pixel sorted stack of background values: the scenes are added and
+        evicted one by one (O(depth) per pixel) instead of computing the median
+        of the whole stack again (consecutive images of a tile share most of
+        their backgrounds). Invalid values (0) are stored as +inf (end of the stack).
+    """
+
+    def __init__(self, shape, capacity):
+        """
+        Arguments:
+            :param shape: shape of one scene window (rows, cols, bands)
+            :param capacity: maximum number of scenes in the stack
+        """
+        self.shape = tuple(shape)
+        size = int(np.prod(self.shape))
+        self.stack = np.full((capacity, size), np.inf, dtype=np.float32)
+        self.count = np.zeros(size, dtype=np.int16)
+        self.nb_scenes = 0
+        self._rank = np.arange(capacity)[:, None]
+        self._columns = np.arange(size)
+
+    def _values(self, values):
+        values = values.reshape(-1).astype(np.float32)
+        values[values == 0] = np.inf
+        return values
+
+    def reset(self, stack):
+        """ Replace the content by a stack of scenes (one sort)
+        Arguments:
+            :param stack: np.ndarray (scenes, rows, cols, bands)
+        """
+        stack = stack.reshape(len(stack), self.stack.shape[1]).astype(np.float32)
+        stack[stack == 0] = np.inf
+        self.stack[:len(stack)] = np.sort(stack, axis=0)
+        self.stack[len(stack):] = np.inf
+        self.count[:] = np.isfinite(stack).sum(axis=0)
+        self.nb_scenes = len(stack)
+
+    def add(self, values):
+        """ Insert one scene
+        Arguments:
+            :param values: np.ndarray (rows, cols, bands)
+        """
+        if self.nb_scenes == len(self.stack):
+            raise ValueError("SlidingMedian capacity ({}) exceeded".format(len(self.stack)))
+        values = self._values(values)
+        position = (self.stack < values).sum(axis=0)
+        # Shift the values after the insertion position
+        self.stack[1:] = np.where(self._rank[1:] > position, self.stack[:-1], self.stack[1:])
+        self.stack[position, self._columns] = values
+        self.count += np.isfinite(values)
+        self.nb_scenes += 1
+
+    def evict(self, values):
+        """ Remove one scene (values previously added)
+        Arguments:
+            :param values: np.ndarray (rows, cols, bands)
+        """
+        values = self._values(values)
+        position = (self.stack < values).sum(axis=0)
+        self.stack[:-1] = np.where(self._rank[:-1] >= position, self.stack[1:], self.stack[:-1])
+        self.stack[-1] = np.inf
+        self.count -= np.isfinite(values)
+        self.nb_scenes -= 1
+
+    def median(self):
+        """ Median of the valid values (same as _median)
+            :return: np.ndarray float32 (rows, cols, bands), NaN where no valid value
+        """
+        count = self.count.astype(np.int64)
+        low = self.stack[np.maximum(count - 1, 0) // 2, self._columns]
+        high = self.stack[np.maximum(count, 1) // 2 - (count == 0), self._columns]
+        median = (low + high) / np.float32(2)
+        median[count == 0] = np.nan
+        return median.reshape(self.shape)
+
+
+def iterForecastSeries(series, window, bands):
+    """ Median of the backgrounds of consecutive images over a window
+        The stack slides from one image to the next one: only the backgrounds
+        added / removed are processed (full sort when most of them change)
+    Arguments:
+        :param series: list of background lists (LocalScene), one per image (time order)
+        :param window: (row slice, column slice)
+        :param bands: list of band names
+        :return: generator of np.ndarray float32 (rows, cols, bands), one per image
+                 (same values as forecastWindow)
+    """
+    def read(bg):
+        return bg.data[window][..., bg.band_index(bands)]
+
+    shape = (window[0].stop - window[0].start, window[1].stop - window[1].start, len(bands))
+    sliding = SlidingMedian(shape, max([len(backgrounds) for backgrounds in series] + [1]))
+    current = {}
+    for backgrounds in series:
+        scenes = {id(bg): bg for bg in backgrounds}
+        added = [bg for key, bg in scenes.items() if key not in current]
+        evicted = [bg for key, bg in current.items() if key not in scenes]
+
+        if len(added) + len(evicted) >= len(scenes):
+            # Most of the stack changes: one sort
+            if scenes:
+                sliding.reset(np.stack([read(bg) for bg in scenes.values()]))
+            else:
+                sliding.reset(np.zeros((0,) + shape, dtype=np.float32))
+        else:
+            for bg in evicted:
+                sliding.evict(read(bg))
+            for bg in added:
+                sliding.add(read(bg))
+        current = scenes
+        yield sliding.median()
@@ -0,0 +1,247 @@
+#####################################################
+# File: local cloud masking model (no GEE)          #
+# Methods:                                          #
+#   - CloudClusterScore(image, candidates,          #
+#                       number_of_images,           #
+#                       number_preselect,           #
+#                       block_size, combined)       #
+#   - CloudClusterScoreSeries(images, candidates,   #
+#                             number_of_images,     #
+#                             number_preselect,     #
+#                             block_size)           #
+#   - computeCloudMasking(image, candidates,        #
+#                         artifact, threshold,      #
+#                         land_mask, block_size,    #
+#                         out, output_mode,         #
+#                         pack_methods, scores)     #
+#   - computeCloudMaskingSeries(images, candidates, #
+#                               artifact, ..., outs)#
+# Same model as "cloud_masking_model.py" computed   #
+# with NumPy on images stored locally (GeoTIFF):    #
+# tree2, tree3, percentile1, percentile5 then the   #
+# random forest artifact (see "Utils/               #
+# utils_classifier.py"). The image is processed by  #
+# windows of LOCAL_BLOCK_SIZE pixels.               #
+#                                                   #
+# Usage:                                            #
+#   python Cloud_masking/Local_methods/             #
+#       local_cloud_masking.py classifier.json      #
+#       image_dir output.tif background_dir...      #
+#####################################################
+
+import logging                          # Write logs
+import os
+import sys
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+sys.path.append(os.path.join(BASE_DIR, '..', 'Utils'))
+
+import parameters
+from parameters import CUTTOF
+from utils_classifier import loadArtifact, predictArtifact
+from utils_probability import quantizeProbability
+from utils_encoding import PACKED_BITS
+from local_utils import LocalScene, iterWindows, coreWindow, createOutputRaster
+from local_tree_methods import getTreeBitfield, bitfieldMask
+from local_background_methods import SelectBackgroundImages
+from local_clustering import ClusterClouds, ClusterCloudsSeries, ClusterCloudsCombined, openingWindow
+
+# Value of the pixels masked (outside the image footprint or the land)
+NODATA = 255
+
+
+def CloudClusterScore(image, candidates,
+                      number_of_images=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images'],
+                      number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect'],
+                      block_size=None, combined=None):
+    """ Get the cloud cluster score of the percentile methods 1 & 5 (before opening)
+    Params are defined in parameters.py file
+    Arguments:
+        :param image: LocalScene analysed
+        :param candidates: list of LocalScene, background candidates (same MGRS tile)
+        :param number_of_images=PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images']:
+        :param number_preselect=PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']:
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param combined=parameters.COMBINED_BACKGROUND: read the union of the backgrounds
+                        of the 2 methods once (see local_clustering.ClusterCloudsCombined)
+        :return: python dict {"percentile1": (cloud, valid), "percentile5": (cloud, valid)}
+                 see local_clustering.ClusterClouds
+    """
+    if combined is None: combined = parameters.COMBINED_BACKGROUND
+    params = parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT
+
+    # Select background, return two lists for the 2 methods
+    images_p1, images_p5 = SelectBackgroundImages(image, candidates,
+                                                  number_of_images,
+                                                  number_preselect,
+                                                  block_size)
+
+    if combined:
+        logging.info("\t- percentile1 / percentile5: {} / {} background images ({} distinct)"
+                     .format(len(images_p1), len(images_p5), len({id(bg) for bg in images_p1 + images_p5})))
+        results = ClusterCloudsCombined(image, [images_p1, images_p5],
+                                        threshold_dif_cloud=params["threshold_dif_cloud"],
+                                        do_clustering=params["do_clustering"],
+                                        threshold_reflectance=params["threshold_reflectance"],
+                                        numPixels=params["numPixels"],
+                                        bands_thresholds=params["bands_thresholds"],
+                                        n_clusters=params["n_clusters"],
+                                        block_size=block_size)
+        return {"percentile1": results[0], "percentile5": results[1]}
+
+    scores = {}
+    for method, backgrounds in [("percentile1", images_p1), ("percentile5", images_p5)]:
+        logging.info("\t- {}: {} background images".format(method, len(backgrounds)))
+        scores[method] = ClusterClouds(image, backgrounds,
+                                       threshold_dif_cloud=params["threshold_dif_cloud"],
+                                       do_clustering=params["do_clustering"],
+                                       threshold_reflectance=params["threshold_reflectance"],
+                                       numPixels=params["numPixels"],
+                                       bands_thresholds=params["bands_thresholds"],
+                                       n_clusters=params["n_clusters"],
+                                       block_size=block_size)
+    return scores
+
+
+def CloudClusterScoreSeries(images, candidates,
+                            number_of_images=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images'],
+                            number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect'],
+                            block_size=None):
+    """ CloudClusterScore of consecutive images of a tile (same results)
+        The median of the backgrounds slides from one image to the next one
+        (see local_background_methods.SlidingMedian)
+    Arguments:
+        :param images: list of LocalScene (same MGRS tile)
+        :param candidates: list of LocalScene, background candidates (same MGRS tile)
+        :param others: see CloudClusterScore
+        :return: images sorted by date (python list), python list of dict
+                 (see CloudClusterScore), one per sorted image
+    """
+    params = parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT
+    images = sorted(images, key=lambda image: image.time_start())
+
+    backgrounds = [SelectBackgroundImages(image, candidates, number_of_images, number_preselect, block_size)
+                   for image in images]
+
+    scores = [{} for _ in images]
+    for k, method in enumerate(["percentile1", "percentile5"]):
+        series = [selection[k] for selection in backgrounds]
+        results = ClusterCloudsSeries(images, series,
+                                      threshold_dif_cloud=params["threshold_dif_cloud"],
+                                      do_clustering=params["do_clustering"],
+                                      threshold_reflectance=params["threshold_reflectance"],
+                                      numPixels=params["numPixels"],
+                                      bands_thresholds=params["bands_thresholds"],
+                                      n_clusters=params["n_clusters"],
+                                      block_size=block_size)
+        for score, result in zip(scores, results):
+            score[method] = result
+    return images, scores
+
+
+def computeCloudMasking(image, candidates, artifact, threshold=CUTTOF,
+                        land_mask=None, block_size=None, out=None, output_mode=None,
+                        pack_methods=None, scores=None):
+    """ Compute the Cloud masking for a given image
+        Methods used: 'percentile1', 'percentile5', 'tree2', 'tree3'
+    Arguments:
+        :param image: LocalScene analysed
+        :param candidates: list of LocalScene, background candidates (same MGRS tile)
+        :param artifact: random forest artifact (python dict, see utils_classifier.loadArtifact)
+        :param threshold=CUTTOF: RandomForest model cuttof (output_mode "mask")
+        :param land_mask=None: boolean np.ndarray (rows, cols), None: no clip
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param out=None: output np.ndarray / np.memmap (rows, cols) uint8, None: new array
+        :param output_mode=parameters.OUTPUT_MODE: "mask" or "probability"
+        :param pack_methods=parameters.EXPORT_PACK_METHODS: pack the mask and the methods
+                            as bits of the output (output_mode "mask" only)
+        :param scores=None: result of CloudClusterScore if already computed (candidates unused)
+        :return: np.ndarray uint8, NODATA masked
+                 "mask": 0 cloud free, 1 cloudy (pack_methods: see "Utils/utils_encoding.py")
+                 "probability": fraction of the trees voting "cloud" * PROBABILITY_SCALE
+    """
+    if output_mode is None: output_mode = parameters.OUTPUT_MODE
+    if pack_methods is None: pack_methods = parameters.EXPORT_PACK_METHODS
+    if pack_methods and output_mode != "mask":
+        raise ValueError("The methods can only be packed with the output mode \"mask\"")
+    if out is None:
+        out = np.empty((image.nrows, image.ncols), dtype=np.uint8)
+
+    growing_ratio = parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT["growing_ratio"]
+    if scores is None:
+        scores = CloudClusterScore(image, candidates, block_size=block_size)
+    # Opening = erosion + dilation: each window needs 2 * radius of context
+    halo = 2 * int(np.ceil(growing_ratio))
+
+    for window, inner in iterWindows(image.nrows, image.ncols, block_size, halo):
+        core = coreWindow(window, inner)
+
+        # Tree methods (one pass, one bit per tree)
+        bitfield = getTreeBitfield(image.data[core][..., image.band_index(parameters.SENTINEL2_BANDNAMES)])
+        features = {"tree2": bitfieldMask(bitfield, "tree2"), "tree3": bitfieldMask(bitfield, "tree3")}
+
+        # Background methods (opening) + masked pixels
+        masked = ~np.any(image.data[core] != 0, axis=-1)
+        for method, (cloud, valid) in scores.items():
+            features[method] = openingWindow(cloud, valid, window, inner, growing_ratio)
+            masked |= ~valid[core]
+        if land_mask is not None:
+            masked |= ~land_mask[core]
+
+        X = np.stack([features[name].ravel() for name in artifact["features"]], axis=1)
+        votes = predictArtifact(artifact, X).reshape(masked.shape)
+        if output_mode == "probability":
+            mask = quantizeProbability(votes)
+        else:
+            # Apply the random Forest classification (class voted by the majority of the trees)
+            mask = ((votes > 0.5) > threshold).astype(np.uint8)
+            if pack_methods:
+                for name, values in features.items():
+                    mask |= values.astype(np.uint8) << PACKED_BITS[name]
+        mask[masked] = NODATA
+        out[core] = mask
+
+    return out
+
+
+
+def computeCloudMaskingSeries(images, candidates, artifact, threshold=CUTTOF,
+                              land_mask=None, block_size=None, outs=None, output_mode=None,
+                              pack_methods=None):
+    """ Compute the Cloud masking of consecutive images of a tile
+        (same results as computeCloudMasking, shared background medians)
+    Arguments:
+        :param images: list of LocalScene (same MGRS tile)
+        :param candidates: list of LocalScene, background candidates (same MGRS tile)
+        :param outs=None: list of outputs (see computeCloudMasking), same order as `images`
+        :param others: see computeCloudMasking
+        :return: python list of np.ndarray uint8 (same order as `images`)
+    """
+    if outs is None:
+        outs = [None] * len(images)
+    outputs = {id(image): out for image, out in zip(images, outs)}
+
+    sorted_images, scores = CloudClusterScoreSeries(images, candidates, block_size=block_size)
+    for image, image_scores in zip(sorted_images, scores):
+        outputs[id(image)] = computeCloudMasking(image, None, artifact, threshold, land_mask, block_size,
+                                                 outputs[id(image)], output_mode, pack_methods,
+                                                 scores=image_scores)
+    return [outputs[id(image)] for image in images]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python local_cloud_masking.py classifier.json image_dir output.tif background_dir...")
+        sys.exit(1)
+
+    artifact = loadArtifact(sys.argv[1])
+    image = LocalScene.Load(sys.argv[2])
+    candidates = [LocalScene.Load(folder) for folder in sys.argv[4:]]
+
+    # Mask written window by window in the output file
+    out = createOutputRaster(sys.argv[3], (image.nrows, image.ncols))
+    computeCloudMasking(image, candidates, artifact, out=out)
+    out.flush()
+    print("Cloud mask saved: {}".format(sys.argv[3]))
@@ -0,0 +1,324 @@
+#####################################################
+# Cloud clustering on NumPy arrays                  #
+# Same logic as "Background_methods/clustering.py"  #
+#                                                   #
+# Methods:                                          #
+#   - kMeans(X, n_clusters, seed, max_iter)         #
+#   - ClusterClouds(image, backgrounds, ...)        #
+#   - ClusterCloudsSeries(images, series, ...)      #
+#   - ClusterCloudsCombined(image, selections, ...) #
+#   - openingWindow(cloud, valid, window, inner,    #
+#                   growing_ratio)                  #
+#                                                   #
+# ClusterClouds streams over the image windows:     #
+#   1. sample `numPixels` pixels, normalisation +   #
+#      k-means training                             #
+#   2. cluster every window, sum the cluster values #
+#   3. score + threshold of each cluster            #
+# The opening (neighbourhood operation) is applied  #
+# later by window, with a halo of twice the kernel  #
+# radius: erosion + dilation (openingWindow)        #
+#####################################################
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+
+import parameters
+from local_utils import iterWindows, validMask, opening, allocate
+from local_background_methods import forecastWindow, forecastPixels, iterForecastSeries, \
+                                     forecastUnion, forecastUnionPixels
+
+# Bands used in clustering process
+BANDS_MODEL = ['B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B9', 'B10', 'B11', 'B12']
+
+# Label of the pixels not clustered (masked in GEE)
+NO_CLUSTER = 255
+
+
+def kMeans(X, n_clusters, seed=0, max_iter=500):
+    """ K-means (Lloyd algorithm, random instances as initial centroids,
+        euclidean distance), as ee.Clusterer.wekaKMeans
+    Arguments:
+        :param X: np.ndarray (n_samples, n_features)
+        :param n_clusters: number of clusters
+        :param seed=0: random seed
+        :param max_iter=500: maximum number of iterations
+        :return: centroids np.ndarray (n_clusters, n_features)
+    """
+    rng = np.random.RandomState(seed)
+    n_clusters = min(n_clusters, len(X))
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)]
+
+    labels = None
+    for _ in range(max_iter):
+        new_labels = assignClusters(X, centroids)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for k in range(n_clusters):
+            members = X[labels == k]
+            # Empty cluster: keep its centroid
+            if len(members):
+                centroids[k] = members.mean(axis=0)
+    return centroids
+
+
+def assignClusters(X, centroids):
+    """ Index of the nearest centroid of each row
+    Arguments:
+        :param X: np.ndarray (n_samples, n_features)
+        :param centroids: np.ndarray (n_clusters, n_features)
+        :return: np.ndarray (n_samples)
+    """
+    distances = ((X[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=-1)
+    return distances.argmin(axis=1)
+
+
+class _ClusterScene:
+    """ Clustering of one image, window by window (see ClusterClouds)
+    """
+
+    def __init__(self, image, backgrounds, threshold_dif_cloud, do_clustering, numPixels,
+                 threshold_reflectance, bands_thresholds, n_clusters, seed, training_forecast=None,
+                 scratch_dir=None):
+        """
+        Arguments:
+            :param training_forecast=None: median of the backgrounds at the sampled pixels
+                                           (see samplePixels), None: computed from `backgrounds`
+            :param scratch_dir=parameters.LOCAL_SCRATCH_DIR: directory of the arrays (see allocate)
+        """
+        self.image = image
+        self.threshold_dif_cloud = threshold_dif_cloud
+        self.threshold_reflectance = threshold_reflectance
+        self.do_clustering = do_clustering
+        self.index_model = image.band_index(BANDS_MODEL)
+        self.index_thresholds = [BANDS_MODEL.index(band) for band in bands_thresholds]
+
+        shape = (image.nrows, image.ncols)
+        self.valid = allocate(shape, bool, scratch_dir=scratch_dir)
+        # No valid pixel in the training sample: everything masked
+        self.empty = False
+        if not do_clustering:
+            self.cloud = allocate(shape, bool, scratch_dir=scratch_dir)
+            return
+
+        # 1. Training: sample + normalisation + k-means
+        rows, cols = _ClusterScene.samplePixels(image, numPixels, seed)
+        if training_forecast is None:
+            training_forecast = forecastPixels(backgrounds, rows, cols, BANDS_MODEL)
+        _, training, sampled = self.differences(image.data[rows, cols], training_forecast)
+        training = training[sampled][:numPixels]
+        if len(training) == 0:
+            self.empty = True
+            self.cloud = allocate(shape, bool, scratch_dir=scratch_dir)
+            return
+
+        self.mean = training.mean(axis=0)
+        self.std = training.std(axis=0)
+        self.std[self.std == 0] = 1
+        self.centroids = kMeans((training - self.mean) / self.std, n_clusters, seed)
+        self.n_clusters = len(self.centroids)
+
+        self.labels = allocate(shape, np.uint8, NO_CLUSTER, scratch_dir=scratch_dir)
+        # Cloud mask written over the labels by finalize (same item size): one buffer
+        self.cloud = self.labels.view(bool)
+        self.sums = np.zeros((self.n_clusters, 2 * len(bands_thresholds)))
+        self.counts = np.zeros(self.n_clusters)
+
+    @staticmethod
+    def samplePixels(image, numPixels, seed):
+        """ Pixels sampled for the training (twice numPixels: invalid pixels dropped)
+            :return: rows, cols (np.ndarray)
+        """
+        rng = np.random.RandomState(seed)
+        rows = rng.randint(0, image.nrows, 2 * numPixels)
+        cols = rng.randint(0, image.ncols, 2 * numPixels)
+        return rows, cols
+
+    def differences(self, data, forecast):
+        img = data[..., self.index_model].astype(np.float32)
+        valid = validMask(img) & ~np.isnan(forecast).any(axis=-1)
+        return img, img - forecast, valid
+
+    def threshold(self, multitemporal_score, reflectance_score):
+        cloud = multitemporal_score > self.threshold_dif_cloud
+        if self.threshold_reflectance > 0:
+            cloud &= reflectance_score > self.threshold_reflectance
+        return cloud
+
+    def add_window(self, window, forecast):
+        """ Pixel wise score (no clustering) or
+            2. clustering + sum of the band values of each cluster
+        Arguments:
+            :param window: (row slice, column slice)
+            :param forecast: median of the backgrounds over the window (see forecastWindow)
+        """
+        if self.empty:
+            return
+        img, diff, valid_window = self.differences(self.image.data[window], forecast)
+        self.valid[window] = valid_window
+
+        if not self.do_clustering:
+            diff, img = diff[..., self.index_thresholds], img[..., self.index_thresholds]
+            with np.errstate(invalid="ignore"):
+                multitemporal_score = np.sqrt((diff ** 2).mean(axis=-1)) * (diff.mean(axis=-1) >= 0)
+                reflectance_score = np.sqrt((img ** 2).mean(axis=-1))
+                self.cloud[window] = self.threshold(multitemporal_score, reflectance_score) & valid_window
+            return
+
+        label = assignClusters((diff[valid_window] - self.mean) / self.std, self.centroids)
+        self.labels[window][valid_window] = label
+
+        values = np.concatenate([img[valid_window][:, self.index_thresholds],
+                                 diff[valid_window][:, self.index_thresholds]], axis=1)
+        self.counts += np.bincount(label, minlength=self.n_clusters)
+        for k in range(values.shape[1]):
+            self.sums[:, k] += np.bincount(label, weights=values[:, k], minlength=self.n_clusters)
+
+    def finalize(self, block_size=None):
+        """ 3. Score + threshold of each cluster (the labels are replaced by the cloud mask)
+            :return: cloud, valid (see ClusterClouds)
+        """
+        if self.empty or not self.do_clustering:
+            return self.cloud, self.valid
+
+        nb_bands = len(self.index_thresholds)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.sums / self.counts[:, None]
+        clusters_refl = means[:, :nb_bands]
+        clusters_diff = means[:, nb_bands:]
+
+        reflectance_score = np.sqrt((clusters_refl ** 2).mean(axis=1))
+        multitemporal_score = np.sqrt((clusters_diff ** 2).mean(axis=1))
+        multitemporal_score = np.where(clusters_diff.mean(axis=1) > 0,
+                                       multitemporal_score, -multitemporal_score)
+        with np.errstate(invalid="ignore"):
+            cloud_clusters = self.threshold(multitemporal_score, reflectance_score)
+
+        # Cloud clusters (NO_CLUSTER: False)
+        lookup = np.zeros(256, dtype=bool)
+        lookup[:self.n_clusters] = cloud_clusters
+        for window, _ in iterWindows(self.image.nrows, self.image.ncols, block_size):
+            self.cloud[window] = lookup[self.labels[window]]
+        return self.cloud, self.valid
+
+
+def ClusterClouds(image, backgrounds,
+                  threshold_dif_cloud=.045,
+                  do_clustering=True, numPixels=1000,
+                  threshold_reflectance=.175,
+                  bands_thresholds=["B2", "B3", "B4"],
+                  n_clusters=10,
+                  block_size=None, seed=None):
+    """ Compute the cloud score given the differences between the
+        real and predicted (median of the backgrounds) image.
+    Arguments:
+        :param image: LocalScene analysed
+        :param backgrounds: list of LocalScene (background images)
+        :param threshold_dif_cloud=.045: Threshold over the cloud score to be considered clouds
+        :param do_clustering=True:
+        :param numPixels=1000: number of pixels sampled (clustering training)
+        :param threshold_reflectance=.175:
+        :param bands_thresholds=["B2", "B3","B4"]:
+        :param n_clusters=10: number of clusters
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param seed=parameters.LOCAL_SEED: random seed (sampling + k-means)
+        :return: cloud (boolean np.ndarray (rows, cols), before opening),
+                 valid (boolean np.ndarray (rows, cols), pixels not masked)
+    """
+    if seed is None: seed = parameters.LOCAL_SEED
+
+    scene = _ClusterScene(image, backgrounds, threshold_dif_cloud, do_clustering, numPixels,
+                          threshold_reflectance, bands_thresholds, n_clusters, seed)
+    if not scene.empty:
+        for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+            scene.add_window(window, forecastWindow(backgrounds, window, BANDS_MODEL))
+    return scene.finalize(block_size)
+
+
+def ClusterCloudsSeries(images, series,
+                        threshold_dif_cloud=.045,
+                        do_clustering=True, numPixels=1000,
+                        threshold_reflectance=.175,
+                        bands_thresholds=["B2", "B3", "B4"],
+                        n_clusters=10,
+                        block_size=None, seed=None, scratch_dir=None):
+    """ ClusterClouds of consecutive images of a tile (same results)
+        The windows are processed one by one for all the images: the median of
+        the backgrounds slides from one image to the next one (iterForecastSeries)
+        The arrays of all the images are kept until the end: they are stored in
+        temporary files (memory mapped) by default
+    Arguments:
+        :param images: list of LocalScene (time order)
+        :param series: list of background lists (LocalScene), one per image
+        :param scratch_dir=parameters.LOCAL_SCRATCH_DIR: directory of the arrays
+                           (see local_utils.allocate), None: system temporary directory
+        :param others: see ClusterClouds
+        :return: python list of (cloud, valid), one per image
+    """
+    if seed is None: seed = parameters.LOCAL_SEED
+    if scratch_dir is None: scratch_dir = parameters.LOCAL_SCRATCH_DIR or tempfile.gettempdir()
+
+    scenes = [_ClusterScene(image, backgrounds, threshold_dif_cloud, do_clustering, numPixels,
+                            threshold_reflectance, bands_thresholds, n_clusters, seed,
+                            scratch_dir=scratch_dir)
+              for image, backgrounds in zip(images, series)]
+    if scenes:
+        for window, _ in iterWindows(images[0].nrows, images[0].ncols, block_size):
+            for scene, forecast in zip(scenes, iterForecastSeries(series, window, BANDS_MODEL)):
+                scene.add_window(window, forecast)
+    return [scene.finalize(block_size) for scene in scenes]
+
+
+def ClusterCloudsCombined(image, selections,
+                          threshold_dif_cloud=.045,
+                          do_clustering=True, numPixels=1000,
+                          threshold_reflectance=.175,
+                          bands_thresholds=["B2", "B3", "B4"],
+                          n_clusters=10,
+                          block_size=None, seed=None):
+    """ ClusterClouds of several background selections of the same image
+        (percentile 1 and 5 methods, same results): the union of the backgrounds
+        is read once for the training sample and for each window
+        (forecastUnion), both medians are computed from the same stack
+    Arguments:
+        :param image: LocalScene analysed
+        :param selections: list of background lists (LocalScene)
+        :param others: see ClusterClouds
+        :return: python list of (cloud, valid), one per selection
+    """
+    if seed is None: seed = parameters.LOCAL_SEED
+
+    training_forecasts = [None] * len(selections)
+    if do_clustering:
+        # Same pixels sampled for all the selections
+        rows, cols = _ClusterScene.samplePixels(image, numPixels, seed)
+        training_forecasts = forecastUnionPixels(selections, rows, cols, BANDS_MODEL)
+
+    scenes = [_ClusterScene(image, backgrounds, threshold_dif_cloud, do_clustering, numPixels,
+                            threshold_reflectance, bands_thresholds, n_clusters, seed, training_forecast)
+              for backgrounds, training_forecast in zip(selections, training_forecasts)]
+    if not all(scene.empty for scene in scenes):
+        for window, _ in iterWindows(image.nrows, image.ncols, block_size):
+            for scene, forecast in zip(scenes, forecastUnion(selections, window, BANDS_MODEL)):
+                scene.add_window(window, forecast)
+    return [scene.finalize(block_size) for scene in scenes]
+
+
+def openingWindow(cloud, valid, window, inner, growing_ratio):
+    """ Apply the opening to a window of the cloud score
+    Arguments:
+        :param cloud: boolean np.ndarray (rows, cols), see ClusterClouds
+        :param valid: boolean np.ndarray (rows, cols), see ClusterClouds
+        :param window: window with a halo >= 2 * growing_ratio (erosion + dilation, see iterWindows)
+        :param inner: window without halo (slices in `window`)
+        :param growing_ratio: kernel radius (pixels)
+        :return: boolean np.ndarray (inner window)
+    """
+    return opening(cloud[window], growing_ratio, valid[window])[inner]
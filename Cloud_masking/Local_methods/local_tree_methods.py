@@ -0,0 +1,115 @@
+#####################################################
+# Decision tree masks on NumPy arrays               #
+# Same rules as "Tree_methods/tree_methods.py"      #
+# (compiled from "Tree_methods/tree_rules.py")      #
+#                                                   #
+# Methods:                                          #
+#   - normalizedImage(data, coef_standard)          #
+#   - getMaskTree1(bands)                           #
+#   - getMaskTree2(bands)                           #
+#   - getMaskTree3(bands)                           #
+#   - getTreeBitfield(data, bands, coef_standard)   #
+#   - bitfieldMask(bitfield, tree)                  #
+#                                                   #
+# `bands`: python dict {band name: np.ndarray}      #
+# (normalized values, see normalizedImage)          #
+#####################################################
+
+import os
+import sys
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+sys.path.append(os.path.join(BASE_DIR, '..', 'Tree_methods'))
+
+from parameters import COEF_NORMALISATION, SENTINEL2_BANDNAMES
+from tree_rules import TREE_RULES, compileNumpy
+
+# NumPy functions of the trees (rules defined in "Tree_methods/tree_rules.py")
+_TREES = {tree: compileNumpy(tree) for tree in TREE_RULES}
+
+# Bit of each tree in the bitfield (see getTreeBitfield)
+TREE_BITS = {"tree1": 1, "tree2": 2, "tree3": 4}
+
+# Number of pixels evaluated at once by getTreeBitfield
+# (normalised values stay in the CPU cache)
+FUSED_CHUNK = 16384
+
+
+def normalizedImage(data, coef_standard=COEF_NORMALISATION, bands=SENTINEL2_BANDNAMES):
+    """ Normalize image band values (same scale as in the article)
+    Arguments:
+        :param data: np.ndarray (..., bands)
+        :param coef_standard=COEF_NORMALISATION: reduction coefficient
+        :param bands=SENTINEL2_BANDNAMES: band names (last axis of data)
+        :return: python dict {band name: np.ndarray (float32)}
+    """
+    return {band: data[..., k].astype(np.float32) / coef_standard for k, band in enumerate(bands)}
+
+
+def getMaskTree1(b):
+    """ Compute tree1 method
+    Argument
+        :param b: python dict {band name: normalized np.ndarray}
+        :return: boolean np.ndarray
+    """
+    return _TREES["tree1"](b)
+
+
+def getMaskTree2(b):
+    """ Compute tree2 method
+    Argument
+        :param b: python dict {band name: normalized np.ndarray}
+        :return: boolean np.ndarray
+    """
+    return _TREES["tree2"](b)
+
+
+def getMaskTree3(b):
+    """ Compute tree3 method
+    Argument
+        :param b: python dict {band name: normalized np.ndarray}
+        :return: boolean np.ndarray
+    """
+    return _TREES["tree3"](b)
+
+
+def getTreeBitfield(data, bands=SENTINEL2_BANDNAMES, coef_standard=COEF_NORMALISATION):
+    """ Evaluate the three trees in one pass: the pixels are normalised once
+        (float32, in place) by chunks of FUSED_CHUNK pixels and all the rules
+        are evaluated on each chunk
+    Arguments:
+        :param data: np.ndarray (..., bands), Sentinel 2 digital numbers
+        :param bands=SENTINEL2_BANDNAMES: band names (last axis of data)
+        :param coef_standard=COEF_NORMALISATION: reduction coefficient
+        :return: np.ndarray uint8 (...), one bit per tree (see TREE_BITS)
+    """
+    pixels = data.reshape(-1, data.shape[-1])
+    bitfield = np.zeros(len(pixels), dtype=np.uint8)
+    chunk = np.empty((FUSED_CHUNK, len(bands)), dtype=np.float32)
+
+    for start in range(0, len(pixels), FUSED_CHUNK):
+        stop = min(start + FUSED_CHUNK, len(pixels))
+        x = chunk[:stop - start]
+        x[...] = pixels[start:stop]
+        x /= coef_standard
+        b = {band: x[:, k] for k, band in enumerate(bands)}
+
+        bits = bitfield[start:stop]
+        bits[getMaskTree1(b)] |= TREE_BITS["tree1"]
+        bits[getMaskTree2(b)] |= TREE_BITS["tree2"]
+        bits[getMaskTree3(b)] |= TREE_BITS["tree3"]
+
+    return bitfield.reshape(data.shape[:-1])
+
+
+def bitfieldMask(bitfield, tree):
+    """ Mask of one tree from the bitfield
+    Arguments:
+        :param bitfield: np.ndarray uint8 (see getTreeBitfield)
+        :param tree: "tree1", "tree2" or "tree3"
+        :return: boolean np.ndarray
+    """
+    return (bitfield & TREE_BITS[tree]) != 0
@@ -0,0 +1,261 @@
+#####################################################
+# Utils file for the local (NumPy) cloud masking    #
+#                                                   #
+# Class:                                            #
+#   - LocalScene(data, metadata)                    #
+#       - Load(local_dir)                           #
+#       - band_index(bands)                         #
+#       - time_start()                              #
+# Methods:                                          #
+#   - iterWindows(nrows, ncols, block_size, halo)   #
+#   - coreWindow(window, inner)                     #
+#   - createOutputRaster(filename, shape, dtype)    #
+#   - allocate(shape, dtype, fill_value,            #
+#              scratch_dir)                         #
+#   - validMask(data)                               #
+#   - circleKernel(radius)                          #
+#   - opening(mask, radius, valid)                  #
+#   - percentileStack(stack, percentiles, invalid)  #
+#   - reducePercentiles(scenes, bands, percentiles, #
+#                       block_size, out)            #
+#####################################################
+
+import json                             # Read metadata
+import os
+import sys
+import tempfile                         # Scratch files
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+
+import parameters
+
+# Name of the raster and metadata files in a scene directory
+# (same layout as "Build_model/Methods_cloud_masking/local_image.py")
+RASTER_NAME = "raster"
+METADATA_NAME = "info.json"
+
+
+class LocalScene:
+    """ Sentinel 2 scene stored locally: array (rows, cols, bands) + metadata
+        Metadata used: "bands", "system:time_start", "CLOUDY_PIXEL_PERCENTAGE",
+        "MGRS_TILE", "id"
+    """
+
+    def __init__(self, data, metadata={}):
+        """
+        Arguments:
+            :param data: np.ndarray or np.memmap (rows, cols, bands), Sentinel 2 digital numbers
+            :param metadata={}: python dict
+        """
+        self.data = data
+        self.metadata = metadata
+        self.nrows = data.shape[0]
+        self.ncols = data.shape[1]
+
+    @staticmethod
+    def Load(local_dir):
+        """ Load a scene from a directory: RASTER_NAME + ".tif" (memory mapped)
+            and METADATA_NAME
+        Arguments:
+            :param local_dir: scene directory
+            :return: LocalScene
+        """
+        import tifffile
+
+        metadata = {}
+        metadata_file = os.path.join(local_dir, METADATA_NAME)
+        if os.path.exists(metadata_file):
+            with open(metadata_file, "r") as f:
+                metadata = json.load(f)
+        data = tifffile.memmap(os.path.join(local_dir, RASTER_NAME + ".tif"), mode="r")
+        return LocalScene(data, metadata)
+
+    def band_index(self, bands):
+        """ Return the index of the bands in the array
+        Arguments:
+            :param bands: list of band names
+            :return: python list of int
+        """
+        names = self.metadata.get("bands", parameters.SENTINEL2_BANDNAMES)
+        return [names.index(band) for band in bands]
+
+    def time_start(self):
+        """ Acquisition time (milliseconds, as "system:time_start" in GEE)
+        """
+        return self.metadata["system:time_start"]
+
+
+def iterWindows(nrows, ncols, block_size=None, halo=0):
+    """ Iterate over square windows of an image
+    Arguments:
+        :param nrows: number of rows
+        :param ncols: number of columns
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param halo=0: number of pixels added around each window (neighbourhood operations)
+        :return: generator of (outer, inner): outer = window with halo (slices in the image),
+                 inner = window without halo (slices in the outer window)
+    """
+    if block_size is None: block_size = parameters.LOCAL_BLOCK_SIZE
+
+    for r0 in range(0, nrows, block_size):
+        r1 = min(r0 + block_size, nrows)
+        for c0 in range(0, ncols, block_size):
+            c1 = min(c0 + block_size, ncols)
+            R0, R1 = max(r0 - halo, 0), min(r1 + halo, nrows)
+            C0, C1 = max(c0 - halo, 0), min(c1 + halo, ncols)
+            outer = (slice(R0, R1), slice(C0, C1))
+            inner = (slice(r0 - R0, r1 - R0), slice(c0 - C0, c1 - C0))
+            yield outer, inner
+
+
+def coreWindow(window, inner):
+    """ Window without halo, as slices in the image
+    Arguments:
+        :param window: outer window (see iterWindows)
+        :param inner: inner window (see iterWindows)
+        :return: (row slice, column slice)
+    """
+    return tuple(slice(w.start + i.start, w.start + i.stop) for w, i in zip(window, inner))
+
+
+def createOutputRaster(filename, shape, dtype=np.uint8):
+    """ Create a GeoTIFF memory mapped: the windows are written in the file
+        (the full raster is never stored in memory)
+    Arguments:
+        :param filename: path to the tif file
+        :param shape: (rows, cols) or (rows, cols, bands)
+        :param dtype=np.uint8: data type
+        :return: np.memmap
+    """
+    import tifffile
+    return tifffile.memmap(filename, shape=tuple(shape), dtype=dtype)
+
+
+def allocate(shape, dtype, fill_value=0, scratch_dir=None):
+    """ Array of the size of the image (intermediate results)
+        Stored in a temporary file of LOCAL_SCRATCH_DIR if defined, in memory otherwise
+    Arguments:
+        :param shape: array shape
+        :param dtype: data type
+        :param fill_value=0: initial value
+        :param scratch_dir=parameters.LOCAL_SCRATCH_DIR: directory of the temporary file
+        :return: np.ndarray or np.memmap
+    """
+    if scratch_dir is None: scratch_dir = parameters.LOCAL_SCRATCH_DIR
+    if scratch_dir is None:
+        return np.full(shape, fill_value, dtype=dtype)
+
+    if not os.path.exists(scratch_dir):
+        os.makedirs(scratch_dir)
+    # File deleted when the array is released
+    scratch = tempfile.TemporaryFile(dir=scratch_dir)
+    array = np.memmap(scratch, dtype=dtype, mode="w+", shape=shape)
+    if fill_value:
+        array[...] = fill_value
+    return array
+
+
+def validMask(data):
+    """ Valid pixels: all the bands non zero (Sentinel 2 no data value is 0)
+        Same as "mask().reduce(ee.Reducer.allNonZero())" in GEE
+    Arguments:
+        :param data: np.ndarray (..., bands)
+        :return: boolean np.ndarray (...)
+    """
+    return np.all(data != 0, axis=-1)
+
+
+def circleKernel(radius):
+    """ Boolean circle kernel (same as ee.Kernel.circle(radius) in pixels)
+    Arguments:
+        :param radius: radius (pixels)
+    """
+    r = int(np.ceil(radius))
+    y, x = np.ogrid[-r:r + 1, -r:r + 1]
+    return x * x + y * y <= radius * radius
+
+
+def opening(mask, radius, valid=None):
+    """ Morphological opening (focal_min then focal_max, circle kernel)
+        As in GEE, the invalid (masked) pixels and the pixels outside the
+        array are ignored by the focal operations
+    Arguments:
+        :param mask: boolean np.ndarray (rows, cols)
+        :param radius: kernel radius (pixels)
+        :param valid=None: boolean np.ndarray (rows, cols), None: all valid
+        :return: boolean np.ndarray
+    """
+    from scipy import ndimage
+    kernel = circleKernel(radius)
+    if valid is not None:
+        mask = mask | ~valid
+    mask = ndimage.binary_erosion(mask, structure=kernel, border_value=1)
+    if valid is not None:
+        mask &= valid
+    return ndimage.binary_dilation(mask, structure=kernel)
+
+
+def percentileStack(stack, percentiles, invalid=0):
+    """ Per-pixel percentiles over the first axis (scenes), invalid values ignored
+        Partition (np.partition) instead of a full sort, all the percentiles in one
+        pass, the stack keeps its type (uint16: no float64 copy). Same values as
+        np.nanpercentile (linear interpolation) with the invalid values set to NaN.
+    Arguments:
+        :param stack: np.ndarray (scenes, ...), ex: (scenes, rows, cols, bands) uint16
+        :param percentiles: list of percentiles (0 to 100)
+        :param invalid=0: value of the invalid (masked) pixels
+        :return: np.ndarray float32 (len(percentiles), ...), NaN where no valid value
+    """
+    stack = np.asarray(stack)
+    depth, shape = stack.shape[0], stack.shape[1:]
+    flat = stack.reshape(depth, -1)
+    valid = flat != invalid
+    counts = valid.sum(axis=0)
+    # Invalid values moved after the valid ones
+    top = np.iinfo(stack.dtype).max if np.issubdtype(stack.dtype, np.integer) else np.inf
+
+    out = np.full((len(percentiles), flat.shape[1]), np.nan, dtype=np.float32)
+    # Pixels grouped by number of valid values: same ranks in each group
+    for count in np.unique(counts):
+        if count == 0:
+            continue
+        group = counts == count
+        columns = slice(None) if group.all() else np.flatnonzero(group)
+        values = flat[:, columns]
+        if count < depth:
+            values = np.where(valid[:, columns], values, top)
+
+        positions = [(count - 1) * percentile / 100. for percentile in percentiles]
+        kth = sorted(set(int(np.floor(x)) for x in positions) | set(int(np.ceil(x)) for x in positions))
+        values = np.partition(values, kth, axis=0)
+        for k, x in enumerate(positions):
+            low = values[int(np.floor(x))].astype(np.float32)
+            high = values[int(np.ceil(x))].astype(np.float32)
+            out[k, columns] = low + (high - low) * np.float32(x - np.floor(x))
+
+    return out.reshape((len(percentiles),) + shape)
+
+
+def reducePercentiles(scenes, bands, percentiles, block_size=None, out=None):
+    """ Per-pixel percentiles of a stack of scenes, computed by windows
+        (memory used: one window of each scene)
+    Arguments:
+        :param scenes: list of LocalScene (same shape)
+        :param bands: list of band names
+        :param percentiles: list of percentiles (0 to 100)
+        :param block_size=parameters.LOCAL_BLOCK_SIZE: window size (pixels)
+        :param out=None: output array (len(percentiles), rows, cols, bands) float32,
+                         None: new array (see allocate)
+        :return: np.ndarray float32 (len(percentiles), rows, cols, bands), NaN where no valid value
+    """
+    nrows, ncols = scenes[0].nrows, scenes[0].ncols
+    if out is None:
+        out = allocate((len(percentiles), nrows, ncols, len(bands)), np.float32)
+
+    for window, _ in iterWindows(nrows, ncols, block_size):
+        stack = np.stack([scene.data[window][..., scene.band_index(bands)] for scene in scenes])
+        out[(slice(None),) + window] = percentileStack(stack, percentiles)
+    return out
@@ -2,12 +2,18 @@
 # Fonctions performing tree mask methods            #
 # Methods:                                          #
 #   - normalizedImage(image, coef_standard=10000)   #
+#   - getMaskTree(image, roi, tree)                 #
 #   - getMaskTree1(image, roi)                      #
 #   - getMaskTree2(image, roi)                      #
 #   - getMaskTree3(image, roi)                      #
+# The rules are defined in "tree_rules.py"          #
 #####################################################
 
+import os, sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
 from parameters import COEF_NORMALISATION
+from tree_rules import treeToExpressions
 
 def normalizedImage(image, coef_standard=COEF_NORMALISATION):
     """ Normalize image band values (same scale as in the article)
@@ -20,6 +26,25 @@ def normalizedImage(image, coef_standard=COEF_NORMALISATION):
     return image.divide(coef_standard)
 
 
+def getMaskTree(image, roi, tree):
+    """ Compute a tree method from its rules (see "tree_rules.py")
+    Argument
+        :param image: image to process
+        :param roi: region_of_interest
+        :param tree: tree name ("tree1", "tree2", "tree3")
+    """
+    image_normalized = normalizedImage(image)
+
+    # One expression per criteria (Clouds or Cirrus)
+    exprs = [image_normalized.expression(expr) for expr in treeToExpressions(tree)]
+
+    # full criteria = Clouds + Cirrus
+    mask = exprs[-1]
+    for expr in reversed(exprs[:-1]):
+        mask = expr.Or(mask)
+    return mask.select(["constant"], [tree]).clip(roi)
+
+
 ####################################
 # Compute Decision Tree filter 1   #
 ####################################
@@ -29,22 +54,7 @@ def getMaskTree1(image, roi):
         :param image: image to process
         :param roi: region_of_interest
     """
-    image_normalized = normalizedImage(image)
-
-    # Criteria 1 : Cirrus
-    expr1 = image_normalized.expression(
-        '( (b("B3") < 0.325) && (b("B8A") < 0.166) && (b("B10") > 0.011)) ? 1 : 0'
-    )
-    # Criteria 2 : Cirrus
-    expr2 = image_normalized.expression(
-        '( (b("B3") > 0.325) && (b("B11") < 0.267) && (b("B4") < 0.674)) ? 1 : 0'
-    )
-    # Criteri 3 : Clouds
-    expr3 = image_normalized.expression(
-        '( (b("B3") > 0.325) && (b("B11") > 0.267) && (b("B7") < 1.544)) ? 1 : 0'
-    )
-    # full criteria = Clouds + Cirrus
-    return expr1.Or(expr2.Or(expr3)).select(["constant"], ["tree1"]).clip(roi)
+    return getMaskTree(image, roi, "tree1")
 
 
 ####################################
@@ -56,18 +66,7 @@ def getMaskTree2(image, roi):
         :param image: image to process
         :param roi: region_of_interest
     """
-    image_normalized = normalizedImage(image)
-
-    # Criteria 1 : Cirrus
-    expr1 = image_normalized.expression(
-        '( (b("B8A") > 0.156) && (b("B3") < 0.333) && (b("B10")/b("B2") > 0.065)) ? 1 : 0'
-    )
-    # Criteria 2 : Cloud
-    expr2 = image_normalized.expression(
-        '( (b("B8A") > 0.156) && (b("B3") > 0.333) && (b("B6")/b("B11") < 4.292)) ? 1 : 0'
-    )
-    # full criteria = Clouds + Cirrus
-    return expr1.Or(expr2).select(["constant"], ["tree2"]).clip(roi)
+    return getMaskTree(image, roi, "tree2")
 
 
 ####################################
@@ -79,31 +78,4 @@ def getMaskTree3(image, roi):
         :param image: image to process
         :param roi: region_of_interest
     """
-    image_normalized = normalizedImage(image)
-
-    # Criteria 1 : Cirrus
-    expr1 = image_normalized.expression(
-        '( (b("B8A") < 0.181) && (b("B8A") > 0.051) && (b("B12") < 0.097) && (b("B10") > 0.011)) ? 1 : 0'
-    )
-    # Criteria 2 : Cloud
-    expr2 = image_normalized.expression(
-        '( (b("B8A") > 0.181) && (b("B1") < 0.331) && (b("B10") < 0.012) && (b("B2") > 0.271) ) ? 1 : 0'
-    )
-
-    # Criteria 3 : Cirrus
-    expr3 = image_normalized.expression(
-        '( (b("B8A") > 0.181) && (b("B1") < 0.331) && (b("B10") > 0.012) ) ? 1 : 0'
-    )
-
-    # Criteria 4 : Cirrus
-    expr4 = image_normalized.expression(
-        '( (b("B8A") > 0.181) && (b("B1") > 0.331) && (b("B11") < 0.239) && (b("B2") < 0.711) ) ? 1 : 0'
-    )
-
-    # Criteria 5 : Cloud
-    expr5 = image_normalized.expression(
-        '( (b("B8A") > 0.181) && (b("B1") > 0.331) && (b("B11") > 0.239) && (b("B5") < 1.393) ) ? 1 : 0'
-    )
-
-    # full criteria = Clouds + Cirrus
-    return expr1.Or(expr2.Or(expr3.Or(expr4.Or(expr5)))).select(["constant"], ["tree3"]).clip(roi)
+    return getMaskTree(image, roi, "tree3")
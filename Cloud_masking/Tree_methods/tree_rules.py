@@ -0,0 +1,118 @@
+#####################################################
+# Decision tree rules (single source of truth)      #
+#                                                   #
+# Variable:                                         #
+#   - TREE_RULES                                    #
+# Methods:                                          #
+#   - ruleToExpression(conditions)                  #
+#   - treeToExpressions(tree)                       #
+#   - compileNumpy(tree)                            #
+#                                                   #
+# A tree is a list of criteria (OR), each criteria  #
+# is a list of conditions (AND):                    #
+#   (term, comparator, threshold)                   #
+# A term is a band name ("B3") or a ratio of two    #
+# bands (("B10", "B2") <=> B10 / B2). Values are    #
+# normalised (see COEF_NORMALISATION).              #
+# The rules are compiled to:                        #
+#   - ee.Image.expression strings (GEE)             #
+#   - NumPy functions (local processing)            #
+# Rules from the article:                           #
+#   https://www.mdpi.com/2072-4292/8/8/666          #
+#####################################################
+
+import operator
+
+COMPARATORS = {"<": operator.lt, ">": operator.gt}
+
+TREE_RULES: dict = {
+    "tree1": [
+        # Criteria 1 : Cirrus
+        [("B3", "<", 0.325), ("B8A", "<", 0.166), ("B10", ">", 0.011)],
+        # Criteria 2 : Cirrus
+        [("B3", ">", 0.325), ("B11", "<", 0.267), ("B4", "<", 0.674)],
+        # Criteria 3 : Clouds
+        [("B3", ">", 0.325), ("B11", ">", 0.267), ("B7", "<", 1.544)],
+    ],
+    "tree2": [
+        # Criteria 1 : Cirrus
+        [("B8A", ">", 0.156), ("B3", "<", 0.333), (("B10", "B2"), ">", 0.065)],
+        # Criteria 2 : Cloud
+        [("B8A", ">", 0.156), ("B3", ">", 0.333), (("B6", "B11"), "<", 4.292)],
+    ],
+    "tree3": [
+        # Criteria 1 : Cirrus
+        [("B8A", "<", 0.181), ("B8A", ">", 0.051), ("B12", "<", 0.097), ("B10", ">", 0.011)],
+        # Criteria 2 : Cloud
+        [("B8A", ">", 0.181), ("B1", "<", 0.331), ("B10", "<", 0.012), ("B2", ">", 0.271)],
+        # Criteria 3 : Cirrus
+        [("B8A", ">", 0.181), ("B1", "<", 0.331), ("B10", ">", 0.012)],
+        # Criteria 4 : Cirrus
+        [("B8A", ">", 0.181), ("B1", ">", 0.331), ("B11", "<", 0.239), ("B2", "<", 0.711)],
+        # Criteria 5 : Cloud
+        [("B8A", ">", 0.181), ("B1", ">", 0.331), ("B11", ">", 0.239), ("B5", "<", 1.393)],
+    ],
+}
+
+
+def _termToExpression(term):
+    if isinstance(term, tuple):
+        return 'b("{}")/b("{}")'.format(*term)
+    return 'b("{}")'.format(term)
+
+
+def ruleToExpression(conditions):
+    """ Convert one criteria to an ee.Image.expression string
+    Arguments:
+        :param conditions: list of (term, comparator, threshold)
+        :return: python string, ex: '( (b("B3") < 0.325) && (b("B8A") < 0.166) ) ? 1 : 0'
+    """
+    conditions = " && ".join("({} {} {})".format(_termToExpression(term), comparator, threshold)
+                             for term, comparator, threshold in conditions)
+    return "( {} ) ? 1 : 0".format(conditions)
+
+
+def treeToExpressions(tree):
+    """ Expression strings of all the criteria of a tree
+    Arguments:
+        :param tree: tree name ("tree1", "tree2", "tree3") or list of criteria
+        :return: python list of strings
+    """
+    if isinstance(tree, str): tree = TREE_RULES[tree]
+    return [ruleToExpression(conditions) for conditions in tree]
+
+
+def compileNumpy(tree):
+    """ Return a NumPy function evaluating a tree
+        Short-circuit: the pixels already classified as cloud (previous criteria)
+        and the pixels failing a condition are not evaluated by the next ones
+    Arguments:
+        :param tree: tree name ("tree1", "tree2", "tree3") or list of criteria
+        :return: function(bands) -> boolean np.ndarray,
+                 bands: python dict {band name: normalized np.ndarray (same shape)}
+    """
+    import numpy as np
+
+    if isinstance(tree, str): tree = TREE_RULES[tree]
+
+    def evaluate(bands):
+        shape = next(iter(bands.values())).shape
+        flat = {band: values.reshape(-1) for band, values in bands.items()}
+        result = np.zeros(int(np.prod(shape)), dtype=bool)
+
+        for conditions in tree:
+            # Pixels not classified yet
+            index = np.flatnonzero(~result)
+            for term, comparator, threshold in conditions:
+                if not len(index): break
+                if isinstance(term, tuple):
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        values = flat[term[0]][index] / flat[term[1]][index]
+                else:
+                    values = flat[term][index]
+                index = index[COMPARATORS[comparator](values, threshold)]
+            result[index] = True
+
+        return result.reshape(shape)
+
+    return evaluate
@@ -5,7 +5,9 @@
 #   - get_name_collection(collection)               #
 #   - GenerateBandNames(bands, sufix)               #
 #   - export_image_to_GEE(image, asset_id, roi,     #
-#                         name, num, total)         #
+#                         name, num, total,         #
+#                         shard_policy, data_type,  #
+#                         pyramiding_policy)        #
 # Methods Python:                                   #
 #   - createJSONMetaData(filename, data)            #
 #   - updateJSONMetaData(filename, new_data)        #
@@ -78,18 +80,25 @@ def GenerateBandNames(bands, sufix):
 
 
 def export_image_to_GEE(image, asset_id="users/ab43536/", roi=None,
-                        name=None, num=None, total=None):
+                        name=None, num=None, total=None, shard_policy=None,
+                        data_type=None, pyramiding_policy=None):
     """ Export one image to asset
     Arguments:
         :param image: image to export
         :param asset_id="users/ab43536/": 
         :param roi=None: specify the roi, default compute from image dimension
-        :type roi: Python List
+        :type roi: ee.Geometry
         :param name=None: name of the image
         :param num=None: optional number for the image (appear on task list in GEE web interface )
         :param total=None: total number of image processing (appear on task list in GEE web interface )
+        :param shard_policy=None: ShardPolicy (see "utils_sharding.py"), if given the
+                                  destination folder is chosen by the policy (asset_id ignored)
+        :param data_type=parameters.EXPORT_DATA_TYPE: "byte" (uint8) or None (type of the image)
+        :param pyramiding_policy=parameters.EXPORT_PYRAMIDING: "mean", "mode", "sample"...
+                                 (None: "mean" for probabilities, "mode" for masks)
         :return: task        
-    NOTE: the ROI must be a Python list.
+    NOTE: the ROI is an ee.Geometry, it is sent with the export request
+        (no extra request to read its coordinates).
         For time efficiency, it's better to pass an already defined geometry
         If no geometry is given, the geometry is computed from the given image
         However, since it's the result from lot of process, requesting the geometry
@@ -101,6 +110,10 @@ def export_image_to_GEE(image, asset_id="users/ab43536/", roi=None,
         If "num" and "total" (must have the both) are passed, the description of the 
         task with be: "Image `num` on `total` equal `num/total` pourcent"
     """
+    if data_type is None: data_type = parameters.EXPORT_DATA_TYPE
+    if pyramiding_policy is None: pyramiding_policy = parameters.EXPORT_PYRAMIDING
+    if pyramiding_policy is None:
+        pyramiding_policy = "mean" if parameters.OUTPUT_MODE == "probability" else "mode"
     if roi == None:
         roi = getGeometryImage(image)
     if name == None:
@@ -110,13 +123,20 @@ def export_image_to_GEE(image, asset_id="users/ab43536/", roi=None,
         description = "Image {} on {} equal {:05.2f} pourcent".format(
             num, total, num / total * 100)
     # print(description)
+    if shard_policy is not None:
+        asset_id = shard_policy.folder_for(name)
     assetId = asset_id + '/' + name
+    # Smaller data type: smaller asset (storage quota) and faster export
+    # (the cast drops the properties: fingerprint, scenes, system:time_start...)
+    if data_type == "byte":
+        image = image.toByte().copyProperties(image, image.propertyNames())
     # Create a task : export the result as image asset
     task = ee.batch.Export.image.toAsset(image=image.clip(roi),
                                          description=description,
                                          assetId=assetId,
                                          scale=30,
-                                         region=roi.coordinates().getInfo(),
+                                         region=roi,
+                                         pyramidingPolicy={'.default': pyramiding_policy},
                                          )
     # Run the task
     task.start()
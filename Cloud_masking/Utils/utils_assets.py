@@ -18,11 +18,11 @@
 
 from subprocess import check_output     # Run windows command from python
 import ee                               # GEE
-import time                             # Time module
 
 # Others functions
 import utils
 import utils_tasks
+from utils_scheduler import PollScheduler
 
 def getAllImagesInColl(path):
     """ Return all the image in the directory
@@ -168,10 +168,13 @@ def exportImageListToDrive(image_to_run, output_json="Metadata_mask.json", drive
 
     total = len(image_to_run)
     counter = 0
+    scheduler = PollScheduler(nb_task_max)
+    nb_task_expected = 0            # Number of active tasks if none has ended
     print("{:-<100}\n|{:^98}|\n{:-<100}".format("", "Export to drive started", ""))
 
     while len(image_to_run) > 0:
         nb_task_pending = utils_tasks.getNumberActiveTask()
+        scheduler.update(nb_task_pending, max(nb_task_expected - nb_task_pending, 0))
         if nb_task_pending < nb_task_max:
             new_images = nb_task_max - nb_task_pending
 
@@ -195,10 +198,13 @@ def exportImageListToDrive(image_to_run, output_json="Metadata_mask.json", drive
                                                                total,
                                                                counter / total * 100, image_name))
                 counter += 1
+            nb_task_pending += len(image_running)
+        nb_task_expected = nb_task_pending
 
-        # Use quit a long time (30s) since there is lag between the moment the task is launched
-        # (in Python) and the time it really starts on GEE
-        time.sleep(30)
+        # Wait before the next poll (depends on free slots and completion rate)
+        # NOTE: there is lag between the moment the task is launched (in Python)
+        # and the time it really appears on GEE, the minimum interval should cover it
+        scheduler.wait(nb_task_pending, len(image_to_run) > 0)
 
     print("{:-<100}\n|{:^98}|\n{:-<100}".format("",
                                                 "Export to drive finished !", ""))
@@ -0,0 +1,316 @@
+#####################################################
+# Utils file: Earth Engine backend                  #
+#                                                   #
+# Class:                                            #
+#   - EarthEngineBackend(use_scene_index)           #
+#       - list_images(date_start, date_end,         #
+#                     geometry)                     #
+#       - list_tile_scenes(tile)                    #
+#       - candidate_valids(names, roi_coordinates)  #
+#       - create_collection(folder)                 #
+#       - list_assets(folder)                       #
+#       - list_group_scenes(folder)                 #
+#       - list_fingerprints(folder)                 #
+#       - delete_assets(asset_ids)                  #
+#       - asset_update_time(path)                   #
+#       - download_land_geometry(path)              #
+#       - get_footprints(names)                     #
+#       - classify_land(names, land_geometry)       #
+#       - prepare_model()                           #
+#       - start_export(name, folder, clip_land,     #
+#                      num, total)                  #
+#       - start_group_export(names, folder,         #
+#                            clip_land, num, total) #
+#       - task_snapshot(task_ids)                   #
+#       - cancel_tasks(task_ids)                    #
+#                                                   #
+# All the GEE requests of the cloud masking process #
+# go through a backend. Any object with the same    #
+# methods can replace it (see FakeBackend in        #
+# "utils_fake_backend.py" for offline load tests).  #
+#####################################################
+
+import ee                               # GEE
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+
+from utils import getGeometryImage, get_name_collection, export_image_to_GEE
+from utils_tasks import cancelAllTask, getTaskSnapshot
+from utils_assets import getAllImagesInColl
+from utils_land_index import LAND_INSIDE, LAND_PARTIAL, LAND_OUTSIDE
+from utils_grouping import group_asset_name, group_band_name, group_properties
+from utils_encoding import encodingProperties
+from utils_fingerprint import model_fingerprint
+from utils_scene_index import SceneIndex
+from utils_candidate_cache import getCandidateCache
+import parameters
+
+
+class EarthEngineBackend:
+    """ Backend running the requests on Google Earth Engine
+    """
+
+    def __init__(self, use_scene_index=None):
+        """
+        Arguments:
+            :param use_scene_index=parameters.USE_SCENE_INDEX: select the background images
+                                   with a local index of the scene metadata (one request per tile)
+        """
+        if use_scene_index is None: use_scene_index = parameters.USE_SCENE_INDEX
+        self.scene_index = SceneIndex(self.list_tile_scenes, valids_function=self.candidate_valids,
+                                      cache=getCandidateCache()) if use_scene_index else None
+
+    def list_images(self, date_start, date_end, geometry):
+        """ Return the Sentinel 2 images matching the date range and the area
+        Arguments:
+            :param date_start: starting date (python string)
+            :param date_end: end date (python string)
+            :param geometry: list of coordinates or path to a GEE featureCollection
+            :return: python list of image ids ("COPERNICUS/S2/...")
+        """
+        # Load geometry
+        if isinstance(geometry, list):
+            geometry = ee.Geometry.Polygon(geometry)
+        elif isinstance(geometry, str):
+            # Feature name
+            geometry = ee.FeatureCollection(geometry)
+        else:
+            raise ValueError("The geometry must either be a list of coordinates"
+                             " or a string to a featureCollection already imported in GEE assets")
+
+        # Get Sentinel ImageCollection according to filters
+        col = ee.ImageCollection("COPERNICUS/S2") \
+                .filterDate(date_start, date_end) \
+                .filterBounds(geometry)
+
+        # Get all image name as a python list (string)
+        return get_name_collection(col).getInfo()
+
+    def list_tile_scenes(self, tile):
+        """ Return the metadata of all the Sentinel 2 images of a MGRS tile (one request)
+        Arguments:
+            :param tile: MGRS tile (ex: "30UVE")
+            :return: python list of (name, time_start, cloudy percentage, footprint coordinates)
+        """
+        def set_footprint(image):
+            return image.set("footprint", ee.Geometry(image.get("system:footprint")).coordinates())
+
+        coll = ee.ImageCollection("COPERNICUS/S2") \
+                 .filter(ee.Filter.eq("MGRS_TILE", tile)) \
+                 .map(set_footprint)
+        return coll.reduceColumns(ee.Reducer.toList(4), ["system:index", "system:time_start",
+                                                         "CLOUDY_PIXEL_PERCENTAGE", "footprint"]) \
+                   .get("list").getInfo()
+
+    def candidate_valids(self, names, roi_coordinates):
+        """ Return the ratio of valid pixels of several background candidates
+            over a region of interest (one request)
+        Arguments:
+            :param names: list of image names (without "COPERNICUS/S2/")
+            :param roi_coordinates: footprint coordinates of the analysed image
+            :return: python dict {name: valid pixels ratio}
+        """
+        from Background_methods.multitemporal_cloud_masking import countValid
+
+        coll = ee.ImageCollection([ee.Image("COPERNICUS/S2/" + name) for name in names]) \
+                 .map(countValid(ee.Geometry.Polygon(roi_coordinates)))
+        rows = coll.reduceColumns(ee.Reducer.toList(2), ["system:index", "valids"]).get("list").getInfo()
+        # No valid pixel in the region: "valids" is null (row dropped)
+        valids = {name: 0. for name in names}
+        valids.update({name: value for name, value in rows})
+        return valids
+
+    def create_collection(self, folder):
+        """ Create the imageCollection if it doesn't exist
+        Arguments:
+            :param folder: GEE path of the imageCollection
+        """
+        if folder not in [elt["id"] for elt in ee.data.getList({"id": '/'.join(folder.split('/')[:-1])})]:
+            ee.data.createAsset({'type': "ImageCollection"}, folder)
+
+    def list_assets(self, folder):
+        """ Return all the image in the folder
+        Arguments:
+            :param folder: GEE path (python string)
+            :return: python list of asset ids
+        """
+        return getAllImagesInColl(folder)
+
+    def list_group_scenes(self, folder):
+        """ Return the scenes stored in the grouped assets of the folder (one request)
+        Arguments:
+            :param folder: GEE path (python string)
+            :return: python list of image names
+        """
+        groups = ee.ImageCollection(folder).aggregate_array("scenes").getInfo()
+        return [name for scenes in groups for name in scenes.split(",")]
+
+    def list_fingerprints(self, folder):
+        """ Return the fingerprint and the scenes of each asset of the folder (one request)
+        Arguments:
+            :param folder: GEE path (python string)
+            :return: python list of (asset_id, fingerprint or None, list of image names)
+        """
+        def set_defaults(image):
+            # Missing properties: assets without fingerprint / single scene assets
+            names = image.propertyNames()
+            return image.set({"fingerprint": ee.Algorithms.If(names.contains("fingerprint"), image.get("fingerprint"), ""),
+                              "scenes": ee.Algorithms.If(names.contains("scenes"), image.get("scenes"), "")})
+
+        rows = ee.ImageCollection(folder).map(set_defaults) \
+                 .reduceColumns(ee.Reducer.toList(3), ["system:id", "fingerprint", "scenes"]) \
+                 .get("list").getInfo()
+        return [(asset_id, fingerprint or None, scenes.split(",") if scenes else [asset_id.split('/')[-1]])
+                for asset_id, fingerprint, scenes in rows]
+
+    def delete_assets(self, asset_ids):
+        """ Delete the given assets
+        Arguments:
+            :param asset_ids: list of GEE asset ids
+        """
+        for asset_id in asset_ids:
+            ee.data.deleteAsset(asset_id)
+
+    def asset_update_time(self, path):
+        """ Return the last update time of an asset
+        Arguments:
+            :param path: GEE path (python string)
+        """
+        return ee.data.getAsset(path).get("updateTime")
+
+    def download_land_geometry(self, path, page_size=500):
+        """ Return the geometries of a GEE featureCollection (GeoJSON dicts)
+            The features are requested by pages (GEE limitation on getInfo size)
+        Arguments:
+            :param path: path to a GEE featureCollection
+            :param page_size=500: number of features per request
+            :return: python list of GeoJSON geometries
+        """
+        coll = ee.FeatureCollection(path)
+        size = coll.size().getInfo()
+        geometries = []
+        for offset in range(0, size, page_size):
+            page = coll.toList(page_size, offset).map(lambda feature: ee.Feature(feature).geometry())
+            geometries.extend(page.getInfo())
+        return geometries
+
+    def get_footprints(self, names):
+        """ Return the footprint of several images (one request)
+        Arguments:
+            :param names: list of image names (without "COPERNICUS/S2/")
+            :return: python dict {name: list of coordinates}
+        """
+        def set_footprint(image):
+            return image.set("footprint", ee.Geometry(image.get("system:footprint")).coordinates())
+
+        coll = ee.ImageCollection("COPERNICUS/S2") \
+                 .filter(ee.Filter.inList("system:index", names)) \
+                 .map(set_footprint)
+        return ee.Dictionary.fromLists(coll.aggregate_array("system:index"),
+                                       coll.aggregate_array("footprint")).getInfo()
+
+    def classify_land(self, names, land_geometry):
+        """ Return the position of several images against land (one request)
+        Arguments:
+            :param names: list of image names (without "COPERNICUS/S2/")
+            :param land_geometry: path to a GEE featureCollection or ee.FeatureCollection
+            :return: python dict {name: LAND_INSIDE | LAND_PARTIAL | LAND_OUTSIDE}
+        """
+        if isinstance(land_geometry, str):
+            land_geometry = ee.FeatureCollection(land_geometry)
+        geometry = land_geometry.geometry()
+
+        def set_land_class(image):
+            footprint = image.geometry()
+            land = ee.Algorithms.If(footprint.containedIn(geometry), LAND_INSIDE,
+                                    ee.Algorithms.If(footprint.intersects(geometry), LAND_PARTIAL, LAND_OUTSIDE))
+            return image.set("land", land)
+
+        coll = ee.ImageCollection("COPERNICUS/S2") \
+                 .filter(ee.Filter.inList("system:index", names)) \
+                 .map(set_land_class)
+        return ee.Dictionary.fromLists(coll.aggregate_array("system:index"),
+                                       coll.aggregate_array("land")).getInfo()
+
+    def prepare_model(self):
+        """ Build the random forest before the submission threads start
+            (the first run waits for the classifier export, see getClassifier)
+        """
+        from cloud_masking_model import getClassifier
+        getClassifier()
+
+    def start_export(self, name, folder, clip_land=True, num=None, total=None):
+        """ Compute the cloud mask of one image and start its export
+            The image must intersect the land geometry
+        Arguments:
+            :param name: image name (without "COPERNICUS/S2/")
+            :param folder: GEE folder (python string)
+            :param clip_land=True: clip the mask to the land geometry
+            :param num=None: image number (task description)
+            :param total=None: total number of images (task description)
+            :return: task id
+        """
+        from cloud_masking_model import computeCloudMasking
+
+        # Create full image ID
+        full_name = 'COPERNICUS/S2/' + name
+
+        # Get cloud mask
+        mask = computeCloudMasking(full_name, clip_land=clip_land, scene_index=self.scene_index)
+        # Export (store) to GEE
+        task = export_image_to_GEE(image=mask, asset_id=folder, roi=getGeometryImage(ee.Image(full_name)),
+                                   name=name, num=num, total=total)
+        return task.id
+
+    def start_group_export(self, names, folder, clip_land=True, num=None, total=None):
+        """ Compute the cloud masks of several images and start one export
+            (one band per image, see "utils_grouping.py")
+        Arguments:
+            :param names: list of image names (without "COPERNICUS/S2/")
+            :param folder: GEE folder (python string)
+            :param clip_land=True: clip the masks to the land geometry
+            :param num=None: image number (task description)
+            :param total=None: total number of images (task description)
+            :return: task id
+        """
+        from cloud_masking_model import computeCloudMasking
+
+        images = [ee.Image('COPERNICUS/S2/' + name) for name in names]
+        masks = [computeCloudMasking('COPERNICUS/S2/' + name, clip_land=clip_land, scene_index=self.scene_index)
+                 .rename(group_band_name(k))
+                 for k, name in enumerate(names)]
+
+        # Region: union of the footprints
+        roi = getGeometryImage(images[0])
+        for image in images[1:]:
+            roi = roi.union(getGeometryImage(image), 1)
+
+        group = ee.Image.cat(masks) \
+                  .set(group_properties(names)) \
+                  .set(encodingProperties(parameters.OUTPUT_MODE, parameters.EXPORT_PACK_METHODS,
+                                          parameters.PROBABILITY_SCALE)) \
+                  .set("fingerprint", model_fingerprint()) \
+                  .set("system:time_start", ee.List([img.get("system:time_start") for img in images]).reduce(ee.Reducer.min())) \
+                  .set("system:time_end", ee.List([img.get("system:time_end") for img in images]).reduce(ee.Reducer.max()))
+        task = export_image_to_GEE(image=group, asset_id=folder, roi=roi,
+                                   name=group_asset_name(names), num=num, total=total)
+        return task.id
+
+    def task_snapshot(self, task_ids=None):
+        """ Return the state of all the tasks with one request
+        Arguments:
+            :param task_ids=None: keep only these task ids (None: all the tasks)
+            :return: python dict {task_id: state}
+        """
+        return getTaskSnapshot(task_ids)
+
+    def cancel_tasks(self, task_ids):
+        """ Cancel the given tasks
+        Arguments:
+            :param task_ids: list of task ids
+        """
+        if task_ids:
+            cancelAllTask(task_list=task_ids)
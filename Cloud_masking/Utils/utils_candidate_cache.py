@@ -0,0 +1,141 @@
+#####################################################
+# Utils file: background candidate statistics cache #
+#                                                   #
+# Class:                                            #
+#   - CandidateCache(path)                          #
+#       - get(roi_hash, scenes)                     #
+#       - set_many(roi_hash, values)                #
+# Methods:                                          #
+#   - roi_hash(coordinates, precision)              #
+#   - getCandidateCache()                           #
+#                                                   #
+# Statistics of a background candidate against the  #
+# region of interest of an analysed image:          #
+#   - common_area: ratio of the region covered by   #
+#     the candidate footprint                       #
+#   - valids: ratio of the region where all the     #
+#     candidate bands are valid                     #
+# They only depend on the candidate and the region: #
+# computed once, stored in a SQLite file (key:      #
+# scene id + region hash) and reused by the next    #
+# images (and runs) sharing the candidate.          #
+#####################################################
+
+import hashlib                          # Region hash
+import json                             # Serialize the region
+import sqlite3                          # Embedded database
+import threading                        # Cache shared by the submission threads
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+# Shared caches (key: path)
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def roi_hash(coordinates, precision=None):
+    """ Hash of a region of interest (footprint coordinates)
+        The coordinates are rounded: the footprints of the images of a tile
+        acquired on the same orbit share the same hash
+    Arguments:
+        :param coordinates: list of [longitude, latitude] (or nested lists)
+        :param precision=parameters.CANDIDATE_CACHE_PRECISION: number of decimals kept
+        :return: python string
+    """
+    if precision is None: precision = parameters.CANDIDATE_CACHE_PRECISION
+
+    def round_nested(values):
+        if isinstance(values, (list, tuple)):
+            return [round_nested(value) for value in values]
+        return round(values, precision)
+
+    content = json.dumps(round_nested(coordinates))
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+class CandidateCache:
+    """ Persistent cache of the background candidate statistics
+        Each row: scene | roi_hash | common_area | valids (None: not computed yet)
+    """
+
+    def __init__(self, path=None):
+        """ Open (or create) the cache
+        Arguments:
+            :param path=None: path to the SQLite file, None: in memory (current run only)
+        """
+        if path:
+            folder = os.path.dirname(os.path.normpath(path))
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Used by several threads (submission pipeline): access serialised by the lock
+        self.connection = sqlite3.connect(path or ":memory:", isolation_level=None,
+                                          check_same_thread=False)
+        if path:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS candidate_stats (
+                scene       TEXT NOT NULL,
+                roi_hash    TEXT NOT NULL,
+                common_area REAL,
+                valids      REAL,
+                PRIMARY KEY (scene, roi_hash)
+            )
+        """)
+
+    def get(self, roi_hash, scenes=None):
+        """ Return the statistics cached for a region
+        Arguments:
+            :param roi_hash: hash of the region of interest (see roi_hash)
+            :param scenes=None: list of scene ids (None: all the scenes of the region)
+            :return: python dict {scene: (common_area, valids)}
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT scene, common_area, valids FROM candidate_stats "
+                                           "WHERE roi_hash = ?", (roi_hash,)).fetchall()
+        if scenes is not None:
+            scenes = set(scenes)
+            rows = [row for row in rows if row[0] in scenes]
+        return {scene: (common_area, valids) for scene, common_area, valids in rows}
+
+    def set_many(self, roi_hash, values):
+        """ Cache the statistics of several scenes (one transaction)
+            A statistic set to None keeps its cached value
+        Arguments:
+            :param roi_hash: hash of the region of interest (see roi_hash)
+            :param values: python dict {scene: (common_area, valids)}
+        """
+        rows = [(scene, roi_hash, common_area, valids) for scene, (common_area, valids) in values.items()]
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany("INSERT INTO candidate_stats(scene, roi_hash, common_area, valids) "
+                                   "VALUES (?, ?, ?, ?) ON CONFLICT(scene, roi_hash) DO UPDATE SET "
+                                   "common_area=COALESCE(excluded.common_area, common_area), "
+                                   "valids=COALESCE(excluded.valids, valids)", rows)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        """ Close the database connection
+        """
+        self.connection.close()
+
+
+def getCandidateCache():
+    """ Cache of parameters.CANDIDATE_CACHE_FILE, shared by the whole run
+        :return: CandidateCache
+    """
+    path = parameters.CANDIDATE_CACHE_FILE
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = CandidateCache(path)
+        return _CACHES[path]
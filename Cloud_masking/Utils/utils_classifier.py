@@ -0,0 +1,220 @@
+#####################################################
+# Utils file: random forest artifact                #
+#                                                   #
+# Methods:                                          #
+#   - loadTrainingData(training_data, features,     #
+#                      label)                       #
+#   - trainLocalForest(X, y, features,              #
+#                      numberOfTrees, seed)         #
+#   - treeToGEEString(tree, features)               #
+#   - saveArtifact(artifact, filename)              #
+#   - loadArtifact(filename)                        #
+#   - artifactToClassifier(artifact)                #
+#   - predictArtifact(artifact, X)                  #
+#                                                   #
+# The random forest is trained once with            #
+# scikit-learn and saved as a versioned json file   #
+# (the artifact). Each tree is stored as arrays     #
+# (sklearn structure): it is converted to GEE       #
+# decision tree strings (no training on GEE side,   #
+# see ee.Classifier.decisionTreeEnsemble) and can   #
+# be evaluated locally with NumPy.                  #
+#                                                   #
+# Usage (train + save the artifact):                #
+#   python Cloud_masking/Utils/utils_classifier.py  #
+#####################################################
+
+import datetime                         # Artifact creation date
+import hashlib                          # Artifact version
+import json                             # Save artifact
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+
+def loadTrainingData(training_data, features, label, page_size=5000):
+    """ Load the training data as numpy arrays
+    Arguments:
+        :param training_data: path to a csv file or GEE featureCollection id
+        :param features: list of feature names (ex: ['percentile1', 'percentile5', 'tree2', 'tree3'])
+        :param label: label name (ex: 'cloud')
+        :param page_size=5000: number of features per GEE request
+        :return: X (n_samples, n_features), y (n_samples)
+    """
+    import numpy as np
+
+    if training_data.lower().endswith(".csv"):
+        import pandas as pd
+        data = pd.read_csv(training_data)
+        return data[features].values.astype(np.float64), data[label].values.astype(np.int64)
+
+    import ee
+    coll = ee.FeatureCollection(training_data)
+    size = coll.size().getInfo()
+    rows = []
+    for offset in range(0, size, page_size):
+        page = coll.toList(page_size, offset) \
+                   .map(lambda feature: ee.Feature(feature).toDictionary(features + [label]))
+        rows.extend(page.getInfo())
+    X = np.array([[row[feature] for feature in features] for row in rows], dtype=np.float64)
+    y = np.array([row[label] for row in rows], dtype=np.int64)
+    return X, y
+
+
+def trainLocalForest(X, y, features, numberOfTrees=None, seed=0):
+    """ Train a random forest with scikit-learn, return the artifact
+    Arguments:
+        :param X: training features (n_samples, n_features)
+        :param y: training labels (0: clear, 1: cloud)
+        :param features: list of feature names (GEE band names)
+        :param numberOfTrees=parameters.NUMBER_TREES: size of the forest
+        :param seed=0: random seed
+        :return: python dict (artifact)
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    import sklearn
+
+    if numberOfTrees is None: numberOfTrees = parameters.NUMBER_TREES
+
+    forest = RandomForestClassifier(n_estimators=numberOfTrees, random_state=seed)
+    forest.fit(X, y)
+    index_cloud = list(forest.classes_).index(1)
+
+    trees = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        # Fraction of cloudy samples in each node
+        value = tree.value[:, 0, :]
+        value = value[:, index_cloud] / value.sum(axis=1)
+        trees.append({
+            "children_left": tree.children_left.tolist(),
+            "children_right": tree.children_right.tolist(),
+            "feature": tree.feature.tolist(),
+            "threshold": tree.threshold.tolist(),
+            "value": value.tolist(),
+            "n_samples": tree.n_node_samples.tolist(),
+            "impurity": tree.impurity.tolist(),
+        })
+
+    content = json.dumps({"features": features, "trees": trees}, sort_keys=True)
+    return {
+        "version": hashlib.sha1(content.encode("utf-8")).hexdigest()[:12],
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sklearn_version": sklearn.__version__,
+        "numberOfTrees": numberOfTrees,
+        "seed": seed,
+        "nb_samples": int(len(y)),
+        "features": features,
+        "trees": trees,
+    }
+
+
+def treeToGEEString(tree, features):
+    """ Convert one tree of the artifact to a GEE decision tree string
+        Format: one line per node "id) split n_samples loss value", leaves end with "*"
+        The children of the node `id` are `2 * id` (<=) and `2 * id + 1` (>)
+    Arguments:
+        :param tree: python dict (one tree of the artifact)
+        :param features: list of feature names
+        :return: python string
+    """
+    lines = []
+
+    def add_node(node, node_id, split, depth):
+        is_leaf = tree["children_left"][node] == -1
+        n_samples = tree["n_samples"][node]
+        line = "{}{}) {} {} {:.6f} {}".format("  " * depth, node_id, split, n_samples,
+                                              tree["impurity"][node] * n_samples,
+                                              int(tree["value"][node] >= 0.5))
+        lines.append(line + (" *" if is_leaf else ""))
+        if not is_leaf:
+            feature = features[tree["feature"][node]]
+            threshold = tree["threshold"][node]
+            add_node(tree["children_left"][node], 2 * node_id,
+                     "{}<={:.6f}".format(feature, threshold), depth + 1)
+            add_node(tree["children_right"][node], 2 * node_id + 1,
+                     "{}>{:.6f}".format(feature, threshold), depth + 1)
+
+    add_node(0, 1, "root", 0)
+    return "\n".join(lines)
+
+
+def saveArtifact(artifact, filename):
+    """ Save the artifact (json file)
+    Arguments:
+        :param artifact: python dict
+        :param filename: path to the output file
+    """
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(filename, "w") as f:
+        json.dump(artifact, f)
+
+
+def loadArtifact(filename):
+    """ Load an artifact saved by saveArtifact
+    Arguments:
+        :param filename: path to the json file
+        :return: python dict
+    """
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def artifactToClassifier(artifact):
+    """ Return the GEE classifier of the artifact (no training on GEE side)
+    Arguments:
+        :param artifact: python dict
+        :return: ee.Classifier
+    """
+    import ee
+    trees = [treeToGEEString(tree, artifact["features"]) for tree in artifact["trees"]]
+    return ee.Classifier.decisionTreeEnsemble(trees)
+
+
+def predictArtifact(artifact, X):
+    """ Evaluate the forest locally (NumPy), same votes as the GEE classifier
+        (each tree votes for the class of its leaf, see treeToGEEString)
+        The rows are evaluated once per distinct value (binary features: at most 16 rows)
+    Arguments:
+        :param artifact: python dict
+        :param X: features (n_samples, n_features), columns in artifact["features"] order
+        :return: np.ndarray (n_samples): fraction of the trees voting "cloud"
+    """
+    import numpy as np
+
+    X = np.asarray(X, dtype=np.float64)
+    rows, inverse = np.unique(X, axis=0, return_inverse=True)
+    votes = np.zeros(len(rows))
+
+    for tree in artifact["trees"]:
+        children_left = np.asarray(tree["children_left"])
+        children_right = np.asarray(tree["children_right"])
+        feature = np.asarray(tree["feature"])
+        threshold = np.asarray(tree["threshold"])
+
+        node = np.zeros(len(rows), dtype=np.int64)
+        active = children_left[node] != -1
+        while active.any():
+            current = node[active]
+            go_left = rows[active, feature[current]] <= threshold[current]
+            node[active] = np.where(go_left, children_left[current], children_right[current])
+            active = children_left[node] != -1
+        votes += np.asarray(tree["value"])[node] >= 0.5
+
+    return (votes / len(artifact["trees"]))[inverse.ravel()]
+
+
+if __name__ == "__main__":
+    import ee
+    ee.Initialize()
+
+    X, y = loadTrainingData(parameters.TRAINING_DATA, parameters.METHODS_NAME, "cloud")
+    artifact = trainLocalForest(X, y, parameters.METHODS_NAME)
+    filename = parameters.CLASSIFIER_FILE or "Cloud_masking/Data/random_forest_{}.json".format(artifact["version"])
+    saveArtifact(artifact, filename)
+    print("Random forest {} saved: {}".format(artifact["version"], filename))
@@ -0,0 +1,82 @@
+#####################################################
+# Utils file: compact encoding of the masks         #
+#                                                   #
+# Methods:                                          #
+#   - packMethods(mask, methods)                    #
+#   - unpackBand(image, name)                       #
+#   - unpackBandLocal(array, name)                  #
+#   - encodingProperties(output_mode, pack_methods, #
+#                        probability_scale)         #
+#                                                   #
+# The final mask and the four methods used by the   #
+# random forest are stored as bits of one uint8     #
+# band ("packed"), see PACKED_BITS.                 #
+# Each asset is stamped with its encoding (property #
+# "encoding", see ENCODINGS): read by               #
+# "Interpolation/load_dataset.py".                  #
+#####################################################
+
+# Bit of each band in the packed band
+PACKED_BITS: dict = {
+    "mask": 0,
+    "tree3": 1,
+    "tree2": 2,
+    "percentile1": 3,
+    "percentile5": 4,
+}
+
+# Encodings of the exported assets (band name of a single image asset):
+#   - "classification": binary mask (OUTPUT_MODE = "mask")
+#   - "packed": mask + methods bits (EXPORT_PACK_METHODS)
+#   - "probability": fraction of the trees voting "cloud" (OUTPUT_MODE = "probability")
+ENCODINGS: tuple = ("classification", "packed", "probability")
+
+
+def packMethods(mask, methods):
+    """ Pack the mask and the methods bands in one uint8 band (GEE)
+    Arguments:
+        :param mask: ee.Image, binary mask (one band)
+        :param methods: ee.Image with the bands "tree3", "tree2", "percentile1", "percentile5"
+        :return: ee.Image uint8 (band "packed")
+    """
+    packed = mask.toByte()
+    for name, bit in PACKED_BITS.items():
+        if name == "mask": continue
+        packed = packed.bitwiseOr(methods.select(name).toByte().leftShift(bit))
+    return packed.toByte().rename("packed")
+
+
+def unpackBand(image, name="mask"):
+    """ Extract one band from a packed image (GEE)
+    Arguments:
+        :param image: ee.Image with the band "packed"
+        :param name="mask": band name (see PACKED_BITS)
+        :return: ee.Image (binary, band `name`)
+    """
+    return image.select("packed") \
+                .rightShift(PACKED_BITS[name]) \
+                .bitwiseAnd(1) \
+                .rename(name)
+
+
+def unpackBandLocal(array, name="mask"):
+    """ Extract one band from a packed array (local)
+    Arguments:
+        :param array: np.ndarray uint8 (packed values)
+        :param name="mask": band name (see PACKED_BITS)
+        :return: np.ndarray uint8 (0 / 1)
+    """
+    return (array >> PACKED_BITS[name]) & 1
+
+
+def encodingProperties(output_mode, pack_methods, probability_scale):
+    """ Properties describing the encoding of an exported asset
+    Arguments:
+        :param output_mode: "mask" or "probability"
+        :param pack_methods: mask and methods packed in one band
+        :param probability_scale: value of a probability of 1 (output_mode "probability")
+        :return: python dict
+    """
+    if output_mode == "probability":
+        return {"encoding": "probability", "probability_scale": probability_scale}
+    return {"encoding": "packed" if pack_methods else "classification"}
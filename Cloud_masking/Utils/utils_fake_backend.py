@@ -0,0 +1,236 @@
+#####################################################
+# Utils file: in-memory fake backend                #
+#                                                   #
+# Class:                                            #
+#   - FakeBackend(nb_images, latency,               #
+#                 task_duration, failure_rate,      #
+#                 export_failure_rate,              #
+#                 outside_rate, inside_rate,        #
+#                 seed)                             #
+#                                                   #
+# Same methods as EarthEngineBackend                #
+# ("utils_backend.py") without any GEE request:     #
+# images, assets and tasks are simulated in memory. #
+# The simulation is deterministic (seed), each      #
+# request waits `latency` seconds and is counted in #
+# `requests` (number of requests per method).       #
+# Land: one square of land per tile, the footprint  #
+# of each image is inside, across the coast or out  #
+# of its land square (see fake_footprint).          #
+# Used to measure the process throughput offline    #
+# (see "Cloud_masking/load_test.py").               #
+#####################################################
+
+from collections import Counter         # Count requests
+import datetime                         # Generate image names
+import random                           # Simulate durations / failures
+import threading                        # Backend used by several threads
+import time                             # Latency and task durations
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils_land_index import LAND_INSIDE, LAND_PARTIAL, LAND_OUTSIDE
+from utils_grouping import group_asset_name
+from utils_fingerprint import model_fingerprint
+
+# MGRS tiles of the simulated images
+FAKE_TILES = ["29UPB", "30UUE", "30UVE", "30UWE", "30UXE", "30VUH", "30VVH", "30VWH", "31UCT", "31UDT"]
+
+# Position of the image footprints in their tile (longitude offset), see fake_footprint
+FAKE_OFFSETS = {LAND_INSIDE: 0.25, LAND_PARTIAL: 0.75, LAND_OUTSIDE: 1.25}
+
+
+def fake_land_square(k):
+    """ Land square of the k-th tile: [2k, 2k + 1] x [0, 1] (degrees)
+        :return: GeoJSON geometry
+    """
+    x = 2. * k
+    return {"type": "Polygon", "coordinates": [[[x, 0.], [x + 1, 0.], [x + 1, 1.], [x, 1.], [x, 0.]]]}
+
+
+def fake_footprint(k, land):
+    """ Footprint (0.5 degree square) of an image of the k-th tile:
+        inside its land square, across its east coast or out of land
+        :return: list of [longitude, latitude] (polygon shell)
+    """
+    x = 2. * k + FAKE_OFFSETS[land]
+    return [[x, .25], [x + .5, .25], [x + .5, .75], [x, .75], [x, .25]]
+
+
+class FakeBackend:
+    """ Deterministic in-memory backend
+    """
+
+    def __init__(self, nb_images=1000, latency=0., task_duration=(0.05, 0.5),
+                 failure_rate=0., export_failure_rate=0.,
+                 outside_rate=0.1, inside_rate=0.5, seed=0):
+        """
+        Arguments:
+            :param nb_images=1000: number of Sentinel 2 images simulated
+            :param latency=0.: time of each request (seconds)
+            :param task_duration=(0.05, 0.5): range of the task durations (seconds)
+            :param failure_rate=0.: ratio of tasks ending FAILED
+            :param export_failure_rate=0.: ratio of export starts raising an error
+            :param outside_rate=0.1: ratio of images out of land
+            :param inside_rate=0.5: ratio of images fully inside land
+            :param seed=0: random seed
+        """
+        self.latency = latency
+        self.task_duration = task_duration
+        self.failure_rate = failure_rate
+        self.export_failure_rate = export_failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+
+        # Images: one image per tile every 5 days
+        start = datetime.datetime(2017, 1, 1, 10, 54, 41)
+        self.images = {}
+        for k in range(nb_images):
+            date = (start + datetime.timedelta(days=5 * (k // len(FAKE_TILES)), seconds=k)).strftime("%Y%m%dT%H%M%S")
+            name = "{0}_{0}_T{1}".format(date, FAKE_TILES[k % len(FAKE_TILES)])
+            draw = self.random.random()
+            land = LAND_OUTSIDE if draw < outside_rate \
+                   else LAND_INSIDE if draw < outside_rate + inside_rate \
+                   else LAND_PARTIAL
+            self.images[name] = land
+
+        self.folders = {}               # folder -> set of asset ids
+        self.group_scenes = {}          # folder -> {asset id: scenes} of the grouped assets
+        self.fingerprints = {}          # asset id -> fingerprint
+        self.tasks = {}                 # task id -> task dict
+        self.counter_task = 0
+
+    def _request(self, method):
+        """ Simulate one request (count + latency)
+        """
+        with self.lock:
+            self.requests[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _update_task(self, task):
+        """ Compute the task state from the time elapsed since its start
+        """
+        if task["state"] not in ("READY", "RUNNING"):
+            return
+        elapsed = time.time() - task["start"]
+        if elapsed >= task["duration"]:
+            task["state"] = "FAILED" if task["fail"] else "COMPLETED"
+            if not task["fail"]:
+                self.folders.setdefault(task["folder"], set()).add(task["asset_id"])
+                self.fingerprints[task["asset_id"]] = task["fingerprint"]
+                if task["scenes"]:
+                    self.group_scenes.setdefault(task["folder"], {})[task["asset_id"]] = task["scenes"]
+        elif elapsed >= task["duration"] / 10:
+            task["state"] = "RUNNING"
+
+    def list_images(self, date_start, date_end, geometry):
+        self._request("list_images")
+        return ["COPERNICUS/S2/" + name for name in self.images]
+
+    def create_collection(self, folder):
+        self._request("create_collection")
+        with self.lock:
+            self.folders.setdefault(folder, set())
+
+    def list_assets(self, folder):
+        self._request("list_assets")
+        with self.lock:
+            for task in self.tasks.values():
+                self._update_task(task)
+            return sorted(self.folders.get(folder, set()))
+
+    def list_group_scenes(self, folder):
+        self._request("list_group_scenes")
+        with self.lock:
+            for task in self.tasks.values():
+                self._update_task(task)
+            return [name for scenes in self.group_scenes.get(folder, {}).values() for name in scenes]
+
+    def list_fingerprints(self, folder):
+        self._request("list_fingerprints")
+        with self.lock:
+            for task in self.tasks.values():
+                self._update_task(task)
+            groups = self.group_scenes.get(folder, {})
+            return [(asset_id, self.fingerprints.get(asset_id), groups.get(asset_id, [asset_id.split('/')[-1]]))
+                    for asset_id in sorted(self.folders.get(folder, set()))]
+
+    def delete_assets(self, asset_ids):
+        self._request("delete_assets")
+        with self.lock:
+            for asset_id in asset_ids:
+                folder = '/'.join(asset_id.split('/')[:-1])
+                self.folders.get(folder, set()).discard(asset_id)
+                self.group_scenes.get(folder, {}).pop(asset_id, None)
+                self.fingerprints.pop(asset_id, None)
+
+    def asset_update_time(self, path):
+        self._request("asset_update_time")
+        return "fake"
+
+    def download_land_geometry(self, path, page_size=500):
+        self._request("download_land_geometry")
+        return [fake_land_square(k) for k in range(len(FAKE_TILES))]
+
+    def get_footprints(self, names):
+        self._request("get_footprints")
+        return {name: fake_footprint(FAKE_TILES.index(name.split('_')[-1][1:]), self.images[name])
+                for name in names if name in self.images}
+
+    def classify_land(self, names, land_geometry):
+        self._request("classify_land")
+        return {name: self.images[name] for name in names if name in self.images}
+
+    def prepare_model(self):
+        self._request("prepare_model")
+
+    def start_export(self, name, folder, clip_land=True, num=None, total=None):
+        return self._start_task("start_export", folder, name, [], clip_land)
+
+    def start_group_export(self, names, folder, clip_land=True, num=None, total=None):
+        return self._start_task("start_group_export", folder, group_asset_name(names), names, clip_land)
+
+    def _start_task(self, method, folder, asset_name, scenes, clip_land):
+        """ Simulate the start of an export (exports clipped to land counted in "clip_land")
+        """
+        self._request(method)
+        if clip_land:
+            with self.lock:
+                self.requests["clip_land"] += 1
+        with self.lock:
+            if self.random.random() < self.export_failure_rate:
+                raise RuntimeError("Fake export error")
+            self.counter_task += 1
+            task_id = "FAKE{:08d}".format(self.counter_task)
+            self.tasks[task_id] = {"state": "READY",
+                                   "start": time.time(),
+                                   "duration": self.random.uniform(*self.task_duration),
+                                   "fail": self.random.random() < self.failure_rate,
+                                   "folder": folder,
+                                   "asset_id": folder + '/' + asset_name,
+                                   "scenes": scenes,
+                                   "fingerprint": model_fingerprint()}
+        return task_id
+
+    def task_snapshot(self, task_ids=None):
+        self._request("task_snapshot")
+        with self.lock:
+            if task_ids is None:
+                task_ids = list(self.tasks)
+            snapshot = {}
+            for task_id in task_ids:
+                if task_id in self.tasks:
+                    self._update_task(self.tasks[task_id])
+                    snapshot[task_id] = self.tasks[task_id]["state"]
+            return snapshot
+
+    def cancel_tasks(self, task_ids):
+        self._request("cancel_tasks")
+        with self.lock:
+            for task_id in task_ids:
+                task = self.tasks.get(task_id)
+                if task is not None and task["state"] in ("READY", "RUNNING"):
+                    task["state"] = "CANCELLED"
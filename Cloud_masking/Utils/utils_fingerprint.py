@@ -0,0 +1,144 @@
+#####################################################
+# Utils file: model fingerprint                     #
+#                                                   #
+# Methods:                                          #
+#   - set_land_version(land_hash)                   #
+#   - model_configuration(numberOfTrees,            #
+#                         output_mode,              #
+#                         pack_methods,             #
+#                         classifier_file)          #
+#   - model_fingerprint(...)                        #
+#   - find_stale(fingerprints, fingerprint,         #
+#                image_names)                       #
+#                                                   #
+# Each mask is stamped with the hash of the model   #
+# version and of the parameters changing its values #
+# (property "fingerprint"). After a change in       #
+# "parameters.py", only the masks with another      #
+# fingerprint are processed again.                  #
+#####################################################
+
+import hashlib                          # Fingerprint
+import json                             # Serialize the configuration
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '..'))
+sys.path.append(os.path.join(BASE_DIR, '..', 'Tree_methods'))
+
+import parameters
+from tree_rules import TREE_RULES
+
+# Version of the model code: increase it when a change in the code
+# modifies the masks (not only the parameters)
+MODEL_VERSION = 1
+
+# Artifact versions already read (key: classifier file)
+_ARTIFACT_VERSIONS = {}
+
+
+def _artifact_version(classifier_file):
+    """ Version of a random forest artifact (read once per run)
+    """
+    if classifier_file not in _ARTIFACT_VERSIONS:
+        with open(classifier_file, "r") as f:
+            _ARTIFACT_VERSIONS[classifier_file] = json.load(f)["version"]
+    return _ARTIFACT_VERSIONS[classifier_file]
+
+
+def set_land_version(land_hash):
+    """ Store the version of the land geometry (requested once per run by the process)
+    Arguments:
+        :param land_hash: hash of parameters.land_geometry (see utils_prefilter.land_geometry_hash)
+    """
+    parameters.LAND_VERSION = land_hash
+
+
+def _land_version():
+    """ Version of the land geometry clipping the masks: the hash changes
+        when the asset is updated (requested on GEE side if not set by the process)
+    """
+    if parameters.LAND_VERSION is None:
+        from utils_backend import EarthEngineBackend
+        from utils_prefilter import land_geometry_hash
+        set_land_version(land_geometry_hash(parameters.land_geometry, EarthEngineBackend(use_scene_index=False)))
+    return parameters.LAND_VERSION
+
+
+def model_configuration(numberOfTrees=None, output_mode=None,
+                        pack_methods=None, classifier_file=None):
+    """ Everything changing the mask values
+        The "mask" output is the majority vote of the trees: the cutoff
+        (parameters.CUTTOF) has no effect on it and is not part of the configuration
+    Arguments:
+        :param numberOfTrees=parameters.NUMBER_TREES: size of forest
+        :param output_mode=parameters.OUTPUT_MODE: "mask" or "probability"
+        :param pack_methods=parameters.EXPORT_PACK_METHODS: methods packed in the output
+        :param classifier_file=parameters.CLASSIFIER_FILE: random forest artifact
+        :return: python dict
+    """
+    if numberOfTrees is None: numberOfTrees = parameters.NUMBER_TREES
+    if output_mode is None: output_mode = parameters.OUTPUT_MODE
+    if pack_methods is None: pack_methods = parameters.EXPORT_PACK_METHODS
+    if classifier_file is None: classifier_file = parameters.CLASSIFIER_FILE
+
+    configuration = {
+        "model_version": MODEL_VERSION,
+        "methods": parameters.METHODS_NAME,
+        "tree_rules": TREE_RULES,
+        "coef_normalisation": parameters.COEF_NORMALISATION,
+        "background": parameters.PARAMS_SELECTBACKGROUND_DEFAULT,
+        "clustering": parameters.PARAMS_CLOUDCLUSTERSCORE_DEFAULT,
+        "number_hours": parameters.NUMBER_HOURS,
+        "common_area": parameters.COMMON_AREA,
+        "scene_index": parameters.USE_SCENE_INDEX,
+        "combined_background": parameters.COMBINED_BACKGROUND,
+        "output_mode": output_mode,
+        "pack_methods": bool(pack_methods),
+        "data_type": parameters.EXPORT_DATA_TYPE,
+        # Masks clipped to the land geometry: a new version of the asset changes them
+        "land": {"geometry": parameters.land_geometry,
+                 "version": _land_version()},
+    }
+    if output_mode == "probability":
+        # The cutoff is applied after
+        configuration["probability_scale"] = parameters.PROBABILITY_SCALE
+
+    if classifier_file:
+        configuration["classifier"] = _artifact_version(classifier_file)
+    else:
+        # Forest trained on GEE side
+        configuration["classifier"] = {"training_data": parameters.TRAINING_DATA,
+                                       "numberOfTrees": numberOfTrees}
+    return configuration
+
+
+def model_fingerprint(**kwargs):
+    """ Hash of the model configuration (same arguments as model_configuration)
+        :return: python string (12 hexadecimal characters)
+    """
+    content = json.dumps(model_configuration(**kwargs), sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+
+
+def find_stale(fingerprints, fingerprint, image_names):
+    """ Assets computed with another configuration
+        A grouped asset is only stale if all its scenes are processed again
+        (the other scenes would be lost)
+    Arguments:
+        :param fingerprints: list of (asset_id, fingerprint, scenes), see ShardPolicy.list_fingerprints
+        :param fingerprint: current fingerprint
+        :param image_names: images processed by the current execution
+        :return: stale assets (python list of asset ids), stale scenes (python set)
+    """
+    image_names = set(image_names)
+    assets, scenes = [], set()
+    for asset_id, asset_fingerprint, asset_scenes in fingerprints:
+        if asset_fingerprint == fingerprint:
+            continue
+        if not set(asset_scenes) <= image_names:
+            continue
+        assets.append(asset_id)
+        scenes.update(asset_scenes)
+    return assets, scenes
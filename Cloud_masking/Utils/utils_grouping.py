@@ -0,0 +1,70 @@
+#####################################################
+# Utils file: multi-scene (grouped) exports         #
+#                                                   #
+# Methods:                                          #
+#   - group_key(name, group_days)                   #
+#   - group_asset_name(names)                       #
+#   - group_band_name(index)                        #
+#   - group_properties(names)                       #
+#                                                   #
+# The scenes sharing a MGRS tile and a date window  #
+# of `group_days` days are exported in one asset    #
+# (one task): one band per scene. The scene of each #
+# band is stored in the asset property "scenes"     #
+# (comma separated names, band order).              #
+# Reader: "Interpolation/load_dataset.py"           #
+# (unpackMaskCollection).                           #
+#####################################################
+
+import datetime                         # Date windows
+import hashlib                          # Asset names
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils_queue import image_date, image_tile
+
+# First day of the date windows
+GROUP_ORIGIN = datetime.datetime(2015, 1, 1)
+
+
+def group_key(name, group_days):
+    """ Group of a scene: MGRS tile + first day of its date window
+        Ex: "20180103T105441_20180103T105435_T31UDT" -> "T31UDT_20171216" (group_days=30)
+    Arguments:
+        :param name: image name (without "COPERNICUS/S2/")
+        :param group_days: length of the date windows (days)
+        :return: python string
+    """
+    date = datetime.datetime.strptime(image_date(name)[:8], "%Y%m%d")
+    window = (date - GROUP_ORIGIN).days // group_days
+    start = GROUP_ORIGIN + datetime.timedelta(days=window * group_days)
+    return "T{}_{}".format(image_tile(name), start.strftime("%Y%m%d"))
+
+
+def group_asset_name(names):
+    """ Asset name of a group of scenes: first scene group key + hash of the scenes
+        (a date window split in several tasks gives several assets)
+    Arguments:
+        :param names: list of image names
+        :return: python string
+    """
+    digest = hashlib.md5(",".join(sorted(names)).encode("utf-8")).hexdigest()[:8]
+    return "T{}_{}_{}".format(image_tile(names[0]), image_date(min(names))[:8], digest)
+
+
+def group_band_name(index):
+    """ Band name of the `index`-th scene of a group
+    """
+    return "b{:02d}".format(index)
+
+
+def group_properties(names):
+    """ Properties of a group asset (band to scene index)
+    Arguments:
+        :param names: list of image names (band order)
+        :return: python dict
+    """
+    return {"scenes": ",".join(names),
+            "nb_scenes": len(names),
+            "MGRS_TILE": image_tile(names[0])}
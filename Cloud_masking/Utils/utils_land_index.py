@@ -0,0 +1,116 @@
+#####################################################
+# Utils file: local index of the land geometry      #
+#                                                   #
+# Constants:                                        #
+#   - LAND_INSIDE, LAND_PARTIAL, LAND_OUTSIDE       #
+# Class:                                            #
+#   - LandIndex(geometries, inside_margin)          #
+#       - Load(land_geometry, land_hash,            #
+#              download_function, cache_dir)        #
+#       - classify(footprint)                       #
+#       - intersects(footprint)                     #
+#       - contains(footprint)                       #
+#                                                   #
+# The land polygons are downloaded once (backend)   #
+# and stored on disk (GeoJSON). An STRtree answers  #
+# the footprint / land questions locally, without   #
+# any GEE request. The "inside" test uses the land  #
+# shrunk by LAND_INSIDE_MARGIN (planar test, GEE    #
+# clips with geodesic edges).                       #
+#####################################################
+
+import json                             # Store the polygons
+import os
+from shapely.geometry import shape, Polygon     # Handle geometries
+from shapely.strtree import STRtree             # Spatial index
+from shapely.ops import unary_union
+from shapely.prepared import prep
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+# Position of an image footprint against the land geometry
+LAND_INSIDE = "inside"          # Footprint fully inside land: no clip needed
+LAND_PARTIAL = "partial"        # Footprint partially on land: clip needed
+LAND_OUTSIDE = "outside"        # Footprint out of land: image ignored
+
+
+class LandIndex:
+    """ Local spatial index of the land polygons
+    """
+
+    def __init__(self, geometries, inside_margin=None):
+        """
+        Arguments:
+            :param geometries: list of GeoJSON geometries (land polygons)
+            :param inside_margin=parameters.LAND_INSIDE_MARGIN: safety margin of the
+                                 "inside" test (degrees)
+        """
+        if inside_margin is None: inside_margin = parameters.LAND_INSIDE_MARGIN
+
+        self.polygons = [shape(geometry) for geometry in geometries]
+        self.tree = STRtree(self.polygons)
+        # Union of the polygons: a footprint over two polygons is still inside land
+        union = unary_union(self.polygons)
+        # Shrunk by the margin: the planar test never skips a clip needed by GEE
+        self.union = prep(union.buffer(-inside_margin) if inside_margin else union)
+
+    @staticmethod
+    def Load(land_geometry, land_hash, download_function, cache_dir=None):
+        """ Load the index from the disk, download the polygons the first time
+        Arguments:
+            :param land_geometry: path to a GEE featureCollection
+            :param land_hash: hash of the land geometry (see land_geometry_hash)
+            :param download_function: function(land_geometry) -> list of GeoJSON geometries
+                                      (ex: EarthEngineBackend.download_land_geometry)
+            :param cache_dir=parameters.LAND_CACHE_DIR: folder of the cached polygons
+            :return: LandIndex
+        """
+        if cache_dir is None: cache_dir = parameters.LAND_CACHE_DIR
+
+        cache_file = os.path.join(cache_dir, "land_{}.json".format(land_hash))
+        if os.path.isfile(cache_file):
+            with open(cache_file, "r") as f:
+                geometries = json.load(f)
+        else:
+            geometries = download_function(land_geometry)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(cache_file, "w") as f:
+                json.dump(geometries, f)
+        return LandIndex(geometries)
+
+    def _candidates(self, footprint):
+        # shapely < 2 returns geometries, shapely >= 2 returns indices
+        return [elt if hasattr(elt, "geom_type") else self.polygons[elt]
+                for elt in self.tree.query(footprint)]
+
+    def intersects(self, footprint):
+        """ Return True if the footprint intersects land
+        Arguments:
+            :param footprint: shapely geometry
+        """
+        return any(polygon.intersects(footprint) for polygon in self._candidates(footprint))
+
+    def contains(self, footprint):
+        """ Return True if the footprint is fully inside land (at more than the margin
+            from the coast)
+        Arguments:
+            :param footprint: shapely geometry
+        """
+        return self.union.contains(footprint)
+
+    def classify(self, footprint):
+        """ Return the position of the footprint against land
+        Arguments:
+            :param footprint: shapely geometry or list of coordinates (polygon shell)
+            :return: LAND_INSIDE, LAND_PARTIAL or LAND_OUTSIDE
+        """
+        if isinstance(footprint, list):
+            footprint = Polygon(footprint)
+        if not self.intersects(footprint):
+            return LAND_OUTSIDE
+        if self.contains(footprint):
+            return LAND_INSIDE
+        return LAND_PARTIAL
@@ -0,0 +1,240 @@
+#####################################################
+# Utils file: job ledger (image processing status)  #
+#                                                   #
+# Class:                                            #
+#   - JobLedger(path)                               #
+#       - upsert(name, result, task_id)             #
+#       - upsert_many(rows)                         #
+#       - remove(names)                             #
+#       - get_names()                               #
+#       - get_rows(results)                         #
+#       - count(results)                            #
+#       - count_tasks(results)                      #
+#       - import_excel(excel_file)                  #
+#       - export(filename)                          #
+#       - get_land_classes(land_hash)               #
+#       - set_land_classes(land_hash, values)       #
+#       - get_queue()                               #
+#       - add_queue(rows)                           #
+#       - remove_queue(names)                       #
+#                                                   #
+# The ledger is a SQLite database (WAL mode) with   #
+# one row per image. Each update only writes the    #
+# rows that changed. The xlsx / csv file is only    #
+# produced on demand (`export`) for humans.         #
+# The ledger also caches the position of the images #
+# against land (inside, partial, outside)           #
+# (key: image name + land geometry hash) and the    #
+# queue of images waiting to be processed           #
+#####################################################
+
+import sqlite3                          # Embedded database
+import time                             # Row update time
+import os                               # Handle files
+
+
+# States considered as "task in progress" on GEE side
+ACTIVE_STATES = ("READY", "RUNNING")
+
+
+class JobLedger:
+    """ Store the state of each image processed by the cloud masking process
+        Each row: Name (image id) | Result (task state) | Task_id | Updated (timestamp)
+    """
+
+    def __init__(self, path):
+        """ Open (or create) the ledger
+        Arguments:
+            :param path: path to the SQLite file
+        """
+        self.path = os.path.normpath(path)
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.is_new = not os.path.isfile(self.path)
+
+        # isolation_level=None: transactions are handled explicitly (see _transaction)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                name    TEXT PRIMARY KEY,
+                result  TEXT NOT NULL,
+                task_id TEXT,
+                updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_images_result ON images(result);
+            CREATE INDEX IF NOT EXISTS idx_images_task_id ON images(task_id);
+            CREATE TABLE IF NOT EXISTS land_class (
+                name       TEXT NOT NULL,
+                land_hash  TEXT NOT NULL,
+                land       TEXT NOT NULL,
+                PRIMARY KEY (name, land_hash)
+            );
+            CREATE TABLE IF NOT EXISTS queue (
+                name     TEXT PRIMARY KEY,
+                priority TEXT NOT NULL
+            );
+        """)
+
+    def _transaction(self, query, rows):
+        """ Run the query on all the rows in one transaction
+            (either all rows are written or none)
+        Arguments:
+            :param query: SQL query
+            :param rows: list of tuples (query parameters)
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            cursor.executemany(query, rows)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def upsert(self, name, result, task_id=None):
+        """ Insert or update one image row
+        Arguments:
+            :param name: image name (id)
+            :param result: state ("Out of area", "READY", "RUNNING", "COMPLETED", "FAILED"...)
+            :param task_id=None: GEE task id
+        """
+        self.upsert_many([(name, result, task_id)])
+
+    def upsert_many(self, rows):
+        """ Insert or update several image rows in one transaction
+        Arguments:
+            :param rows: list of (name, result, task_id)
+        """
+        now = time.time()
+        self._transaction("INSERT INTO images(name, result, task_id, updated) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT(name) DO UPDATE SET result=excluded.result, "
+                          "task_id=excluded.task_id, updated=excluded.updated",
+                          [(name, result, task_id, now) for name, result, task_id in rows])
+
+    def remove(self, names):
+        """ Remove the given images from the ledger
+        Arguments:
+            :param names: list of image names
+        """
+        self._transaction("DELETE FROM images WHERE name = ?", [(name,) for name in names])
+
+    def get_names(self):
+        """ Return all the image names stored in the ledger
+            :return: python list
+        """
+        return [row[0] for row in self.connection.execute("SELECT name FROM images")]
+
+    def get_rows(self, results=None):
+        """ Return the rows matching one of the given states
+        Arguments:
+            :param results=None: list of states (None: all the rows)
+            :return: list of (name, result, task_id)
+        """
+        if results is None:
+            return self.connection.execute("SELECT name, result, task_id FROM images").fetchall()
+        query = "SELECT name, result, task_id FROM images WHERE result IN ({})" \
+                    .format(", ".join("?" * len(results)))
+        return self.connection.execute(query, tuple(results)).fetchall()
+
+    def count(self, results):
+        """ Return the number of images in one of the given states
+        Arguments:
+            :param results: list of states
+            :return: int
+        """
+        query = "SELECT COUNT(*) FROM images WHERE result IN ({})".format(", ".join("?" * len(results)))
+        return self.connection.execute(query, tuple(results)).fetchone()[0]
+
+    def count_tasks(self, results):
+        """ Return the number of tasks of the images in one of the given states
+            (grouped exports: one task for several images)
+        Arguments:
+            :param results: list of states
+            :return: int
+        """
+        query = "SELECT COUNT(DISTINCT task_id) FROM images WHERE result IN ({})" \
+                    .format(", ".join("?" * len(results)))
+        return self.connection.execute(query, tuple(results)).fetchone()[0]
+
+    def import_excel(self, excel_file):
+        """ Load the rows of an xlsx status file (written by previous versions)
+        Arguments:
+            :param excel_file: path to the xlsx file (columns Name, Result, Task_id)
+        """
+        import pandas as pd
+        data = pd.read_excel(excel_file)
+        rows = [(str(name), str(result), None if pd.isna(task_id) else str(task_id))
+                for name, result, task_id in zip(data.Name, data.Result, data.Task_id)]
+        self.upsert_many(rows)
+
+    def export(self, filename):
+        """ Export the ledger in a human readable file (xlsx or csv)
+        Arguments:
+            :param filename: output file, the extension gives the format
+        """
+        import pandas as pd
+        output = pd.DataFrame(self.get_rows(), columns=["Name", "Result", "Task_id"]) \
+                   .set_index("Name")
+        if filename.lower().endswith(".csv"):
+            output.to_csv(filename)
+        else:
+            output.to_excel(filename)
+
+    def get_land_classes(self, land_hash):
+        """ Return the position against land cached for the given land geometry
+        Arguments:
+            :param land_hash: hash of the land geometry
+            :return: python dict {name: "inside" | "partial" | "outside"}
+        """
+        rows = self.connection.execute("SELECT name, land FROM land_class WHERE land_hash = ?",
+                                       (land_hash,))
+        return dict(rows.fetchall())
+
+    def set_land_classes(self, land_hash, values):
+        """ Cache the position against land of several images (one transaction)
+        Arguments:
+            :param land_hash: hash of the land geometry
+            :param values: python dict {name: "inside" | "partial" | "outside"}
+        """
+        self._transaction("INSERT OR REPLACE INTO land_class(name, land_hash, land) VALUES (?, ?, ?)",
+                          [(name, land_hash, land) for name, land in values.items()])
+
+    def get_queue(self):
+        """ Return the images waiting to be processed
+            :return: list of (name, priority)
+        """
+        return self.connection.execute("SELECT name, priority FROM queue").fetchall()
+
+    def add_queue(self, rows):
+        """ Add images to the queue (one transaction)
+        Arguments:
+            :param rows: list of (name, priority), priority is a string
+        """
+        self._transaction("INSERT OR REPLACE INTO queue(name, priority) VALUES (?, ?)", rows)
+
+    def remove_queue(self, names):
+        """ Remove images from the queue (one transaction)
+        Arguments:
+            :param names: list of image names
+        """
+        self._transaction("DELETE FROM queue WHERE name = ?", [(name,) for name in names])
+
+    def close(self):
+        """ Close the database connection
+        """
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # Export the ledger to the xlsx file (human readable)
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import parameters
+
+    ledger = JobLedger(parameters.ledger_file)
+    ledger.export(parameters.excel_file)
+    ledger.close()
@@ -0,0 +1,89 @@
+#####################################################
+# Utils file: land intersection prefilter           #
+#                                                   #
+# Methods:                                          #
+#   - land_geometry_hash(land_geometry, backend)    #
+#   - classifyLandIntersection(image_names,         #
+#                              land_geometry,       #
+#                              ledger,              #
+#                              backend,             #
+#                              page_size,           #
+#                              use_land_index)      #
+#                                                   #
+# The position of each image against the land       #
+# geometry (inside, partial, outside) is computed   #
+# by pages of images (one GEE request per page) and #
+# cached in the ledger: the images are never        #
+# requested twice for the same land geometry.       #
+# With the local land index, GEE only returns the   #
+# footprints, the classification is done locally.   #
+#####################################################
+
+import hashlib                          # Hash land geometry
+import logging                          # Write logs
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+from utils import list_reshape
+from utils_land_index import LandIndex
+
+
+def land_geometry_hash(land_geometry, backend):
+    """ Return a hash identifying the land geometry
+        For an asset, the hash changes when the asset is updated
+    Arguments:
+        :param land_geometry: path to a GEE featureCollection or ee.FeatureCollection
+        :param backend: EarthEngineBackend (or any backend)
+        :return: python string
+    """
+    if isinstance(land_geometry, str):
+        key = land_geometry + str(backend.asset_update_time(land_geometry))
+    else:
+        key = land_geometry.serialize()
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def classifyLandIntersection(image_names, land_geometry, ledger, backend,
+                             page_size=None, use_land_index=None):
+    """ Return the position of the images against the land geometry
+    Arguments:
+        :param image_names: list of image names (without "COPERNICUS/S2/")
+        :param land_geometry: path to a GEE featureCollection or ee.FeatureCollection
+        :param ledger: JobLedger (cache of the classification)
+        :param backend: EarthEngineBackend (or any backend)
+        :param page_size=parameters.PREFILTER_PAGE_SIZE: number of images per GEE request
+        :param use_land_index=parameters.USE_LAND_INDEX: classify the footprints locally
+                              (only for a land geometry given as a path)
+        :return: python dict {name: LAND_INSIDE | LAND_PARTIAL | LAND_OUTSIDE}
+    """
+    if page_size is None: page_size = parameters.PREFILTER_PAGE_SIZE
+    if use_land_index is None: use_land_index = parameters.USE_LAND_INDEX
+
+    land_hash = land_geometry_hash(land_geometry, backend)
+
+    cache = ledger.get_land_classes(land_hash)
+    output = {name: cache[name] for name in image_names if name in cache}
+    to_request = [name for name in image_names if name not in cache]
+    if not to_request:
+        return output
+
+    if use_land_index and isinstance(land_geometry, str):
+        # Request the footprints, classify them locally
+        land_index = LandIndex.Load(land_geometry, land_hash, backend.download_land_geometry)
+        classify_page = lambda page: {name: land_index.classify(footprint)
+                                      for name, footprint in backend.get_footprints(page).items()}
+    else:
+        # Classify on GEE side
+        classify_page = lambda page: backend.classify_land(page, land_geometry)
+
+    nb_pages = -(-len(to_request) // page_size)
+    for k, page in enumerate(list_reshape(to_request, page_size)):
+        values = classify_page(page)
+        # Save each page: a stopped process doesn't request it again
+        ledger.set_land_classes(land_hash, values)
+        output.update(values)
+        logging.info("\t- Land intersection: page {}/{}".format(k + 1, nb_pages))
+
+    return output
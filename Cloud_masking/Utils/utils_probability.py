@@ -0,0 +1,87 @@
+#####################################################
+# Utils file: probability outputs                   #
+#                                                   #
+# Methods:                                          #
+#   - quantizeProbability(probability)              #
+#   - probabilityToMask(image, threshold)           #
+#   - probabilityToMaskLocal(probability,           #
+#                            threshold, nodata)     #
+#                                                   #
+# With OUTPUT_MODE = "probability", the model       #
+# stores the fraction of the trees voting "cloud"   #
+# (uint8, PROBABILITY_SCALE = 100 %). The masks at  #
+# any cutoff are computed from the stored values    #
+# (no recomputation of the model).                  #
+# OUTPUT_MODE = "mask" is the majority vote of the  #
+# trees: cutoff MAJORITY_VOTE (0.5), not CUTTOF.    #
+#                                                   #
+# Usage (local probability raster to mask):         #
+#   python Cloud_masking/Utils/utils_probability.py #
+#       probability.tif mask.tif [threshold]        #
+#####################################################
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+# Cutoff reproducing the masks of OUTPUT_MODE = "mask" (class of the majority of the trees)
+MAJORITY_VOTE = 0.5
+
+
+def quantizeProbability(probability):
+    """ Quantise probabilities to uint8 (local arrays)
+    Arguments:
+        :param probability: np.ndarray of values in [0, 1]
+        :return: np.ndarray uint8 (0 to PROBABILITY_SCALE)
+    """
+    import numpy as np
+    return np.round(probability * parameters.PROBABILITY_SCALE).astype(np.uint8)
+
+
+def probabilityToMask(image, threshold=MAJORITY_VOTE):
+    """ Cloud mask from a probability image (GEE, server side)
+    Arguments:
+        :param image: ee.Image with a "probability" band (OUTPUT_MODE = "probability")
+        :param threshold=MAJORITY_VOTE: cutoff on the fraction of the trees voting "cloud"
+                         (MAJORITY_VOTE: same mask as OUTPUT_MODE = "mask")
+        :return: ee.Image: 0 cloud free, 1 cloudy (band "classification")
+    """
+    return image.select("probability") \
+                .gt(threshold * parameters.PROBABILITY_SCALE) \
+                .rename("classification")
+
+
+def probabilityToMaskLocal(probability, threshold=MAJORITY_VOTE, nodata=None):
+    """ Cloud mask from a local probability array
+    Arguments:
+        :param probability: np.ndarray uint8 (OUTPUT_MODE = "probability")
+        :param threshold=MAJORITY_VOTE: cutoff on the fraction of the trees voting "cloud"
+                         (MAJORITY_VOTE: same mask as OUTPUT_MODE = "mask")
+        :param nodata=None: no data value (kept in the mask), None: no masked pixel
+        :return: np.ndarray uint8: 0 cloud free, 1 cloudy, `nodata` masked
+    """
+    import numpy as np
+
+    mask = (probability > threshold * parameters.PROBABILITY_SCALE).astype(np.uint8)
+    if nodata is not None:
+        mask[probability == nodata] = nodata
+    return mask
+
+
+if __name__ == "__main__":
+    import tifffile
+
+    if len(sys.argv) < 3:
+        print("Usage: python utils_probability.py probability.tif mask.tif [threshold]")
+        sys.exit(1)
+
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else MAJORITY_VOTE
+    probability = tifffile.memmap(sys.argv[1], mode="r")
+    mask = tifffile.memmap(sys.argv[2], shape=probability.shape, dtype=probability.dtype)
+    # Row by row: the memory used does not depend on the raster size
+    for row in range(probability.shape[0]):
+        mask[row] = probabilityToMaskLocal(probability[row], threshold, nodata=255)
+    mask.flush()
+    print("Mask (cutoff {}) saved: {}".format(threshold, sys.argv[2]))
@@ -0,0 +1,168 @@
+#####################################################
+# Utils file: queue of the images to process        #
+#                                                   #
+# Methods:                                          #
+#   - image_date(name)                              #
+#   - image_tile(name)                              #
+# Class:                                            #
+#   - WorkQueue(ledger, policy, cost_function)      #
+#       - sync(image_names)                         #
+#       - pop_many(n)                               #
+#       - pop_groups(n, key_function, max_size)     #
+#                                                   #
+# The images are stored in a heap (pop in           #
+# O(log n)) ordered by a policy:                    #
+#   - "date": acquisition date                      #
+#   - "tile": MGRS tile, then date (images of one   #
+#             tile share their background images)   #
+#   - "cost": estimated cost (cost_function), then  #
+#             date                                  #
+# The queue is saved in the ledger (priority +      #
+# policy): a restarted process keeps the same order #
+# (priorities computed again if the policy changed) #
+#####################################################
+
+import heapq                            # Priority queue
+import json                             # Save priorities
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+
+def image_date(name):
+    """ Return the acquisition date of a Sentinel 2 image from its name
+        Ex: "20180101T105441_20180101T105435_T31UDT" -> "20180101T105441"
+    Arguments:
+        :param name: image name (without "COPERNICUS/S2/")
+    """
+    return name.split('_')[0]
+
+
+def image_tile(name):
+    """ Return the MGRS tile of a Sentinel 2 image from its name
+        Ex: "20180101T105441_20180101T105435_T31UDT" -> "31UDT"
+    Arguments:
+        :param name: image name (without "COPERNICUS/S2/")
+    """
+    return name.split('_')[-1][1:]
+
+
+# Sort key of each ordering policy
+ORDERING_POLICIES = {
+    "date": lambda name, cost_function: [image_date(name), name],
+    "tile": lambda name, cost_function: [image_tile(name), image_date(name), name],
+    "cost": lambda name, cost_function: [cost_function(name), image_date(name), name],
+}
+
+
+class WorkQueue:
+    """ Queue of the images waiting to be processed
+    """
+
+    def __init__(self, ledger, policy=None, cost_function=None):
+        """ Load the queue saved in the ledger
+        Arguments:
+            :param ledger: JobLedger (queue storage)
+            :param policy=parameters.QUEUE_ORDERING: "date", "tile" or "cost"
+            :param cost_function=None: function(name) -> estimated cost (policy "cost")
+        """
+        if policy is None: policy = parameters.QUEUE_ORDERING
+        if policy not in ORDERING_POLICIES:
+            raise ValueError("The queue ordering must be one of: {}".format(", ".join(ORDERING_POLICIES)))
+        if policy == "cost" and cost_function is None:
+            raise ValueError("The 'cost' ordering requires a cost_function")
+
+        self.ledger = ledger
+        self.policy = policy
+        self.cost_function = cost_function
+
+        self.heap = []
+        policies = set()
+        for name, priority in ledger.get_queue():
+            priority = json.loads(priority)
+            # Priorities saved without policy (list): previous ledger format
+            if isinstance(priority, dict):
+                policies.add(priority["policy"])
+                priority = priority["key"]
+            else:
+                policies.add(None)
+            self.heap.append((priority, name))
+        self.names = set(name for _, name in self.heap)
+
+        # Queue saved with another policy: the sort keys are not comparable
+        if policies - {policy}:
+            self.heap = [(self.priority(name), name) for name in self.names]
+            self.ledger.add_queue([(name, self.dumps(priority)) for priority, name in self.heap])
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.names)
+
+    def priority(self, name):
+        """ Sort key of an image with the current policy
+        """
+        return ORDERING_POLICIES[self.policy](name, self.cost_function)
+
+    def dumps(self, priority):
+        """ Priority saved in the ledger (json: sort key + policy)
+        """
+        return json.dumps({"policy": self.policy, "key": priority})
+
+    def sync(self, image_names):
+        """ Set the content of the queue: add the new images, remove the ones missing
+            The images already in the queue keep their priority (position)
+        Arguments:
+            :param image_names: list of the images to process
+        """
+        image_names = set(image_names)
+        to_remove = self.names - image_names
+        to_add = [(self.priority(name), name) for name in image_names - self.names]
+
+        if to_remove:
+            self.heap = [elt for elt in self.heap if elt[1] not in to_remove]
+            heapq.heapify(self.heap)
+            self.ledger.remove_queue(list(to_remove))
+        for elt in to_add:
+            heapq.heappush(self.heap, elt)
+        self.ledger.add_queue([(name, self.dumps(priority)) for priority, name in to_add])
+        self.names = image_names
+
+    def pop_many(self, n):
+        """ Remove and return the n first images (the ledger is updated in one transaction)
+        Arguments:
+            :param n: number of images
+            :return: list of image names
+        """
+        output = [heapq.heappop(self.heap)[1] for _ in range(min(n, len(self.heap)))]
+        self.names.difference_update(output)
+        self.ledger.remove_queue(output)
+        return output
+
+    def pop_groups(self, n, key_function, max_size):
+        """ Remove and return the first images gathered in at most n groups
+            (consecutive images of the same key, ex: same tile and date window
+            with the "tile" ordering). The ledger is updated in one transaction
+        Arguments:
+            :param n: number of groups
+            :param key_function: function(name) -> group key
+            :param max_size: maximum number of images per group
+            :return: list of groups (lists of image names)
+        """
+        groups, open_groups = [], {}
+        while self.heap:
+            name = self.heap[0][1]
+            key = key_function(name)
+            group = open_groups.get(key)
+            if group is None or len(group) == max_size:
+                if len(groups) == n:
+                    break
+                group = open_groups[key] = []
+                groups.append(group)
+            group.append(heapq.heappop(self.heap)[1])
+
+        output = [name for group in groups for name in group]
+        self.names.difference_update(output)
+        self.ledger.remove_queue(output)
+        return groups
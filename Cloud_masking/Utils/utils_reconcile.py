@@ -0,0 +1,62 @@
+#####################################################
+# Utils file: resume a stopped process              #
+#                                                   #
+# Methods:                                          #
+#   - reconcileLedger(ledger, backend,              #
+#                     image_done)                   #
+#                                                   #
+# The images READY or RUNNING in the ledger (tasks  #
+# started by a previous execution) are matched      #
+# against the live task list and the assets:        #
+#   - asset existing or task completed: COMPLETED   #
+#   - task still READY / RUNNING: adopted (polled   #
+#     again by the new process)                     #
+#   - task failed: FAILED (as during the process)   #
+#   - task cancelled or unknown: removed from the   #
+#     ledger (processed again)                      #
+#####################################################
+
+import logging                          # Write logs
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils_ledger import ACTIVE_STATES
+
+
+def reconcileLedger(ledger, backend, image_done):
+    """ Update the images in progress according to the live tasks and the assets
+    Arguments:
+        :param ledger: JobLedger
+        :param backend: EarthEngineBackend (or any backend)
+        :param image_done: names of the images already stored in the GEE folder
+        :return: python dict of the tasks still in progress {task_id: (names, state)}
+                 (names: list, several images for the grouped exports)
+    """
+    rows = ledger.get_rows(ACTIVE_STATES)
+    if not rows:
+        return {}
+
+    image_done = set(image_done)
+    snapshot = backend.task_snapshot([task_id for _, _, task_id in rows if task_id])
+
+    adopted, finished, lost = {}, [], []
+    for name, _, task_id in rows:
+        state = snapshot.get(task_id)
+        if name in image_done or state == "COMPLETED":
+            finished.append((name, "COMPLETED", task_id))
+        elif state == "FAILED":
+            finished.append((name, "FAILED", task_id))
+        elif state in ACTIVE_STATES:
+            adopted.setdefault(task_id, ([], state))[0].append(name)
+        else:
+            lost.append(name)
+
+    # One transaction for each kind of update
+    ledger.upsert_many(finished + [(name, state, task_id) for task_id, (names, state) in adopted.items()
+                                   for name in names])
+    ledger.remove(lost)
+
+    logging.info("\t- Tasks of the previous execution: {} finished, {} still running, {} lost (processed again)"
+                 .format(len(finished), sum(len(names) for names, _ in adopted.values()), len(lost)))
+    return adopted
@@ -0,0 +1,202 @@
+#####################################################
+# Utils file: scene metadata index                  #
+#                                                   #
+# Class:                                            #
+#   - SceneIndex(load_function, valids_function,    #
+#                cache)                             #
+#       - tile(tile)                                #
+#       - neighbours(name, nb_images)               #
+#       - select_backgrounds(name,                  #
+#                            number_of_images,      #
+#                            number_preselect)      #
+#                                                   #
+# The metadata of the Sentinel 2 scenes of a MGRS   #
+# tile (name, time_start, cloudy percentage,        #
+# footprint) are requested once per run and sorted  #
+# by date. The background candidates of the methods #
+# percentile 1 and 5 (method1 / method5 in          #
+# "Background_methods/background_methods.py") are   #
+# then selected locally with a bisection: the GEE   #
+# graph receives a fixed list of image ids.         #
+# The common area and the valid pixels ratio of the #
+# candidates are cached (see                        #
+# "utils_candidate_cache.py").                      #
+# The common area is a planar overlap of the        #
+# footprints in degrees (GEE: geodesic overlap):    #
+# the selection may differ near COMMON_AREA.        #
+#####################################################
+
+from bisect import bisect_left, bisect_right    # Search by date
+import threading                        # Index shared by the submission threads
+import os
+import sys
+from shapely.geometry import Polygon    # Footprints
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+from utils_queue import image_tile
+from utils_candidate_cache import roi_hash
+
+
+class _TileIndex:
+    """ Scenes of one tile sorted by time_start
+    """
+
+    def __init__(self, rows):
+        """
+        Arguments:
+            :param rows: list of (name, time_start, cloudy percentage, footprint coordinates)
+        """
+        rows = sorted(rows, key=lambda row: row[1])
+        self.names = [row[0] for row in rows]
+        self.times = [row[1] for row in rows]
+        self.cloudy = [row[2] for row in rows]
+        self.coordinates = [row[3] for row in rows]
+        self.position = {name: k for k, name in enumerate(self.names)}
+        self._footprints = {}
+
+    def footprint(self, k):
+        """ Footprint of the k-th scene (shapely Polygon, built on first use)
+        """
+        if k not in self._footprints:
+            polygon = Polygon(self.coordinates[k])
+            self._footprints[k] = polygon if polygon.is_valid else polygon.buffer(0)
+        return self._footprints[k]
+
+
+class SceneIndex:
+    """ Time sorted metadata of the scenes, loaded once per tile
+    """
+
+    def __init__(self, load_function, valids_function=None, cache=None):
+        """
+        Arguments:
+            :param load_function: function(tile) -> list of (name, time_start, cloudy percentage,
+                                  footprint coordinates), ex: EarthEngineBackend.list_tile_scenes
+            :param valids_function=None: function(names, roi coordinates) -> {name: valid pixels ratio},
+                                  ex: EarthEngineBackend.candidate_valids. None: ratio computed
+                                  on GEE side (see SelectBackgroundImages)
+            :param cache=None: CandidateCache storing the candidate statistics (None: no cache)
+        """
+        self.load_function = load_function
+        self.valids_function = valids_function
+        self.cache = cache
+        self.tiles = {}
+        self.lock = threading.Lock()
+
+    def tile(self, tile):
+        """ Index of a tile (one request the first time)
+        Arguments:
+            :param tile: MGRS tile (ex: "30UVE")
+            :return: _TileIndex
+        """
+        with self.lock:
+            if tile not in self.tiles:
+                self.tiles[tile] = _TileIndex(self.load_function(tile))
+            return self.tiles[tile]
+
+    def neighbours(self, name, nb_images):
+        """ Closest scenes in time sharing COMMON_AREA of the footprint
+            Same selection as getImagesNeightboor: previous scenes (from more recent
+            to older) then, with allow_future, next scenes (from older to more recent).
+            The scenes of the same date (+ or - NUMBER_HOURS) are ignored.
+        Arguments:
+            :param name: image name (without "COPERNICUS/S2/")
+            :param nb_images: number of scenes to select
+            :return: python list of positions in the tile index, None if the image is not indexed
+        """
+        index = self.tile(image_tile(name))
+        if name not in index.position:
+            return None
+        k = index.position[name]
+        roi = index.footprint(k)
+        delta = parameters.NUMBER_HOURS * 3600000
+
+        # Common areas already computed for this region
+        key = roi_hash(index.coordinates[k])
+        cached = self.cache.get(key) if self.cache else {}
+        computed = {}
+
+        def common_area(j):
+            if index.names[j] in cached and cached[index.names[j]][0] is not None:
+                return cached[index.names[j]][0]
+            # Planar overlap in degrees (GEE: geodesic), see parameters.USE_SCENE_INDEX
+            ratio = roi.intersection(index.footprint(j)).area / roi.area if roi.area else 0.
+            computed[index.names[j]] = (ratio, None)
+            return ratio
+
+        selected = []
+        # Previous scenes: bisection then walk back
+        for j in range(bisect_left(index.times, index.times[k] - delta) - 1, -1, -1):
+            if len(selected) == nb_images: break
+            if common_area(j) > parameters.COMMON_AREA:
+                selected.append(j)
+
+        # Allow selecting image in futur (when there are no enough images in past)
+        if parameters.PARAMS_SELECTBACKGROUND_DEFAULT['allow_future']:
+            for j in range(bisect_right(index.times, index.times[k] + delta), len(index.times)):
+                if len(selected) == nb_images: break
+                if common_area(j) > parameters.COMMON_AREA:
+                    selected.append(j)
+
+        if self.cache and computed:
+            self.cache.set_many(key, computed)
+        return selected
+
+    def valids(self, name, candidates):
+        """ Ratio of valid pixels of the candidates over the image footprint
+            (cached, the missing ones are computed with one request)
+        Arguments:
+            :param name: image name (without "COPERNICUS/S2/")
+            :param candidates: list of image names (same tile)
+            :return: python dict {candidate: valid pixels ratio}
+        """
+        index = self.tile(image_tile(name))
+        coordinates = index.coordinates[index.position[name]]
+        key = roi_hash(coordinates)
+
+        cached = self.cache.get(key, candidates) if self.cache else {}
+        valids = {scene: values[1] for scene, values in cached.items() if values[1] is not None}
+        missing = [scene for scene in candidates if scene not in valids]
+        if missing:
+            computed = self.valids_function(missing, coordinates)
+            valids.update(computed)
+            if self.cache:
+                self.cache.set_many(key, {scene: (None, value) for scene, value in computed.items()})
+        return valids
+
+    def select_backgrounds(self, name,
+                           number_of_images=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images'],
+                           number_preselect=parameters.PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']):
+        """ Background candidates of the methods percentile 1 and 5
+            (the ratio of valid pixels is computed on GEE side, see SelectBackgroundImages)
+        Arguments:
+            :param name: image name (without "COPERNICUS/S2/")
+            :param number_of_images=PARAMS_SELECTBACKGROUND_DEFAULT['number_of_images']:
+            :param number_preselect=PARAMS_SELECTBACKGROUND_DEFAULT['number_preselect']:
+            :return: two python lists of image names (method1, method5) + valid pixels
+                     ratios (python dict, None without valids_function: the lists are sorted
+                     by valid pixels on GEE side), None if the image is not indexed
+        """
+        index = self.tile(image_tile(name))
+        # The first neighbours of a longer selection are the shorter selection
+        neighbours = self.neighbours(name, max(number_of_images, number_preselect))
+        if neighbours is None:
+            return None
+        neighbours_p1 = neighbours[:number_of_images]
+        neighbours_p5 = neighbours[:number_preselect]
+
+        # Method 1: the most cloudy images, method 5: the less cloudy images
+        images_p1 = sorted(neighbours_p1, key=lambda j: index.cloudy[j], reverse=True)[:number_of_images]
+        images_p5 = sorted(neighbours_p5, key=lambda j: index.cloudy[j])[:number_of_images]
+        images_p1 = [index.names[j] for j in images_p1]
+        images_p5 = [index.names[j] for j in images_p5]
+        if self.valids_function is None:
+            return images_p1, images_p5, None
+
+        # Sort by valid pixels ratio (same order as SelectBackgroundImages)
+        valids = self.valids(name, sorted(set(images_p1) | set(images_p5)))
+        images_p1 = sorted(images_p1, key=lambda scene: valids.get(scene) or 0)[:number_of_images]
+        images_p5 = sorted(images_p5, key=lambda scene: valids.get(scene) or 0)[:number_of_images]
+        return images_p1, images_p5, valids
@@ -0,0 +1,105 @@
+#####################################################
+# Utils file: polling scheduler of the export loops #
+#                                                   #
+# Class:                                            #
+#   - PollScheduler(nb_task_max,                    #
+#                   interval_min,                   #
+#                   interval_max)                   #
+#       - update(nb_active, nb_finished)            #
+#       - next_interval(nb_active, has_pending)     #
+#       - wait(nb_active, has_pending)              #
+#                                                   #
+# The time between two polls is not fixed:          #
+#   - free slots and images waiting: no wait (the   #
+#     slots freed are seen by the poll before it)   #
+#   - else: expected time before the next task      #
+#     ends (from the observed completion rate)      #
+#   - no task ended since the last poll: backoff    #
+#####################################################
+
+import time                             # Measure completion rate, wait
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+
+class PollScheduler:
+    """ Compute the waiting time between two polls of the task list
+    """
+
+    def __init__(self, nb_task_max, interval_min=None, interval_max=None,
+                 backoff=1.5, smoothing=0.3):
+        """
+        Arguments:
+            :param nb_task_max: maximum number of tasks running at the same time
+            :param interval_min=parameters.POLL_INTERVAL_MIN: shortest time between two polls (seconds)
+            :param interval_max=parameters.POLL_INTERVAL_MAX: longest time between two polls (seconds)
+            :param backoff=1.5: interval growth when no task ended since the last poll
+            :param smoothing=0.3: weight of the last observation in the completion rate (EWMA)
+        """
+        if interval_min is None: interval_min = parameters.POLL_INTERVAL_MIN
+        if interval_max is None: interval_max = parameters.POLL_INTERVAL_MAX
+
+        self.nb_task_max = nb_task_max
+        self.interval_min = interval_min
+        self.interval_max = interval_max
+        self.backoff = backoff
+        self.smoothing = smoothing
+
+        self.rate = None                    # Tasks ended per second (smoothed)
+        self.interval = interval_min        # Last interval used
+        self.last_update = time.time()
+        self.last_nb_finished = 0
+
+    def update(self, nb_active, nb_finished):
+        """ Record the result of one poll
+        Arguments:
+            :param nb_active: number of tasks READY or RUNNING
+            :param nb_finished: number of tasks ended (completed, failed...) since the last poll
+        """
+        now = time.time()
+        elapsed = max(now - self.last_update, 1e-3)
+        self.last_update = now
+        self.last_nb_finished = nb_finished
+
+        rate = nb_finished / elapsed
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = self.smoothing * rate + (1 - self.smoothing) * self.rate
+
+    def next_interval(self, nb_active, has_pending):
+        """ Return the time to wait before the next poll (seconds)
+        Arguments:
+            :param nb_active: number of tasks READY or RUNNING
+            :param has_pending: True if images are waiting to be submitted
+            :return: python float
+        """
+        # Free slots: submit the waiting images straight away
+        if has_pending and nb_active < self.nb_task_max:
+            self.interval = self.interval_min
+            return 0
+
+        if self.last_nb_finished == 0:
+            # Nothing ended: back off
+            interval = self.interval * self.backoff
+        elif self.rate:
+            # Expected time before the next task ends
+            interval = 1 / self.rate
+        else:
+            interval = self.interval_min
+
+        self.interval = min(max(interval, self.interval_min), self.interval_max)
+        return self.interval
+
+    def wait(self, nb_active, has_pending):
+        """ Sleep till the next poll
+        Arguments:
+            :param nb_active: number of tasks READY or RUNNING
+            :param has_pending: True if images are waiting to be submitted
+        """
+        interval = self.next_interval(nb_active, has_pending)
+        if interval > 0:
+            time.sleep(interval)
@@ -0,0 +1,124 @@
+#####################################################
+# Utils file: sharded asset destinations            #
+#                                                   #
+# Class:                                            #
+#   - ShardPolicy(folder, policy, nb_shards, roots) #
+#       - folder_for(name)                          #
+#       - folders(image_names)                      #
+#       - list_done(backend, image_names)           #
+#       - list_fingerprints(backend, image_names)   #
+#                                                   #
+# GEE limits the number of assets per folder and    #
+# per account. The masks are spread over several    #
+# imageCollections according to a policy:           #
+#   - "single": one folder (no sharding)            #
+#   - "hash": consistent hash of the image name     #
+#             (`nb_shards` folders)                 #
+#   - "tile": one folder per MGRS tile              #
+#   - "month": one folder per acquisition month     #
+# The folders can be spread over several roots      #
+# (other users / cloud projects assets).            #
+#####################################################
+
+import hashlib                          # Consistent hash
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+from utils_queue import image_date, image_tile
+
+SHARD_POLICIES = ["single", "hash", "tile", "month"]
+
+
+def _hash(key):
+    """ Consistent hash (same value on every run / machine, unlike hash())
+    """
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16)
+
+
+class ShardPolicy:
+    """ Destination folder of each image
+    """
+
+    def __init__(self, folder, policy=None, nb_shards=None, roots=None):
+        """
+        Arguments:
+            :param folder: GEE folder (python string), prefix of the shard folders
+            :param policy=parameters.SHARD_POLICY: "single", "hash", "tile" or "month"
+            :param nb_shards=parameters.SHARD_NUMBER: number of folders (policy "hash")
+            :param roots=parameters.SHARD_ROOTS: list of GEE roots the folders are spread over
+                         (ex: ["users/ab43536", "projects/my-project/assets"]),
+                         None: root of `folder`
+        """
+        if policy is None: policy = parameters.SHARD_POLICY
+        if nb_shards is None: nb_shards = parameters.SHARD_NUMBER
+        if roots is None: roots = parameters.SHARD_ROOTS
+        if policy not in SHARD_POLICIES:
+            raise ValueError("The shard policy must be one of: {}".format(", ".join(SHARD_POLICIES)))
+
+        self.folder = folder
+        self.policy = policy
+        self.nb_shards = nb_shards
+        self.roots = roots
+
+    def _folder_from_key(self, key):
+        """ Return the folder of a shard key (appended to the folder name)
+        """
+        if not self.roots:
+            return self.folder + '_' + key
+        root = self.roots[_hash(key) % len(self.roots)]
+        return root + '/' + self.folder.split('/')[-1] + '_' + key
+
+    def folder_for(self, name):
+        """ Return the folder of an image
+        Arguments:
+            :param name: image name (without "COPERNICUS/S2/")
+            :return: GEE folder (python string)
+        """
+        if self.policy == "single":
+            return self.folder
+        if self.policy == "hash":
+            return self._folder_from_key("{:02d}".format(_hash(name) % self.nb_shards))
+        if self.policy == "tile":
+            return self._folder_from_key("T" + image_tile(name))
+        return self._folder_from_key(image_date(name)[:6])
+
+    def folders(self, image_names=()):
+        """ Return the folders used by the given images
+            (policy "hash": all the shards)
+        Arguments:
+            :param image_names=(): list of image names
+            :return: sorted python list of folders
+        """
+        if self.policy == "single":
+            return [self.folder]
+        if self.policy == "hash":
+            return sorted(set(self._folder_from_key("{:02d}".format(k)) for k in range(self.nb_shards)))
+        return sorted(set(self.folder_for(name) for name in image_names))
+
+    def list_done(self, backend, image_names=()):
+        """ Merged index: all the images stored in the folders
+            (single scene assets + scenes of the grouped assets)
+        Arguments:
+            :param backend: EarthEngineBackend (or any backend)
+            :param image_names=(): list of image names (policies "tile" and "month")
+            :return: python set of image names
+        """
+        done = set()
+        for folder in self.folders(image_names):
+            done.update(img.split('/')[-1] for img in backend.list_assets(folder))
+            done.update(backend.list_group_scenes(folder))
+        return done
+
+    def list_fingerprints(self, backend, image_names=()):
+        """ Fingerprint of all the assets stored in the folders
+        Arguments:
+            :param backend: EarthEngineBackend (or any backend)
+            :param image_names=(): list of image names (policies "tile" and "month")
+            :return: python list of (asset_id, fingerprint or None, list of image names)
+        """
+        fingerprints = []
+        for folder in self.folders(image_names):
+            fingerprints.extend(backend.list_fingerprints(folder))
+        return fingerprints
@@ -0,0 +1,103 @@
+#####################################################
+# Utils file: concurrent submission of the images   #
+#                                                   #
+# Classes:                                          #
+#   - RateLimiter(rate, burst)                      #
+#       - acquire()                                 #
+#   - SubmissionPipeline(prepare_function,          #
+#                        max_workers,               #
+#                        rate)                      #
+#       - run(items)                                #
+#                                                   #
+# Each image requires several blocking GEE requests #
+# (intersection, graph, export start). They are run #
+# in a bounded thread pool, the number of requests  #
+# per second being limited by the RateLimiter.      #
+#####################################################
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading                        # Lock the rate limiter
+import time                             # Rate limiter clock
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parameters
+
+
+class RateLimiter:
+    """ Token bucket: at most `rate` calls per second (bursts up to `burst` calls)
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Arguments:
+            :param rate: number of calls allowed per second (None: no limit),
+                         below 1: one call every 1 / rate seconds
+            :param burst=max(rate, 1): capacity of the bucket (calls allowed at once)
+        """
+        if burst is None: burst = max(rate, 1) if rate else 1
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block till a call is allowed
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                waiting_time = (1 - self.tokens) / self.rate
+            time.sleep(waiting_time)
+
+
+class SubmissionPipeline:
+    """ Run the preparation / submission of several images in parallel
+    """
+
+    def __init__(self, prepare_function, max_workers=None, rate=None):
+        """
+        Arguments:
+            :param prepare_function: function called on each item, run in the thread pool
+            :param max_workers=parameters.SUBMISSION_WORKERS: number of images prepared at the same time
+            :param rate=parameters.SUBMISSION_RATE: maximum number of images started per second
+        """
+        if max_workers is None: max_workers = parameters.SUBMISSION_WORKERS
+        if rate is None: rate = parameters.SUBMISSION_RATE
+
+        self.prepare_function = prepare_function
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(rate)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _prepare(self, item):
+        self.rate_limiter.acquire()
+        return self.prepare_function(item)
+
+    def run(self, items):
+        """ Prepare all the items, yield the results as soon as they are available
+            The results are consumed in the calling thread: the caller records them
+            (one ledger transaction per item)
+        Arguments:
+            :param items: list of items given to prepare_function
+            :return: generator of (item, result, exception)
+        """
+        futures = {self.executor.submit(self._prepare, item): item for item in items}
+        for future in as_completed(futures):
+            exception = future.exception()
+            result = None if exception else future.result()
+            yield futures[future], result, exception
+
+    def close(self):
+        """ Stop the thread pool (wait for the running preparations)
+        """
+        self.executor.shutdown(wait=True)
@@ -5,11 +5,13 @@
 #       - getNumberActiveTask()                     #
 #       - getTaskList()                             #
 #       - cancelAllTask()                           #
+#       - getTaskSnapshot()                         #
 #####################################################
 
 # Modules required
 from subprocess import check_output     # Run windows command from python
 import re                               # Regex
+import ee                               # GEE
 
 
 def getNumberActiveTask(verbose=False):
@@ -90,6 +92,16 @@ def cancelAllTask(verbose=False, task_list=None):
                                                     "Task cancellation finished !", ""))
 
 
+def getTaskSnapshot(task_ids=None):
+    """ Return the state of all the tasks with one request
+    Arguments:
+        :param task_ids=None: keep only these task ids (None: all the tasks)
+        :return: python dict {task_id: state}
+    """
+    snapshot = {task["id"]: task["state"] for task in ee.data.getTaskList()}
+    if task_ids is not None:
+        snapshot = {task_id: snapshot[task_id] for task_id in task_ids if task_id in snapshot}
+    return snapshot
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
 #####################################################
 # File: Cloud masking model                         #
 # Methods:                                          #
+#   - getClassifier(numberOfTrees,                  #
+#                   classifier_file)                #
+#   - classifierAssetId(numberOfTrees)              #
+#   - exportClassifier(numberOfTrees, asset_id)     #
 #   - computeCloudMasking(image_name,               #
 #                         numberOfTrees,            #
-#                         threshold)                #
+#                         threshold,                #
+#                         clip_land,                #
+#                         output_mode,              #
+#                         pack_methods,             #
+#                         scene_index)              #
 # This mdethod is computing the full cloud mask     #
 # for one image. This function can be run on one    #
 # independant image                                 #
@@ -11,6 +19,10 @@
 
 # Import modules
 import ee               # GEE
+import hashlib          # Classifier asset name
+import logging          # Write logs
+import threading        # Classifier shared by the submission threads
+import time             # Wait for the classifier export
 import sys, os          # Set file path
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,33 +32,126 @@ sys.path.append(os.path.join(BASE_DIR, 'Background_methods'))
 sys.path.append(os.path.join(BASE_DIR, 'Utils'))
 
 from Utils.utils import getGeometryImage
+from Utils.utils_classifier import loadArtifact, artifactToClassifier
+from Utils.utils_encoding import packMethods, encodingProperties
+from Utils.utils_fingerprint import model_fingerprint
 from Tree_methods.tree_methods import getMaskTree1, getMaskTree2, getMaskTree3
 from Background_methods.multitemporal_cloud_masking import CloudClusterScore
 from parameters import NUMBER_TREES, CUTTOF
 import parameters
 
 
-def computeCloudMasking(image_name, numberOfTrees=NUMBER_TREES, threshold=CUTTOF):
-    """ Compute the Cloud masking for a given image
-        Methods used: 'percentile1', 'percentile5', 'tree2', 'tree3'
+# Classifiers already built (key: (numberOfTrees, classifier_file))
+_CLASSIFIERS = {}
+_CLASSIFIERS_LOCK = threading.Lock()
+
+
+def getClassifier(numberOfTrees=NUMBER_TREES, classifier_file=None):
+    """ Return the random forest model, built once per run
+        and shared by all the images
+        The forest is trained once: either locally (classifier_file) or on GEE side
+        and stored as a classifier asset (CLASSIFIER_ASSET). Without both of them, the
+        training is part of the graph of each image (trained again by each task)
+        The first call can wait for the classifier export: call it before starting
+        the submission threads (see EarthEngineBackend.prepare_model)
     Arguments:
-        :param image_name: string image name
         :param numberOfTrees=NUMBER_TREE: Size of forest in randomForest model
-        :param threshold=CUTTOF: RandomForest model cuttof
-        :return: one binary image: 0 cloud free, 1 cloudy
+        :param classifier_file=parameters.CLASSIFIER_FILE: random forest trained locally
+                    (see "Utils/utils_classifier.py"). If None, the forest is trained on GEE side
+        :return: ee.Classifier
     """
+    if classifier_file is None: classifier_file = parameters.CLASSIFIER_FILE
+
+    key = (numberOfTrees, classifier_file)
+    with _CLASSIFIERS_LOCK:
+        if key in _CLASSIFIERS:
+            return _CLASSIFIERS[key]
+
+    # Built without the lock: the threads using another classifier are not blocked
+    if classifier_file:
+        # Trees already trained: no training on GEE side
+        classifier = artifactToClassifier(loadArtifact(classifier_file))
+    elif parameters.CLASSIFIER_ASSET:
+        # Forest trained once on GEE side, loaded from its asset
+        asset_id = classifierAssetId(numberOfTrees)
+        if ee.data.getInfo(asset_id) is None:
+            exportClassifier(numberOfTrees, asset_id)
+        classifier = ee.Classifier.load(asset_id)
+    else:
+        classifier = _trainClassifier(numberOfTrees)
+
+    with _CLASSIFIERS_LOCK:
+        return _CLASSIFIERS.setdefault(key, classifier)
+
+
+def classifierAssetId(numberOfTrees=NUMBER_TREES):
+    """ GEE path of the classifier asset: CLASSIFIER_ASSET + number of trees
+        + hash of the training data (path + last update time) and features
+        (a new training, or training data updated in place, gets a new asset)
+    """
+    # Fusion tables ("ft:" ids) are not assets: no update time
+    update_time = None if parameters.TRAINING_DATA.startswith("ft:") \
+        else ee.data.getAsset(parameters.TRAINING_DATA).get("updateTime")
+    training = "{}|{}|{}".format(parameters.TRAINING_DATA, update_time, ",".join(parameters.METHODS_NAME))
+    return "{}_{}_{}".format(parameters.CLASSIFIER_ASSET, numberOfTrees,
+                             hashlib.sha1(training.encode("utf-8")).hexdigest()[:8])
+
 
+def _trainClassifier(numberOfTrees):
+    """ Random forest trained on GEE side (lazy: trained by each graph using it)
+    """
     # Import training data as GEE object
-    # Build randomForest model at each run
-    fc_training = ee.FeatureCollection(
-        'ft:1XzZPz8HZMARKQ9OPTWvfuRkPaGIASzkRYMfhKT8H')
+    fc_training = ee.FeatureCollection(parameters.TRAINING_DATA)
+    randomForest = ee.Classifier.randomForest(numberOfTrees=numberOfTrees)
+    return randomForest.train(fc_training, 'cloud', parameters.METHODS_NAME)
 
-    # Use these methods for prediction.
-    methods_name = ee.List(['percentile1', 'percentile5', 'tree2', 'tree3'])
 
-    # Random Forest model
-    randomForest = ee.Classifier.randomForest(numberOfTrees=numberOfTrees)
-    randomForest = randomForest.train(fc_training, 'cloud', methods_name)
+def exportClassifier(numberOfTrees, asset_id):
+    """ Train the random forest on GEE side and store it as an asset
+        (blocking: waits for the end of the export task)
+    Arguments:
+        :param numberOfTrees: Size of forest in randomForest model
+        :param asset_id: GEE path of the classifier asset
+    """
+    logging.info("Training the random forest ({} trees) into {}".format(numberOfTrees, asset_id))
+    task = ee.batch.Export.classifier.toAsset(classifier=_trainClassifier(numberOfTrees),
+                                              description="random_forest_{}".format(numberOfTrees),
+                                              assetId=asset_id)
+    task.start()
+    while task.status()["state"] in ("UNSUBMITTED", "READY", "RUNNING"):
+        time.sleep(parameters.POLL_INTERVAL_MIN)
+    status = task.status()
+    if status["state"] != "COMPLETED":
+        raise RuntimeError("The random forest export failed: {}".format(status.get("error_message")))
+
+
+def computeCloudMasking(image_name, numberOfTrees=NUMBER_TREES, threshold=CUTTOF, clip_land=True,
+                        output_mode=None, pack_methods=None, scene_index=None):
+    """ Compute the Cloud masking for a given image
+        Methods used: 'percentile1', 'percentile5', 'tree2', 'tree3'
+    Arguments:
+        :param image_name: string image name
+        :param numberOfTrees=NUMBER_TREE: Size of forest in randomForest model
+        :param threshold=CUTTOF: RandomForest model cuttof (output_mode "mask")
+        :param clip_land=True: clip to the land geometry (False if the image
+                               is fully inside land: the clip is a no-op)
+        :param output_mode=parameters.OUTPUT_MODE: "mask" or "probability"
+        :param pack_methods=parameters.EXPORT_PACK_METHODS: pack the mask and the methods
+                            in one uint8 band (output_mode "mask" only)
+        :param scene_index=None: SceneIndex selecting the background images locally
+                                 (see "Utils/utils_scene_index.py"), None: selected on GEE side
+        :return: "mask": one binary image: 0 cloud free, 1 cloudy
+                 (pack_methods: one uint8 image, band "packed", see "Utils/utils_encoding.py")
+                 "probability": one uint8 image (band "probability"): fraction of
+                 the trees voting "cloud" * PROBABILITY_SCALE (see "Utils/utils_probability.py")
+    """
+    if output_mode is None: output_mode = parameters.OUTPUT_MODE
+    if pack_methods is None: pack_methods = parameters.EXPORT_PACK_METHODS
+    if pack_methods and output_mode != "mask":
+        raise ValueError("The methods can only be packed with the output mode \"mask\"")
+
+    # Random Forest model (built once, shared by all the images)
+    randomForest = getClassifier(numberOfTrees)
 
     # Image + region of interest
     image = ee.Image(image_name)
@@ -60,20 +165,39 @@ def computeCloudMasking(image_name, numberOfTrees=NUMBER_TREES, threshold=CUTTOF
     # tree1 = getMaskTree1(image, roi)
     tree2 = getMaskTree2(image, roi)
     tree3 = getMaskTree3(image, roi)
-    percentile1, percentile5 = CloudClusterScore(image, roi)
+    background_ids = scene_index.select_backgrounds(image_name.split('/')[-1]) if scene_index else None
+    percentile1, percentile5 = CloudClusterScore(image, roi, clip_land=clip_land,
+                                                 background_ids=background_ids)
 
     # Add each result as a band of the final image
-    final_image = tree3.addBands([tree2, percentile1, percentile5]) \
-                        .clip(land_geometry)
-
-    # Apply the random Forest classification
-    masked_image = final_image.classify(randomForest) \
-                              .gt(threshold)
+    final_image = tree3.addBands([tree2, percentile1, percentile5])
+    if clip_land:
+        final_image = final_image.clip(land_geometry)
+
+    if output_mode == "probability":
+        # Fraction of the trees voting "cloud", quantised to uint8
+        masked_image = final_image.classify(randomForest.setOutputMode('PROBABILITY')) \
+                                  .multiply(parameters.PROBABILITY_SCALE) \
+                                  .round().toByte() \
+                                  .rename("probability")
+    else:
+        # Apply the random Forest classification
+        masked_image = final_image.classify(randomForest) \
+                                  .gt(threshold)
+        if pack_methods:
+            # Mask + methods as bits of one uint8 band
+            masked_image = packMethods(masked_image, final_image)
 
     # Add meta data: geometry + date
     masked_image = masked_image.set("system:footprint", image.get('system:footprint'))
     masked_image = masked_image.set("system:time_start", image.get('system:time_start'))
     masked_image = masked_image.set("system:time_end", image.get('system:time_end'))
+    # Encoding of the values (decoded by "Interpolation/load_dataset.py")
+    masked_image = masked_image.set(encodingProperties(output_mode, pack_methods, parameters.PROBABILITY_SCALE))
+    # Add the model fingerprint (stale masks detection)
+    masked_image = masked_image.set("fingerprint", model_fingerprint(numberOfTrees=numberOfTrees,
+                                                                     output_mode=output_mode,
+                                                                     pack_methods=pack_methods))
 
     return masked_image
 
@@ -10,9 +10,17 @@
 #                              date_end,            #
 #                              geometry,            #
 #                              folder_GEE,          #
+#                              ledger_file,         #
 #                              excel_file,          #
 #                              image_to_exclude,    #
 #                              nb_task_max,         #
+#                              max_workers,         #
+#                              queue_ordering,      #
+#                              backend,             #
+#                              use_land_index,      #
+#                              shard_policy,        #
+#                              group_days,          #
+#                              reprocess_stale,     #
 #                              silent)              #
 #                                                   #
 # The function 'process_and_store_to_GEE' is        #
@@ -29,11 +37,8 @@
 # Import modules
 import ee               # GEE
 import sys, os          # Set file path
-import time             # Sleep between task running
 import logging          # Write logs
 import json             # Read previously define json
-import pandas as pd
-import numpy as np
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
@@ -41,16 +46,26 @@ sys.path.append(os.path.join(BASE_DIR, 'Tree_methods'))
 sys.path.append(os.path.join(BASE_DIR, 'Background_methods'))
 sys.path.append(os.path.join(BASE_DIR, 'Utils'))
 
-from Utils.utils import getGeometryImage, get_name_collection, export_image_to_GEE, init_logger, date_gap
-from Utils.utils_tasks import getNumberActiveTask, getTaskList, cancelAllTask
-from Utils.utils_assets import getAllImagesInColl
-from cloud_masking_model import computeCloudMasking
+from Utils.utils import init_logger, date_gap
+from Utils.utils_backend import EarthEngineBackend
+from Utils.utils_ledger import JobLedger, ACTIVE_STATES
+from Utils.utils_scheduler import PollScheduler
+from Utils.utils_submission import SubmissionPipeline
+from Utils.utils_prefilter import classifyLandIntersection, land_geometry_hash
+from Utils.utils_land_index import LAND_INSIDE, LAND_OUTSIDE
+from Utils.utils_queue import WorkQueue
+from Utils.utils_reconcile import reconcileLedger
+from Utils.utils_sharding import ShardPolicy
+from Utils.utils_grouping import group_key
+from Utils.utils_fingerprint import model_fingerprint, find_stale, set_land_version
 import parameters
 
 
 def process_and_store_to_GEE(date_start=None, date_end=None, geometry=None,
-                             geo_land=None, folder_GEE=None, excel_file=None,
+                             geo_land=None, folder_GEE=None, ledger_file=None, excel_file=None,
                              image_to_exclude=[], nb_task_max=None,
+                             max_workers=None, queue_ordering=None, cost_function=None, backend=None,
+                             use_land_index=None, shard_policy=None, group_days=None, reprocess_stale=None,
                              silent=False):
     """ Method to run the whole cloud masking process
     Arguments:
@@ -59,12 +74,25 @@ def process_and_store_to_GEE(date_start=None, date_end=None, geometry=None,
         :param geometry=None: Geometry that roughly overlay the UK
         :param geo_land=None: path a GEE featureCollection (border area for example)
         :param folder_GEE=None: GEE folder (python string)
-        :param excel_file=None: excel file (file create by previous ecution)
+        :param ledger_file=None: ledger file (SQLite, created/updated by the process)
+        :param excel_file=None: human readable export of the ledger (xlsx or csv)
         :param image_to_exclude=[]: list images to exclude
         :param nb_task_max=parameters.nb_task_max: maximum number of tasks running at the same time
+        :param max_workers=parameters.SUBMISSION_WORKERS: number of images prepared at the same time
+        :param queue_ordering=parameters.QUEUE_ORDERING: order of the images ("date", "tile", "cost")
+        :param cost_function=None: function(name) -> estimated cost of an image ("cost" ordering),
+                                   default: images fully inside land (no clip) first
+        :param backend=None: backend running the GEE requests (default: EarthEngineBackend)
+        :param use_land_index=parameters.USE_LAND_INDEX: classify the footprints locally
+        :param shard_policy=None: ShardPolicy spreading the masks over several folders
+                                  (default: built from "folder_GEE" and the parameters)
+        :param group_days=parameters.EXPORT_GROUP_DAYS: export the images of a tile and a
+                                  date window of `group_days` days in one asset (None: one asset per image)
+        :param reprocess_stale=parameters.REPROCESS_STALE: delete and process again the assets
+                                  computed with another model configuration (fingerprint)
         :param silent=False: show log messages
     
-    NOTE: The image already stored in the "folder_GEE" are ignored (not processed again)
+    NOTE: The image already stored in the "folder_GEE" (or its shards) are ignored (not processed again)
     """
 
     if not silent:
@@ -75,177 +103,214 @@ def process_and_store_to_GEE(date_start=None, date_end=None, geometry=None,
     if not date_end:    date_end    = parameters.date_end
     if not geometry:    geometry    = parameters.geometry
     if not folder_GEE:  folder_GEE  = parameters.folder_GEE
+    if not ledger_file: ledger_file = parameters.ledger_file
     if not excel_file:  excel_file  = parameters.excel_file
     if not nb_task_max: nb_task_max = parameters.nb_task_max
-    if not geo_land:    geo_land    = ee.FeatureCollection(parameters.land_geometry)
+    if not geo_land:    geo_land    = parameters.land_geometry
+    if not backend:     backend     = EarthEngineBackend()
+    if not shard_policy: shard_policy = ShardPolicy(folder_GEE)
+    if not group_days:  group_days  = parameters.EXPORT_GROUP_DAYS
+    if reprocess_stale is None: reprocess_stale = parameters.REPROCESS_STALE
     
     # Adjust date_start and date_end
     date_start, date_end = date_gap(date_start, date_end)
 
-    # Load geometry
-    if isinstance(geometry, list):
-        geometry = ee.Geometry.Polygon(geometry)
-    elif isinstance(geometry, str):
-        # Feature name
-        geometry = ee.FeatureCollection(geometry)
-    else:
-        raise ValueError("The geometry must either be a list of coordinates"
-                        " or a string to a featureCollection already imported in GEE assets")
-
-    # Get Sentinel ImageCollection according to filters
-    col = ee.ImageCollection("COPERNICUS/S2") \
-            .filterDate(date_start, date_end) \
-            .filterBounds(geometry)
-
-    # If imageCollection do not exist: create one
-    if folder_GEE not in [elt["id"] for elt in ee.data.getList({"id":'/'.join(folder_GEE.split('/')[:-1])})]:
-        ee.data.createAsset({'type': "ImageCollection"}, folder_GEE)
-
-    # Get all image name as a python list (string)
-    image_names = get_name_collection(col).getInfo()
+    # Get all image name (Sentinel images matching dates and geometry) as a python list (string)
+    image_names = backend.list_images(date_start, date_end, geometry)
+    image_names = [img.split('/')[-1] for img in image_names]
     total = len(image_names)
 
-    # Load image to ignore from xlsx file
-    image_ignored = []
-    output = pd.DataFrame({"Result": [], "Task_id": []})
-    output.index.name = "Name"
-    if os.path.isfile(excel_file):
-        output = pd.read_excel(excel_file)
-        image_ignored = output.Name.values
-        output = output.set_index("Name")
-
-        to_remove = output.Result.isin(["RUNNING", "READY"])
-
-        # Cancel task running and ready
-        cancelAllTask(task_list=output.Task_id[to_remove].values[:10])
-
-        output = output[~to_remove]
-        output.to_excel(excel_file)
+    # If imageCollections (shards) do not exist: create them
+    for folder in shard_policy.folders(image_names):
+        backend.create_collection(folder)
 
-    else:
-        ans = input('The excel file "{}" doesn\'t exist. Continue and ignore? (Y/N) : '.format(excel_file))
-        if ans.lower() != "y": sys.exit()
+    # Load image to ignore from the ledger
+    ledger = JobLedger(ledger_file)
+    if ledger.is_new:
+        if os.path.isfile(excel_file):
+            # Ledger created from the xlsx file of a previous execution
+            ledger.import_excel(excel_file)
         else:
-            output.to_excel(excel_file)
-    
-    # Select image ID
-    image_done_GEE = [img.split('/')[-1] for img in getAllImagesInColl(folder_GEE)]
+            ans = input('The ledger file "{}" doesn\'t exist. Continue and ignore? (Y/N) : '.format(ledger_file))
+            if ans.lower() != "y": sys.exit()
+
+    # Version of the land geometry clipping the masks (part of the model fingerprint)
+    set_land_version(land_geometry_hash(parameters.land_geometry, backend))
+
+    # Assets computed with another model configuration: deleted and processed again
+    if reprocess_stale:
+        fingerprint = model_fingerprint()
+        stale_assets, stale_names = find_stale(shard_policy.list_fingerprints(backend, image_names),
+                                               fingerprint, image_names)
+        if stale_assets:
+            backend.delete_assets(stale_assets)
+            ledger.remove(list(stale_names))
+        if not silent:
+            logging.info('\t- Model fingerprint {}: {} stale assets deleted ({} images processed again)'
+                         .format(fingerprint, len(stale_assets), len(stale_names)))
+
+    # Select image ID (merged index of all the shards)
+    image_done_GEE = shard_policy.list_done(backend, image_names)
+
+    # Tasks started by a previous execution: adopt the running ones,
+    # the lost ones are removed from the ledger (processed again)
+    adopted = reconcileLedger(ledger, backend, image_done_GEE)
+    image_ignored = ledger.get_names()
     image_to_exclude = [img.split('/')[-1] for img in image_to_exclude]
-    image_names = [img.split('/')[-1] for img in image_names]
 
     # Ignore image to exclude
     image_names = list(set(image_names) - set(image_done_GEE)
                                         - set(image_to_exclude)
                                         - set(image_ignored))
     
+    # Ignore images out of the land geometry (batched requests, cached in the ledger)
+    land_classes = classifyLandIntersection(image_names, geo_land, ledger, backend,
+                                            use_land_index=use_land_index)
+    out_of_area = [name for name in image_names if land_classes.get(name, LAND_OUTSIDE) == LAND_OUTSIDE]
+    ledger.upsert_many([(name, "Out of area", "ignored") for name in out_of_area])
+    image_names = [name for name in image_names if land_classes.get(name, LAND_OUTSIDE) != LAND_OUTSIDE]
+
     if not silent:
         logging.info('\t- There are {} images in Sentinel Collection matching date and area constraints'.format(total))
         logging.info('\t- There are {} images already processed (already existing in GEE folder)'.format(len(image_done_GEE)))
-        logging.info('\t- There are {} images out of the area of interest (ignored)'.format(np.sum(output.Result.eq("Out of area"))))
-        logging.info('\t- There are {} images that have failed'.format(np.sum(output.Result.eq("FAILED"))))
+        logging.info('\t- There are {} images out of the area of interest (ignored)'.format(ledger.count(["Out of area"])))
+        logging.info('\t- There are {} images that have failed'.format(ledger.count(["FAILED"])))
         logging.info('\t- There are {} images to ignored (given in parameters) '.format(len(image_to_exclude)))
         logging.info('\t- There are {} images to process'.format(len(image_names)))
 
+    # Queue of images to process (saved in the ledger)
+    if cost_function is None:
+        # Default cost: the images fully inside land are not clipped
+        cost_function = lambda name: 0 if land_classes.get(name) == LAND_INSIDE else 1
+    queue = WorkQueue(ledger, queue_ordering, cost_function)
+    queue.sync(image_names)
+
 
 
     # Init variables
-    read = True                     # Read output file (dynamically updated when the openning fails)
     counter_img = 0                 # Count the current image processed
-    total = len(image_names)        # Number of images to process
-    task_bag = set()                # Set of tasks
+    total = len(queue)              # Number of images to process
+    task_bag = set(adopted)         # Set of task ids
+    task_names = {task_id: names for task_id, (names, _) in adopted.items()}   # Image names of each task (key: task id)
+    task_states = {task_id: state for task_id, (_, state) in adopted.items()}  # Last state known of each task (key: task id)
+    task_unseen = {}                # Number of polls each task was missing from the task list (key: task id)
+    scheduler = PollScheduler(nb_task_max)
+
+    def start_export(item):
+        """ Compute the cloud mask(s) and start the export of a group of images
+            (images fully inside land: the clips are skipped)
+            A started task is READY (its id is known without any request)
+        """
+        names, num = item
+        folder = shard_policy.folder_for(names[0])
+        clip_land = any(land_classes[name] != LAND_INSIDE for name in names)
+        if group_days:
+            return "READY", backend.start_group_export(names, folder, clip_land=clip_land, num=num, total=total)
+        return "READY", backend.start_export(names[0], folder, clip_land=clip_land, num=num, total=total)
+
+    # Random forest built (or its export awaited) before the submission threads start
+    if len(queue) > 0:
+        backend.prepare_model()
+    pipeline = SubmissionPipeline(start_export, max_workers=max_workers)
     
     process = True                  # While condition 
     while process:
-        # Read the xlsx file 
-        # "read" might be set to false if the previous writting try failed
-        # If that is the case, the xlsx file isn't read (to not lose the updates
-        # perform during the loop)
-        if read:
-            try:
-                # read excel file
-                output = pd.read_excel(excel_file)
-                output = output.set_index("Name")
-            except PermissionError:
-                logging.info("The xlsx file has't been updated (permission denied)")
-
-
-        # Get the number of active task (from xlsx file)
+        # Get the number of active task (from the ledger)
         # nb_task_pending = getNumberActiveTask()
-        nb_task_pending = output.Result.isin(["READY", "RUNNING"]).sum()
+        nb_task_pending = ledger.count_tasks(ACTIVE_STATES)
         new_images = nb_task_max - nb_task_pending      # Number task that can be run
 
         # some counters
         nb_img_ran = 0
-        k = 0
 
         # For the possible number of images to run
-        while k < len(image_names) and nb_img_ran < new_images:
-            # Select first image from list and remove it from list
-            name = image_names[0]
-            image_names = image_names[1:]
-
-            # Create full image ID
-            full_name = 'COPERNICUS/S2/' + name
-            logging.info(
-                "{:4d}/{} = {:05.2f}%   Image {}".format(counter_img, total, counter_img / total * 100, name))
-            
-            out_put_row = {"Result": "Out of area",
-                           "Task_id": "ignored"}
-            
-            # Check if image intersect the land geometry
-            if ee.Image(full_name).geometry().intersects(geo_land).getInfo():
-                # Get cloud mask
-                mask = computeCloudMasking(full_name)
-                # Export (store) to GEE
-                new_task = export_image_to_GEE(image=mask, asset_id=folder_GEE, roi=getGeometryImage(ee.Image(full_name)),
-                                               name=name, num=counter_img, total=total)
-                # Add task to list of tasks
-                task_bag.add(new_task)
-                # Update data informations 
-                out_put_row.update({"Result": new_task.status().get("state"),
-                                    "Task_id": new_task.status().get("id")})
-                # Update counter
-                nb_img_ran += 1
+        # The images that failed do not use a slot: loop till the slots are filled
+        while len(queue) > 0 and nb_img_ran < new_images:
+            # Select as many images (groups of images) as free slots and remove them from queue
+            if group_days:
+                groups = queue.pop_groups(new_images - nb_img_ran,
+                                          lambda name: group_key(name, group_days),
+                                          parameters.EXPORT_GROUP_MAX)
             else:
-                logging.info("The image {} do not intersect the area. It has been ignored".format(name))
-
-            # Add row in out_put dataframe (state of image)
-            output.loc[name] = out_put_row
-            # Update counter
-            k += 1
-            counter_img += 1
+                groups = [[name] for name in queue.pop_many(new_images - nb_img_ran)]
+            batch = []
+            for names in groups:
+                batch.append((names, counter_img))
+                counter_img += len(names)
+
+            # Prepare and start the exports in parallel
+            for (names, num), row, exception in pipeline.run(batch):
+                logging.info(
+                    "{:4d}/{} = {:05.2f}%   Image {}".format(num, total, num / total * 100, ", ".join(names)))
+
+                if exception is not None:
+                    logging.info("The image {} has failed: {}".format(", ".join(names), exception))
+                    row = ("FAILED", None)
+                result, task_id = row
+
+                if result == "READY":
+                    # Add task to list of tasks
+                    task_bag.add(task_id)
+                    task_names[task_id] = names
+                    task_states[task_id] = result
+                    # Update counter
+                    nb_img_ran += 1
+
+                # Add rows in ledger (state of the images)
+                ledger.upsert_many([(name, result, task_id) for name in names])
         
         # Update the task set
-        to_remove = set()
-        # For each task
-        for task in task_bag:
-            # Read task status 
-            task_info = task.status()
-            status = task_info.get("state")
-            # If task failed or completed: add task to the tasks to remove
-            if status in ["FAILED", "COMPLETED"]:
-                to_remove.add(task)
-            
-            # Update output content (excel file)
-            output.loc[output.Task_id.eq(task_info.get("id")), "Result"] = status
-        
-        # Remove finished tasks
-        for task_to_rm in to_remove:
-            task_bag.remove(task_to_rm)
-
-        # Save output in xlsx file
-        try:
-            output.to_excel(excel_file)
-            read = True
-        except PermissionError:
-            logging.info("The xlsx file has't been updated (permission denied)")
-            read = False
+        # Read the status of all the tasks (one request)
+        snapshot = backend.task_snapshot(task_bag) if task_bag else {}
+        updated_rows = []
+        nb_finished = 0
+        # For each task which state changed
+        for task_id, status in snapshot.items():
+            if status == task_states.get(task_id):
+                continue
+            task_states[task_id] = status
+            updated_rows.extend((name, status, task_id) for name in task_names[task_id])
+            # If task failed or completed: remove the task
+            if status in ["FAILED", "COMPLETED", "CANCELLED"]:
+                task_bag.discard(task_id)
+                task_states.pop(task_id)
+                task_names.pop(task_id)
+                nb_finished += 1
+
+        # Tasks missing from the task list for TASK_UNSEEN_CYCLES polls: FAILED
+        for task_id in [task_id for task_id in task_bag if task_id not in snapshot]:
+            task_unseen[task_id] = task_unseen.get(task_id, 0) + 1
+            if task_unseen[task_id] >= parameters.TASK_UNSEEN_CYCLES:
+                logging.info("The task {} is missing from the task list: FAILED".format(task_id))
+                updated_rows.extend((name, "FAILED", task_id) for name in task_names[task_id])
+                task_bag.discard(task_id)
+                task_states.pop(task_id)
+                task_names.pop(task_id)
+                task_unseen.pop(task_id)
+                nb_finished += 1
+        for task_id in snapshot:
+            task_unseen.pop(task_id, None)
+
+        # Save the states in the ledger (one transaction)
+        ledger.upsert_many(updated_rows)
 
         # Exit condition
-        if len(task_bag) == 0 and len(image_names) == 0:
+        if len(task_bag) == 0 and len(queue) == 0:
             process = False    
-        else: time.sleep(30)
-    
+        else:
+            # Wait before the next poll (depends on free slots and completion rate)
+            scheduler.update(len(task_bag), nb_finished)
+            scheduler.wait(ledger.count_tasks(ACTIVE_STATES), len(queue) > 0)
+
+    pipeline.close()
+
+    # Human readable export of the ledger
+    try:
+        ledger.export(excel_file)
+    except PermissionError:
+        logging.info("The xlsx file has't been updated (permission denied)")
+    ledger.close()
+
     logging.info("{:-<98}\n|{:^98}|\n{:-<100}".format("",
                                                       "Process finished :-)", ""))
 
@@ -0,0 +1,93 @@
+#####################################################
+# Load test of the cloud masking process            #
+#                                                   #
+# Run 'process_and_store_to_GEE' on a FakeBackend   #
+# (in-memory images, assets and tasks): no GEE      #
+# account required.                                 #
+#                                                   #
+# Method:                                           #
+#   - run_load_test(nb_images, latency,             #
+#                   task_duration, failure_rate,    #
+#                   nb_task_max, max_workers,       #
+#                   output_json)                    #
+#                                                   #
+# Usage:                                            #
+#   python Cloud_masking/load_test.py [nb_images]   #
+#####################################################
+
+import sys, os          # Set file path
+import json             # Write results
+import tempfile         # Ledger of the test
+import time             # Measure time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'Utils'))
+
+from cloud_masking_process import process_and_store_to_GEE
+from Utils.utils_fake_backend import FakeBackend
+from Utils.utils_ledger import JobLedger
+import parameters
+
+
+def run_load_test(nb_images=100000, latency=0., task_duration=(0.05, 0.5), failure_rate=0.01,
+                  nb_task_max=500, max_workers=8, group_days=None, output_json=None):
+    """ Run the whole process on fake images, return the measures
+    Arguments:
+        :param nb_images=100000: number of images simulated
+        :param latency=0.: time of each request (seconds)
+        :param task_duration=(0.05, 0.5): range of the task durations (seconds)
+        :param failure_rate=0.01: ratio of tasks ending FAILED
+        :param nb_task_max=500: maximum number of tasks running at the same time
+        :param max_workers=8: number of images prepared at the same time
+        :param group_days=None: grouped exports (see parameters.EXPORT_GROUP_DAYS), None: one task per image
+        :param output_json=None: path of the json file storing the results
+        :return: python dict
+    """
+    backend = FakeBackend(nb_images=nb_images, latency=latency, task_duration=task_duration,
+                          failure_rate=failure_rate)
+
+    # Poll intervals adapted to short tasks, no rate limit
+    parameters.POLL_INTERVAL_MIN = min(task_duration) / 2
+    parameters.POLL_INTERVAL_MAX = max(task_duration)
+    parameters.SUBMISSION_RATE = None
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Land polygons of the fake backend stored with the ledger
+        parameters.LAND_CACHE_DIR = folder
+        ledger_file = os.path.join(folder, "status.db")
+        excel_file = os.path.join(folder, "status.csv")
+        # Existing (empty) ledger: no question asked
+        JobLedger(ledger_file).close()
+
+        start = time.time()
+        process_and_store_to_GEE(ledger_file=ledger_file, excel_file=excel_file, folder_GEE="users/fake/masks",
+                                 nb_task_max=nb_task_max, max_workers=max_workers,
+                                 backend=backend, group_days=group_days,
+                                 queue_ordering="tile", silent=True)
+        elapsed = time.time() - start
+
+        ledger = JobLedger(ledger_file)
+        states = {state: ledger.count([state]) for state in ["COMPLETED", "FAILED", "Out of area"]}
+        ledger.close()
+
+    results = {
+        "nb_images": nb_images,
+        "nb_task_max": nb_task_max,
+        "max_workers": max_workers,
+        "group_days": group_days,
+        "latency": latency,
+        "elapsed": elapsed,
+        "images_per_second": nb_images / elapsed,
+        "states": states,
+        "requests": dict(backend.requests),
+    }
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(json.dumps(run_load_test(nb_images=nb_images), indent=4))
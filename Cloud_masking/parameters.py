@@ -12,13 +12,47 @@
 #       - COEF_NORMALISATION                    #
 #       - NUMBER_TREES                          #
 #       - CUTTOF                                #
+#       - METHODS_NAME                          #
+#       - TRAINING_DATA                         #
+#       - CLASSIFIER_FILE                       #
+#       - CLASSIFIER_ASSET                      #
+#       - OUTPUT_MODE                           #
+#       - PROBABILITY_SCALE                     #
 #       - PARAMS_CLOUDCLUSTERSCORE_DEFAULT      #
 #       - PARAMS_SELECTBACKGROUND_DEFAULT       #
+#       - COMBINED_BACKGROUND                   #
 #       - NUMBER_HOURS                          #
 #       - COMMON_AREA                           #
+#       - USE_SCENE_INDEX                       #
+#       - CANDIDATE_CACHE_FILE                  #
+#       - CANDIDATE_CACHE_PRECISION             #
 #       - folder_GEE                            #
 #       - nb_task_max                           #
+#       - POLL_INTERVAL_MIN                     #
+#       - POLL_INTERVAL_MAX                     #
+#       - TASK_UNSEEN_CYCLES                    #
+#       - SUBMISSION_WORKERS                    #
+#       - SUBMISSION_RATE                       #
+#       - PREFILTER_PAGE_SIZE                   #
+#       - USE_LAND_INDEX                        #
+#       - LAND_CACHE_DIR                        #
+#       - LAND_INSIDE_MARGIN                    #
+#       - LAND_VERSION                          #
+#       - QUEUE_ORDERING                        #
+#       - SHARD_POLICY                          #
+#       - SHARD_NUMBER                          #
+#       - SHARD_ROOTS                           #
+#       - EXPORT_DATA_TYPE                      #
+#       - EXPORT_PACK_METHODS                   #
+#       - EXPORT_PYRAMIDING                     #
+#       - EXPORT_GROUP_DAYS                     #
+#       - EXPORT_GROUP_MAX                      #
+#       - REPROCESS_STALE                       #
 #       - excel_file                            #
+#       - ledger_file                           #
+#       - LOCAL_BLOCK_SIZE                      #
+#       - LOCAL_SEED                            #
+#       - LOCAL_SCRATCH_DIR                     #
 #       - SENTINEL2_BANDNAMES                   #
 #       - LOG_FILE                              #
 #################################################
@@ -75,6 +109,32 @@ COEF_NORMALISATION: int = 10000
 NUMBER_TREES: int = 500
 # random forest model cuttof
 CUTTOF: int = 0.29
+# Methods used for prediction (features of the random forest)
+METHODS_NAME: list = ['percentile1', 'percentile5', 'tree2', 'tree3']
+# Training data: GEE featureCollection id or csv file
+# (columns: METHODS_NAME + "cloud")
+TRAINING_DATA: str = 'ft:1XzZPz8HZMARKQ9OPTWvfuRkPaGIASzkRYMfhKT8H'
+# Random forest trained locally (json file created by running
+# 'Cloud_masking/Utils/utils_classifier.py'). The trees are sent to GEE
+# (no training on GEE side for each image).
+# Set to None to train the forest on GEE side
+CLASSIFIER_FILE = None
+# Classifier asset: without CLASSIFIER_FILE, the forest is trained once on GEE
+# side and stored in "<CLASSIFIER_ASSET>_<NUMBER_TREES>_<training hash>" (export
+# task run at the first use), then loaded by every image. The training hash covers the
+# TRAINING_DATA path, its last update time and METHODS_NAME. Set to None to train the forest in the
+# graph of each image (trained again by each export task)
+CLASSIFIER_ASSET = "users/ab43536/cloud_masking_random_forest"
+# Output of the model:
+#   - "mask": binary mask, class voted by the majority of the trees
+#     (CUTTOF has no effect: it is applied to the 0 / 1 class)
+#   - "probability": fraction of the trees voting "cloud", quantised to uint8
+#     (band "probability"). Any cutoff can then be applied without recomputing
+#     the mask (see "Utils/utils_probability.py")
+OUTPUT_MODE: str = "mask"
+# Probability quantisation: value = round(probability * PROBABILITY_SCALE)
+# (values above are free for the local no data value, 255)
+PROBABILITY_SCALE: int = 250
 
 
 #########################
@@ -111,6 +171,13 @@ PARAMS_CLOUDCLUSTERSCORE_DEFAULT: dict = {
     "tileScale": 2,
 }
 
+# One background pipeline for the percentile 1 and 5 methods: the union of the
+# candidates is reduced once (both medians), the differences are sampled once
+# and normalised with shared statistics, one opening for the 2 masks
+# Disabled by default: the shared statistics change the GEE masks, to be
+# validated against the separate chains on GEE before being enabled
+COMBINED_BACKGROUND = False
+
 
 # Filter date from same date e.g. remove dates between image date + or - n hours
 # allowed images | -18h prohibited | IMAGE | 18h prohibited | allowed images
@@ -122,6 +189,23 @@ NUMBER_HOURS: int = 18
 # (avoid having area with no data)
 COMMON_AREA: int = 0.95
 
+# Select the background images with a local index of the scene metadata
+# (date, cloudy percentage, footprint: one request per MGRS tile and per run,
+# see "Utils/utils_scene_index.py"). The GEE graph receives fixed lists of
+# images instead of filtering and sorting the Sentinel 2 collection for each image
+# Disabled by default: the common area is computed locally with a planar overlap
+# (longitude / latitude degrees, straight edges) while GEE uses a geodesic one.
+# The ratios differ slightly: near COMMON_AREA, the backgrounds selected (and the
+# masks) may differ from the GEE selection
+USE_SCENE_INDEX = False
+
+# Cache of the background candidate statistics (common area, ratio of valid
+# pixels), key: scene id + hash of the region of interest
+# (see "Utils/utils_candidate_cache.py"). None: in memory (current run only)
+CANDIDATE_CACHE_FILE = "Cloud_masking/Data/candidate_stats.db"
+# Number of decimals of the footprint coordinates kept in the region hash
+CANDIDATE_CACHE_PRECISION = 3
+
 
 #########################################
 #            Exportation                #
@@ -130,6 +214,47 @@ COMMON_AREA: int = 0.95
 # The images contained in this folder are ignored (not processed again)
 folder_GEE = 'users/ab43536/mask_friday'
 
+# Spread the masks over several imageCollections (GEE assets limits)
+#   - "single": all the masks in folder_GEE
+#   - "hash": SHARD_NUMBER folders "folder_GEE_00", "folder_GEE_01"... (hash of the image name)
+#   - "tile": one folder per MGRS tile "folder_GEE_T30UVE"...
+#   - "month": one folder per acquisition month "folder_GEE_201801"...
+# SHARD_ROOTS: list of GEE roots the folders are spread over (other users or
+# cloud projects the account can write to), None: root of folder_GEE
+# The images of all the folders are ignored (not processed again)
+SHARD_POLICY = "single"
+SHARD_NUMBER = 4
+SHARD_ROOTS = None
+
+# Encoding of the exported masks (asset storage quota + export time)
+#   - EXPORT_DATA_TYPE: "byte" (uint8) or None (GEE default type)
+#   - EXPORT_PACK_METHODS: if True, the mask and the four methods (tree3, tree2,
+#     percentile1, percentile5) are stored as bits of one uint8 band "packed"
+#     (see "Utils/utils_encoding.py"). Only with OUTPUT_MODE = "mask"
+#   - EXPORT_PYRAMIDING: pyramiding policy of the assets: "mode" or "sample"
+#     for masks / packed bits ("mean" averages the classes), "mean" for probabilities.
+#     None: derived from OUTPUT_MODE ("mode" for "mask", "mean" for "probability")
+EXPORT_DATA_TYPE = "byte"
+EXPORT_PACK_METHODS = False
+EXPORT_PYRAMIDING = None
+
+# Multi-scene exports (GEE limits: number of tasks and assets)
+# The scenes sharing a MGRS tile and a window of EXPORT_GROUP_DAYS days are
+# exported in one task / one asset (one band per scene, at most EXPORT_GROUP_MAX
+# scenes). The band to scene index is stored in the asset property "scenes".
+# Read them with "Interpolation/load_dataset.py" (loadMaskCollection).
+# Works best with QUEUE_ORDERING = "tile". None: one asset per scene
+EXPORT_GROUP_DAYS = None
+EXPORT_GROUP_MAX = 16
+
+# Each asset is stamped with a fingerprint of the model version and of the
+# parameters above changing the masks (property "fingerprint", see
+# "Utils/utils_fingerprint.py"). If True, the assets with another fingerprint
+# (older configuration, or no fingerprint) are DELETED and their images
+# processed again. A group asset is only replaced if all its images are in the
+# date range. False: any existing asset is kept
+REPROCESS_STALE = False
+
 # Number of GEE tasks running at the same time
 # GEE restriction: must be below 3000
 # Providing a high number is adding task in pending list
@@ -137,8 +262,63 @@ folder_GEE = 'users/ab43536/mask_friday'
 # The actual number of task processing at the same time is below 10
 nb_task_max = 30
 
-# Excel file create during the export process
+# Time between two updates of the task list (seconds)
+# The interval is adapted to the free slots and the rate of completed tasks:
+#   - short (POLL_INTERVAL_MIN) when slots are free
+#   - growing up to POLL_INTERVAL_MAX when the queue is full and no task ends
+POLL_INTERVAL_MIN = 5
+POLL_INTERVAL_MAX = 120
+
+# Number of polls a task can be missing from the task list (task pruned by GEE,
+# another account...) before being considered FAILED
+TASK_UNSEEN_CYCLES = 10
+
+# Number of images prepared and started at the same time (thread pool)
+# Each image requires several GEE requests (intersection, export start...)
+SUBMISSION_WORKERS = 8
+
+# Maximum number of images started per second (GEE rate limits),
+# below 1: one image every 1 / SUBMISSION_RATE seconds
+# Set to None for no limit
+SUBMISSION_RATE = 5
+
+# Number of images per request when checking the intersection
+# between the images and the land geometry (results cached in the ledger)
+PREFILTER_PAGE_SIZE = 500
+
+# Classify the image footprints against the land geometry locally
+# (shapely STRtree). The land polygons are downloaded once in LAND_CACHE_DIR.
+# The images fully inside land are not clipped (no-op on GEE side)
+USE_LAND_INDEX = True
+LAND_CACHE_DIR = "Cloud_masking/Data"
+
+# Safety margin of the "inside land" test of the land index (degrees): the footprint
+# must be inside the land shrunk by this margin to skip the clip. The local test is
+# planar (straight edges in degrees), GEE clips with geodesic edges: without margin,
+# a footprint close to the coast could skip the clip and keep pixels over the sea
+LAND_INSIDE_MARGIN = 0.01
+
+# Version of the land geometry clipping the masks (part of the model fingerprint):
+# hash of the asset path + last update time, set by the process at each run.
+# None: requested on GEE side when the first fingerprint is computed
+LAND_VERSION = None
+
+# Order of the images processed:
+#   - "date": acquisition date
+#   - "tile": MGRS tile then acquisition date (consecutive images share
+#             their background images)
+#   - "cost": estimated cost ('cost_function' of process_and_store_to_GEE, default:
+#             images fully inside land first, see Utils/utils_queue.py)
+QUEUE_ORDERING = "tile"
+
+# Ledger (SQLite database) updated during the export process
+# Stores the state of each image (task running, completed, out of area...)
 # This file is used to avoid process images already processed
+ledger_file = "Cloud_masking/current_status.db"
+
+# Excel file: human readable export of the ledger (written at the end
+# of the process or by running 'Cloud_masking/Utils/utils_ledger.py')
+# If this file exists and the ledger doesn't, it is imported in the ledger
 excel_file = "Cloud_masking/current_status.xlsx"
 
 # JSON file of already processed images
@@ -149,6 +329,19 @@ excel_file = "Cloud_masking/current_status.xlsx"
 #   - Must be set to None if ignored
 JSON_FILE = None #".\Cloud_masking\Data\Metadata_mask.json"
 
+#########################################
+#      Local engine (no GEE)            #
+#########################################
+# Size (pixels) of the square windows processed at once by the local
+# engine ("Local_methods"). Memory used ~ number_of_images * size^2 * 13 * 4 bytes
+LOCAL_BLOCK_SIZE: int = 256
+# Random seed of the local clustering (pixel sampling + k-means initialisation)
+LOCAL_SEED: int = 0
+# Folder of the intermediate full size arrays of the local engine (memory mapped
+# temporary files, deleted after use). None: intermediate arrays kept in memory
+# (3 bytes / pixel / background method, ~700 MB for a full Sentinel 2 granule)
+LOCAL_SCRATCH_DIR = None
+
 #########################################
 #               Others                  #
 #########################################
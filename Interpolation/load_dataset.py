@@ -2,9 +2,20 @@
 #                           LOAD DATASET                             #
 #  These functions are looking at the mask available in GEE          #
 #  and return the matching mask or sentinel images                   #
+#  The grouped assets (several scenes in one asset, one band per     #
+#  scene, see "Cloud_masking/Utils/utils_grouping.py") are unpacked  #
+#  to one image per scene (unpackMaskCollection)                     #
+#  The values are decoded according to the encoding of each asset    #
+#  (binary mask, packed methods or probability, see                  #
+#  "Cloud_masking/Utils/utils_encoding.py"): decodeMask              #
 ######################################################################
 
 import ee
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Cloud_masking', 'Utils'))
+
+from utils_encoding import ENCODINGS, unpackBand
 
 def build_sentinel_dataset(maskCollection, sentinel_coll_name):
     """ Build sentinel data collection where mask in
@@ -33,7 +44,82 @@ def build_sentinel_dataset(maskCollection, sentinel_coll_name):
     return ee.ImageCollection.fromImages(sentinel_collection)
 
 
-def loadMaskCollection(name, sentinel_name, roi=None, date_start=None, date_end=None):
+def unpackMaskCollection(coll):
+    """ Split the grouped assets in one image per scene
+        The scene of each band is read from the property "scenes" (comma separated names,
+        band order). The images without this property are kept as they are.
+    Arguments:
+        :param coll: mask collection (ee.ImageCollection)
+        :return: ee.ImageCollection, one image per scene (band "classification",
+                 "system:index" = scene name)
+    """
+    def unpack(img, list_):
+        img = ee.Image(img)
+
+        def split_group():
+            # Default value: the branch may be built for images without the property
+            scenes = ee.String(img.toDictionary().get('scenes', '')).split(',')
+            indexes = ee.List.sequence(0, scenes.size().subtract(1))
+            return indexes.map(lambda k: img.select([ee.Number(k).int()], ['classification'])
+                                            .set('system:index', scenes.get(k)))
+
+        images = ee.Algorithms.If(img.propertyNames().contains('scenes'),
+                                  split_group(),
+                                  ee.List([img]))
+        return ee.List(list_).cat(ee.List(images))
+
+    return ee.ImageCollection.fromImages(coll.iterate(unpack, []))
+
+
+def maskEncoding(mask):
+    """ Encoding of a mask asset (server side): property "encoding",
+        band name for the single image assets exported without this property
+    Arguments:
+        :param mask: ee.Image (mask asset)
+        :return: ee.String (see ENCODINGS)
+    """
+    mask = ee.Image(mask)
+    return ee.String(ee.Algorithms.If(mask.propertyNames().contains('encoding'),
+                                      mask.get('encoding'),
+                                      mask.bandNames().get(0)))
+
+
+def checkEncodings(coll):
+    """ Raise a ValueError if some assets of the collection have an unsupported encoding
+        (one request)
+    Arguments:
+        :param coll: mask collection (ee.ImageCollection)
+    """
+    encodings = coll.map(lambda mask: mask.set('encoding', maskEncoding(mask))) \
+                    .aggregate_array('encoding').distinct().getInfo()
+    unsupported = [encoding for encoding in encodings if encoding not in ENCODINGS]
+    if unsupported:
+        raise ValueError("Unsupported mask encodings {} (supported: {})".format(unsupported, list(ENCODINGS)))
+
+
+def decodeMask(mask, threshold=0.5):
+    """ Binary cloud mask of an asset (first band), according to its encoding
+    Arguments:
+        :param mask: ee.Image (mask asset, or one scene of a grouped asset)
+        :param threshold=0.5: cutoff on the fraction of the trees voting "cloud" (encoding
+                              "probability", 0.5: majority vote, same mask as the encoding "classification")
+        :return: ee.Image: 0 cloud free, 1 cloudy (band "classification")
+    """
+    mask = ee.Image(mask)
+    encoding = maskEncoding(mask)
+    band = mask.select([0])
+
+    # Default value: the branch may be built for images without the property
+    probability_scale = ee.Number(mask.toDictionary().get('probability_scale', 1))
+    decoded = ee.Algorithms.If(encoding.equals('packed'),
+                               unpackBand(band.rename('packed'), 'mask'),
+                               ee.Algorithms.If(encoding.equals('probability'),
+                                                band.gt(probability_scale.multiply(threshold)),
+                                                band))
+    return ee.Image(decoded).rename('classification').copyProperties(mask, mask.propertyNames())
+
+
+def loadMaskCollection(name, sentinel_name, roi=None, date_start=None, date_end=None, threshold=0.5):
     """ Retrieve the correct maskCollection with updated metadata 
     from sentinel collection
     Arguments:
@@ -42,12 +128,13 @@ def loadMaskCollection(name, sentinel_name, roi=None, date_start=None, date_end=
         :param roi: area of interest 
         :param date_start: first image date
         :param date_end: last image date
+        :param threshold=0.5: cutoff of the probability masks (see decodeMask)
         :return: List of all masks
         :return type: ee.ImageCollection()
     """
     def setMetaData(mask, sentinel_img):
-        # Inverse binary mask
-        mask = ee.Image(mask).Not()
+        # Inverse binary mask (decoded from the asset encoding)
+        mask = decodeMask(mask, threshold).Not()
 
         meta = ee.Dictionary({
             'system:footprint': sentinel_img.geometry(),
@@ -66,8 +153,10 @@ def loadMaskCollection(name, sentinel_name, roi=None, date_start=None, date_end=
                                          ee.List(list_).add(setMetaData(mask, sentinel_img.first()))))
         return list_
 
-    # Load mask and sentinel image collection
+    # Load mask and sentinel image collection (grouped assets unpacked)
     coll = ee.ImageCollection(name)
+    checkEncodings(coll)
+    coll = unpackMaskCollection(coll)
 
     # Filter and update metadata
     coll = ee.ImageCollection.fromImages(